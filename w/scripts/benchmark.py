@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+
+import datetime
+import json
+import os
+import pathlib
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import typing as t
+
+import click
+import tabulate
+
+from macos_installation.classes.data import KDFParameters
+from macos_installation.classes.session import KeySession
+from macos_installation.classes.zip import InMemoryZip
+from macos_installation.functions import archive, chunking, encryption, util
+
+# Named tree shapes, as (number of files, size of each file, files per directory)
+SHAPES: t.Final[t.Dict[str, t.Tuple[int, int, int]]] = {
+    "tiny": (10000, 1024, 100),
+    "mixed": (2000, 16 * 1024, 50),
+    "huge": (2, 64 * 1024 * 1024, 1),
+}
+SIZE_SUFFIXES: t.Final[t.Dict[str, int]] = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def parse_size(size: str) -> int:
+    """
+    The parse_size function parses a number of bytes, with an optional K, M, or G suffix.
+
+    :param size:str: Size to parse, e.g. '64K'
+    :return: The number of bytes
+    """
+    multiplier = SIZE_SUFFIXES.get(size[-1:].upper(), 1)
+    return int(size[:-1] if multiplier > 1 else size) * multiplier
+
+
+def parse_shape(shape: str) -> t.Tuple[int, int, int]:
+    """
+    The parse_shape function returns the number of files, file size, and files per
+    directory of a tree shape: either a name in 'SHAPES', or 'FILES:SIZE[:PER_DIR]'.
+
+    :param shape:str: Name or specification of the shape
+    :return: A tuple of the number of files, file size, and files per directory
+    """
+    if shape in SHAPES:
+        return SHAPES[shape]
+
+    try:
+        files, size, *per_dir = shape.split(":")
+        return int(files), parse_size(size), int(per_dir[0]) if per_dir else 100
+    except ValueError:
+        raise click.BadParameter(
+            f"'{shape}' is neither one of {list(SHAPES)} nor 'FILES:SIZE[:PER_DIR]'"
+        )
+
+
+def generate_tree(
+    root: pathlib.Path,
+    files: int,
+    file_size: int,
+    per_dir: int,
+    seed: int = 0,
+) -> int:
+    """
+    The generate_tree function creates a synthetic home directory: files spread over
+    nested directories, alternating between compressible text (like dotfiles and shell
+    history) and random data (like keys and compressed files). The same seed always
+    creates the same tree.
+
+    :param root:pathlib.Path: Directory to create the tree in
+    :param files:int: Number of files
+    :param file_size:int: Size of each file
+    :param per_dir:int: Number of files per directory
+    :param seed:int=0: Seed of the file contents
+    :return: The total size of the files
+    """
+    rng = random.Random(seed)
+    words = [
+        "".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 9)))
+        for _ in range(512)
+    ]
+    text = " ".join(rng.choices(words, k=file_size // 4 + 1)).encode()
+    text = (text * (file_size // len(text) + 1))[:file_size]
+
+    for index in range(files):
+        # Two levels of directories, e.g. 'd0003/d0001/f000312'
+        directory = root / f"d{index // per_dir // 16:04}" / f"d{index // per_dir:04}"
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"f{index:06}").write_bytes(
+            text if index % 2 else rng.randbytes(file_size)
+        )
+
+    return files * file_size
+
+
+def reset_peak_rss() -> t.NoReturn:
+    # Linux resets the peak RSS of a process (VmHWM) when '5' is written to clear_refs
+    try:
+        pathlib.Path("/proc/self/clear_refs").write_text("5")
+    except OSError:
+        pass
+
+
+def get_peak_rss() -> int:
+    """
+    The get_peak_rss function returns the peak resident set size of the process, in bytes,
+    since it was last reset (see 'reset_peak_rss').
+
+    :return: The peak RSS in bytes
+    """
+    try:
+        for line in pathlib.Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    # Peak over the whole lifetime of the process; kilobytes on Linux, bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def run_stages(
+    tree: pathlib.Path, work_dir: pathlib.Path, jobs: int, kdf: KDFParameters
+) -> t.Iterator[t.Tuple[str, float, int, int, int]]:
+    """
+    The run_stages function backs up a tree the way the backup command does, one stage at
+    a time, and yields the measurements of each stage: walk, hash, chunk (splitting the
+    files the way repository backups do), zip, kdf, encrypt, decrypt, and write.
+
+    :param tree:pathlib.Path: Tree to back up
+    :param work_dir:pathlib.Path: Directory for the spooled archive and the backup file
+    :param jobs:int: Number of threads hashing files, and processes compressing them
+    :param kdf:KDFParameters: Key derivation parameters
+    :return: An iterator of the stage name, seconds, bytes, files, and peak RSS in bytes
+    """
+
+    def measure(function: t.Callable[[], t.Any]) -> t.Tuple[float, t.Any]:
+        reset_peak_rss()
+        start_time = time.perf_counter()
+        result = function()
+        return time.perf_counter() - start_time, result
+
+    seconds, file_paths = measure(lambda: list(util.get_recursive_file_list([tree])))
+    tree_size = sum(file_path.stat().st_size for file_path in file_paths)
+    yield "walk", seconds, tree_size, len(file_paths), get_peak_rss()
+
+    seconds, _ = measure(lambda: util.get_file_sha256_hashes(file_paths, jobs=jobs))
+    yield "hash", seconds, tree_size, len(file_paths), get_peak_rss()
+
+    def chunk_files() -> None:
+        for file_path in file_paths:
+            with file_path.open("rb") as f:
+                for _ in chunking.iter_chunks(f):
+                    pass
+
+    seconds, _ = measure(chunk_files)
+    yield "chunk", seconds, tree_size, len(file_paths), get_peak_rss()
+
+    with InMemoryZip(spool_dir=work_dir) as zip_object:
+
+        def write_zip() -> None:
+            with zip_object.open_zip_file(mode="a") as zip_file:
+                for _ in archive.write_files_to_zip(
+                    zip_file,
+                    [(file_path, True) for file_path in file_paths],
+                    jobs=jobs,
+                    spool_dir=work_dir,
+                ):
+                    pass
+
+        seconds, _ = measure(write_zip)
+        yield "zip", seconds, tree_size, len(file_paths), get_peak_rss()
+
+        # The key is derived when the session first encrypts; empty data only costs the KDF
+        key_session = KeySession("benchmark", kdf)
+        seconds, _ = measure(lambda: encryption.encrypt_bytes(b"", key_session))
+        yield "kdf", seconds, 0, 0, get_peak_rss()
+
+        zip_object.zip_contents.seek(0, os.SEEK_END)
+        zip_size = zip_object.zip_contents.tell()
+        zip_object.zip_contents.seek(0)
+        with tempfile.TemporaryFile(dir=work_dir) as encrypted:
+            seconds, _ = measure(
+                lambda: encryption.encrypt_stream(
+                    zip_object.zip_contents, encrypted, key_session
+                ),
+            )
+            yield "encrypt", seconds, zip_size, len(file_paths), get_peak_rss()
+
+            encrypted.seek(0)
+            with open(os.devnull, "wb") as devnull:
+                seconds, _ = measure(
+                    lambda: encryption.decrypt_stream(encrypted, devnull, key_session),
+                )
+            yield "decrypt", seconds, zip_size, len(file_paths), get_peak_rss()
+
+        backup_path = work_dir / "backup.zip"
+        seconds, _ = measure(lambda: zip_object.write_to_file(backup_path))
+        yield "write", seconds, zip_size, len(file_paths), get_peak_rss()
+        backup_path.unlink()
+
+
+def benchmark_shape(
+    shape: str, work_dir: pathlib.Path, jobs: int, repeat: int, kdf: KDFParameters
+) -> t.Dict[str, t.Any]:
+    """
+    The benchmark_shape function generates a tree of the given shape and runs every stage
+    on it repeatedly. The fastest run of each stage is reported, with the highest peak RSS.
+
+    :param shape:str: Name or specification of the shape; see 'parse_shape'
+    :param work_dir:pathlib.Path: Directory to generate the tree in
+    :param jobs:int: Number of threads hashing files, and processes compressing them
+    :param repeat:int: Number of runs of each stage
+    :param kdf:KDFParameters: Key derivation parameters
+    :return: The results of the shape
+    """
+    files, file_size, per_dir = parse_shape(shape)
+    tree = work_dir / "home"
+    tree_size = generate_tree(tree, files, file_size, per_dir)
+
+    stages: t.Dict[str, t.Dict[str, t.Any]] = {}
+    for _ in range(repeat):
+        for stage, seconds, size, stage_files, peak_rss in run_stages(
+            tree, work_dir, jobs, kdf
+        ):
+            best = stages.setdefault(stage, {"seconds": seconds, "peak_rss": 0})
+            best["seconds"] = min(best["seconds"], seconds)
+            best["peak_rss"] = max(best["peak_rss"], peak_rss)
+            best["bytes"], best["files"] = size, stage_files
+
+    for best in stages.values():
+        seconds = best["seconds"] or sys.float_info.min
+        best["mb_per_s"] = round(best["bytes"] / 1024**2 / seconds, 3)
+        best["files_per_s"] = round(best["files"] / seconds, 3)
+        best["seconds"] = round(best["seconds"], 6)
+
+    return {
+        "shape": shape,
+        "files": files,
+        "file_size": file_size,
+        "files_per_dir": per_dir,
+        "tree_size": tree_size,
+        "stages": stages,
+    }
+
+
+def print_results(
+    results: t.List[t.Dict[str, t.Any]],
+    baseline: t.Optional[t.Dict[str, t.Any]] = None,
+) -> t.NoReturn:
+    """
+    The print_results function prints a table of the results to stderr, so the JSON on
+    stdout stays parseable. With a baseline, the change in throughput is included.
+
+    :param results:t.List[t.Dict[str, t.Any]]: Results of each shape
+    :param baseline:t.Optional[t.Dict[str, t.Any]]=None: Results of an earlier run
+    :return: None
+    """
+    baseline_stages = {
+        (result["shape"], stage): values
+        for result in (baseline or {}).get("results", [])
+        for stage, values in result["stages"].items()
+    }
+
+    table = []
+    for result in results:
+        for stage, values in result["stages"].items():
+            row = [
+                result["shape"],
+                stage,
+                f"{values['seconds']:.4f}",
+                f"{values['mb_per_s']:.1f}",
+                f"{values['files_per_s']:.1f}",
+                f"{values['peak_rss'] / 1024 ** 2:.1f}",
+            ]
+            if baseline is not None:
+                previous = baseline_stages.get((result["shape"], stage))
+                row.append(
+                    f"{values['seconds'] and previous['seconds'] / values['seconds']:.2f}x"
+                    if previous
+                    else "N/A"
+                )
+            table.append(row)
+
+    headers = ["Shape", "Stage", "Seconds", "MB/s", "Files/s", "Peak RSS (MiB)"]
+    if baseline is not None:
+        headers.append("Speedup")
+    click.echo(
+        tabulate.tabulate(table, headers, tablefmt="github", disable_numparse=True),
+        err=True,
+    )
+
+
+@click.command("benchmark")
+@click.option(
+    "-s",
+    "--shape",
+    default=list(SHAPES),
+    help=f"Tree shape; one of {list(SHAPES)}, or 'FILES:SIZE[:PER_DIR]'; multiple allowed",
+    multiple=True,
+    show_default=True,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    default=1,
+    help="Number of threads hashing files, and processes compressing them",
+    type=click.IntRange(min=1),
+    show_default=True,
+)
+@click.option(
+    "-r",
+    "--repeat",
+    default=3,
+    help="Number of runs of each stage; the fastest is reported",
+    type=click.IntRange(min=1),
+    show_default=True,
+)
+@click.option(
+    "--kdf-n",
+    default=2**14,
+    help="scrypt cost parameter N of the 'kdf' stage",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "-o",
+    "--output",
+    help="File to write the JSON results to; defaults to stdout",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+)
+@click.option(
+    "--compare",
+    help="JSON results of an earlier run, to compare against",
+    type=click.Path(exists=True, dir_okay=False, path_type=pathlib.Path),
+)
+def benchmark(
+    shape: t.Tuple[str, ...],
+    jobs: int,
+    repeat: int,
+    kdf_n: int,
+    output: t.Optional[pathlib.Path],
+    compare: t.Optional[pathlib.Path],
+) -> t.NoReturn:
+    """
+    Benchmark walking, hashing, chunking, zipping, encrypting and writing synthetic home
+    directories.
+    """
+    kdf = KDFParameters(n=kdf_n)
+    for s in shape:
+        parse_shape(s)
+
+    results = []
+    for s in shape:
+        with tempfile.TemporaryDirectory() as work_dir:
+            click.echo(f"Benchmarking shape '{s}'...", err=True)
+            results.append(
+                benchmark_shape(s, pathlib.Path(work_dir), jobs, repeat, kdf)
+            )
+
+    report = {
+        "metadata": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "jobs": jobs,
+            "repeat": repeat,
+            "kdf": kdf.dict(),
+        },
+        "results": results,
+    }
+
+    baseline = json.loads(compare.read_text()) if compare else None
+    print_results(results, baseline)
+
+    contents = json.dumps(report, indent=2, sort_keys=True)
+    if output:
+        output.write_text(f"{contents}\n")
+    else:
+        click.echo(contents)
+
+
+if __name__ == "__main__":
+    benchmark()
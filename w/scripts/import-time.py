@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import typing as t
+
+import click
+import tabulate
+
+# Module imported by the 'macos-install' entry point
+ENTRY_POINT_MODULE: t.Final[str] = "macos_installation.main"
+
+
+def measure_import_time(module: str) -> t.Dict[str, t.Tuple[int, int]]:
+    """
+    The measure_import_time function imports a module in a new interpreter, with
+    'python -X importtime', and parses the time spent importing each module.
+
+    :param module:str: Module to import
+    :return: A dictionary of module names to their own and cumulative import time, in microseconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        check=True,
+        text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        # e.g. 'import time:       209 |        209 |   macos_installation'
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative_time, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_time), int(cumulative_time))
+
+    return times
+
+
+@click.command("import-time")
+@click.option(
+    "-r",
+    "--repeat",
+    default=10,
+    help="Number of interpreters started; the median is reported",
+    type=click.IntRange(min=1),
+    show_default=True,
+)
+@click.option(
+    "-b",
+    "--budget",
+    default=130.0,
+    help="Maximum median import time of the entry point, in milliseconds",
+    type=float,
+    show_default=True,
+)
+@click.option(
+    "-t",
+    "--top",
+    default=15,
+    help="Number of slowest modules printed",
+    type=click.IntRange(min=0),
+    show_default=True,
+)
+@click.option(
+    "-o",
+    "--output",
+    help="File to write the JSON results to",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+)
+def import_time(
+    repeat: int, budget: float, top: int, output: t.Optional[pathlib.Path]
+) -> t.NoReturn:
+    """
+    Measure how long importing the CLI entry point takes, and fail if it exceeds a budget.
+    """
+    runs = [measure_import_time(ENTRY_POINT_MODULE) for _ in range(repeat)]
+
+    # Modules sorted by their median cumulative import time
+    modules = {
+        name: (
+            statistics.median(run[name][0] for run in runs if name in run),
+            statistics.median(run[name][1] for run in runs if name in run),
+        )
+        for name in runs[0]
+    }
+    slowest = sorted(modules.items(), key=lambda m: m[1][1], reverse=True)[:top]
+    headers = ["Module", "Self (ms)", "Cumulative (ms)"]
+    table = [[name, f"{s / 1000:.1f}", f"{c / 1000:.1f}"] for name, (s, c) in slowest]
+    click.echo(tabulate.tabulate(table, headers, tablefmt="github"))
+
+    total = modules[ENTRY_POINT_MODULE][1] / 1000
+    if output:
+        report = {
+            "module": ENTRY_POINT_MODULE,
+            "repeat": repeat,
+            "budget_ms": budget,
+            "total_ms": total,
+            "modules": {
+                name: {"self_ms": s / 1000, "cumulative_ms": c / 1000}
+                for name, (s, c) in modules.items()
+            },
+        }
+        output.write_text(json.dumps(report, indent=2, sort_keys=True))
+
+    if total > budget:
+        click.secho(
+            f"Importing '{ENTRY_POINT_MODULE}' took {total:.1f} ms, "
+            f"over the budget of {budget:.1f} ms!",
+            fg="red",
+        )
+        sys.exit(1)
+
+    click.secho(
+        f"Importing '{ENTRY_POINT_MODULE}' took {total:.1f} ms "
+        f"(budget: {budget:.1f} ms)",
+        fg="green",
+    )
+
+
+if __name__ == "__main__":
+    import_time()
@@ -0,0 +1,159 @@
+import logging
+import os
+import pathlib
+import sqlite3
+import typing as t
+
+from macos_installation.functions import util
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class HashCache(object):
+    """
+    Persistent cache of file digests, stored in an SQLite database. A cached digest is only
+    used while the file's stat tuple (device, inode, size, mtime_ns) is unchanged, so files
+    which have not been modified since the last run do not need to be read and hashed again.
+    """
+
+    SCHEMA: t.ClassVar[str] = (
+        "CREATE TABLE IF NOT EXISTS file_digests ("
+        "path TEXT PRIMARY KEY, "
+        "device INTEGER NOT NULL, "
+        "inode INTEGER NOT NULL, "
+        "size INTEGER NOT NULL, "
+        "mtime_ns INTEGER NOT NULL, "
+        "digest TEXT NOT NULL"
+        ")"
+    )
+
+    def __init__(self, path: pathlib.Path):
+        # Inputs
+        self.path = path
+
+        # Hit / miss counters, reported in debug output
+        self.hits: int = 0
+        self.misses: int = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.__connection = sqlite3.connect(str(self.path))
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+        self.__connection.execute(self.SCHEMA)
+
+        logger.debug(f"Class 'HashCache' instantiated: {self}")
+
+    def __repr__(self):
+        return f"HashCache(path={self.path}, hits={self.hits}, misses={self.misses})"
+
+    def __enter__(self) -> "HashCache":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    @staticmethod
+    def stat_key(stat_result: os.stat_result) -> t.Tuple[int, int, int, int]:
+        return (
+            stat_result.st_dev,
+            stat_result.st_ino,
+            stat_result.st_size,
+            stat_result.st_mtime_ns,
+        )
+
+    def get(self, path: pathlib.Path, stat_result: os.stat_result) -> t.Optional[str]:
+        """
+        The get function returns the cached digest of a file, or None if the file is not
+        cached or its stat tuple changed since the digest was stored.
+
+        :param self: Access the attributes of the class
+        :param path:pathlib.Path: Path of the file
+        :param stat_result:os.stat_result: Current stat of the file
+        :return: The cached digest, or None
+        """
+        row = self.__connection.execute(
+            "SELECT digest FROM file_digests "
+            "WHERE path = ? AND device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+            (str(path), *self.stat_key(stat_result)),
+        ).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return row[0]
+
+    def set_many(
+        self, entries: t.Iterable[t.Tuple[pathlib.Path, os.stat_result, str]]
+    ) -> t.NoReturn:
+        """
+        The set_many function stores the digests of files, together with the stat tuples
+        the files had before they were read.
+
+        :param self: Access the attributes of the class
+        :param entries:t.Iterable[t.Tuple[pathlib.Path, os.stat_result, str]]: Path, stat, and digest of each file
+        :return: None
+        """
+        with self.__connection:
+            self.__connection.executemany(
+                "INSERT OR REPLACE INTO file_digests "
+                "(path, device, inode, size, mtime_ns, digest) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (str(path), *self.stat_key(stat_result), digest)
+                    for path, stat_result, digest in entries
+                ),
+            )
+
+    def get_file_sha256_hashes(
+        self,
+        file_paths: t.Iterable[pathlib.Path],
+        jobs: t.Optional[int] = None,
+    ) -> t.Dict[pathlib.Path, str]:
+        """
+        The get_file_sha256_hashes function returns the digests of the given files. Digests of
+        unchanged files come from the cache; only the remaining files are hashed (concurrently,
+        see 'util.get_file_sha256_hashes'), and their digests are stored for the next run.
+
+        :param self: Access the attributes of the class
+        :param file_paths:t.Iterable[pathlib.Path]: Files to hash
+        :param jobs:t.Optional[int]=None: Number of threads used to hash files
+        :return: A dictionary of file paths to their sha256 hashes, in the order they were given
+        """
+        digests: t.Dict[pathlib.Path, t.Optional[str]] = {}
+        stat_results: t.Dict[pathlib.Path, os.stat_result] = {}
+
+        for file_path in file_paths:
+            stat_results[file_path] = file_path.stat()
+            digests[file_path] = self.get(file_path, stat_results[file_path])
+
+        missing = [p for p, digest in digests.items() if digest is None]
+        computed = util.get_file_sha256_hashes(missing, jobs=jobs)
+        digests.update(computed)
+        self.set_many((p, stat_results[p], digest) for p, digest in computed.items())
+
+        return digests
+
+    def evict_missing(self) -> int:
+        """
+        The evict_missing function removes cached digests of files which no longer exist.
+
+        :param self: Access the attributes of the class
+        :return: The number of evicted entries
+        """
+        missing = [
+            (path,)
+            for (path,) in self.__connection.execute("SELECT path FROM file_digests")
+            if not os.path.lexists(path)
+        ]
+        with self.__connection:
+            self.__connection.executemany(
+                "DELETE FROM file_digests WHERE path = ?", missing
+            )
+
+        return len(missing)
+
+    def close(self) -> t.NoReturn:
+        logger.debug(f"Hash cache statistics: {self.hits} hits, {self.misses} misses")
+        self.__connection.close()
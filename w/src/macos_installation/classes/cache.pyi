@@ -0,0 +1,28 @@
+import logging
+import os
+import pathlib
+import typing as t
+
+logger: logging.Logger
+
+class HashCache:
+    SCHEMA: t.ClassVar[str]
+    path: pathlib.Path
+    hits: int
+    misses: int
+    def __init__(self, path: pathlib.Path) -> None: ...
+    def __enter__(self) -> HashCache: ...
+    def __exit__(self, *args) -> None: ...
+    @staticmethod
+    def stat_key(stat_result: os.stat_result) -> t.Tuple[int, int, int, int]: ...
+    def get(
+        self, path: pathlib.Path, stat_result: os.stat_result
+    ) -> t.Optional[str]: ...
+    def set_many(
+        self, entries: t.Iterable[t.Tuple[pathlib.Path, os.stat_result, str]]
+    ) -> t.NoReturn: ...
+    def get_file_sha256_hashes(
+        self, file_paths: t.Iterable[pathlib.Path], jobs: t.Optional[int] = ...
+    ) -> t.Dict[pathlib.Path, str]: ...
+    def evict_missing(self) -> int: ...
+    def close(self) -> t.NoReturn: ...
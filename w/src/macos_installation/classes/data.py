@@ -1,49 +1,324 @@
 import dataclasses
+import hashlib
+import json
 import logging
+import os
 import pathlib
+import struct
 import typing as t
+import zipfile
 from pprint import pformat
 
 from macos_installation import config
+from macos_installation.classes.cache import HashCache
+from macos_installation.classes.profiler import PROFILER
 from macos_installation.functions import util
 
 logger: logging.Logger = logging.getLogger(__name__)
 
 
+@dataclasses.dataclass(frozen=True)
+class KDFParameters:
+    name: str = dataclasses.field(default="scrypt")
+    n: int = dataclasses.field(default=2**20)
+    r: int = dataclasses.field(default=8)
+    p: int = dataclasses.field(default=1)
+
+    SUPPORTED_NAMES: t.ClassVar[t.Tuple[str, ...]] = ("scrypt",)
+
+    def __post_init__(self):
+        if self.name not in self.SUPPORTED_NAMES:
+            raise ValueError(f"Unsupported key derivation function: {self.name}")
+        if self.n < 2 or self.n & (self.n - 1):
+            raise ValueError(f"scrypt cost parameter N must be a power of 2: {self.n}")
+        if self.r < 1 or self.p < 1:
+            raise ValueError(f"scrypt parameters r and p must be positive: {self}")
+
+    @property
+    def memory_cost(self) -> int:
+        """
+        The memory_cost property returns the approximate number of bytes scrypt
+        allocates when deriving a key with these parameters.
+        """
+        return 128 * self.n * self.r
+
+    def dict(self) -> t.Dict[str, t.Any]:
+        return dataclasses.asdict(self)
+
+
 @dataclasses.dataclass
-class EncryptedData:
-    encrypted_data: bytes
-    salt_size: int = dataclasses.field(default=32)
-    nonce_size: int = dataclasses.field(default=16)
-    tag_size: int = dataclasses.field(default=16)
+class EncryptionHeader:
+    salt: bytes
+    nonce: bytes
+    segment_size: int = dataclasses.field(default=config.ENCRYPTION_SEGMENT_SIZE)
+    kdf: KDFParameters = dataclasses.field(default_factory=KDFParameters)
+    # Value derived from the key, so a wrong password is detected before any segment
+    # is decrypted; missing from headers written before it was added
+    key_check: t.Optional[bytes] = dataclasses.field(default=None, repr=False)
+    version: int = dataclasses.field(default=1)
 
-    # Initialized later
-    salt: bytes = dataclasses.field(init=False)
-    nonce: bytes = dataclasses.field(init=False)
-    raw_data: bytes = dataclasses.field(init=False)
-    tag: bytes = dataclasses.field(init=False)
+    # Fixed framing in front of the JSON header body
+    MAGIC: t.ClassVar[bytes] = b"MACOSENC"
+    PREFIX: t.ClassVar[struct.Struct] = struct.Struct(">8sBI")
+    MAX_BODY_SIZE: t.ClassVar[int] = 64 * 1024
+    SUPPORTED_VERSIONS: t.ClassVar[t.Tuple[int, ...]] = (1,)
+
+    # Serialized header; computed unless it was read from a stream
+    raw: bytes = dataclasses.field(default=b"", repr=False)
 
     def __post_init__(self):
-        self.salt: bytes = self.encrypted_data[: self.salt_size]
-        self.nonce: bytes = self.encrypted_data[
-            self.salt_size : (self.salt_size + self.nonce_size)
-        ]
-        self.raw_data: bytes = self.encrypted_data[
-            (self.salt_size + self.nonce_size) : -(self.tag_size)
-        ]
-        self.tag: bytes = self.encrypted_data[-(self.tag_size) :]
+        if not self.raw:
+            self.raw = self.to_bytes()
 
-        logger.debug(f"Class 'EncryptedData' instantiated: {pformat(self)}")
+        logger.debug(f"Class 'EncryptionHeader' instantiated: {pformat(self)}")
 
     def __repr__(self):
         return (
-            f"EncryptedData(encrypted_data_size={len(self.encrypted_data)}"
-            f", salt_size={self.salt_size}"
-            f", nonce_size={self.nonce_size}"
-            f", tag_size={self.tag_size}"
+            f"EncryptionHeader(version={self.version}"
+            f", segment_size={self.segment_size}"
+            f", kdf={self.kdf}"
+            f", header_size={len(self.raw)}"
             ")"
         )
 
+    def body(self) -> t.Dict[str, t.Any]:
+        body = {
+            "kdf": self.kdf.dict(),
+            "nonce": self.nonce.hex(),
+            "salt": self.salt.hex(),
+            "segment_size": self.segment_size,
+        }
+        if self.key_check is not None:
+            body["key_check"] = self.key_check.hex()
+        return body
+
+    def to_bytes(self) -> bytes:
+        """
+        The to_bytes function serializes the header into the bytes written in front of
+        the encrypted segments: the magic bytes, the format version, the length of the
+        JSON body, and the JSON body itself. These bytes are also used as the associated
+        data of every segment, so the header cannot be altered without detection.
+
+        :param self: Access the attributes of the class
+        :return: The serialized header
+        """
+        body = json.dumps(self.body(), sort_keys=True).encode(config.DEFAULT_ENCODING)
+        return self.PREFIX.pack(self.MAGIC, self.version, len(body)) + body
+
+    @classmethod
+    def from_stream(
+        cls, stream: t.IO[bytes], prefix: bytes = b""
+    ) -> "EncryptionHeader":
+        """
+        The from_stream function reads and parses a header from the current position
+        of the given stream, leaving the stream positioned at the first segment.
+
+        :param stream:t.IO[bytes]: Stream positioned at the start of the header
+        :param prefix:bytes=b"": Bytes of the header already consumed from the stream
+        :return: The parsed header
+        """
+        prefix += stream.read(cls.PREFIX.size - len(prefix))
+        if len(prefix) != cls.PREFIX.size:
+            raise ValueError("Encrypted data is too short to contain a header")
+
+        magic, version, body_size = cls.PREFIX.unpack(prefix)
+        if magic != cls.MAGIC:
+            raise ValueError("Encrypted data does not start with the expected magic")
+        if version not in cls.SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported encryption format version: {version}")
+        if body_size > cls.MAX_BODY_SIZE:
+            raise ValueError(f"Encryption header is too large: {body_size} bytes")
+
+        body = stream.read(body_size)
+        if len(body) != body_size:
+            raise ValueError("Encryption header is truncated")
+
+        try:
+            values = json.loads(body.decode(config.DEFAULT_ENCODING))
+            salt = bytes.fromhex(values["salt"])
+            nonce = bytes.fromhex(values["nonce"])
+            segment_size = int(values["segment_size"])
+            key_check = (
+                bytes.fromhex(values["key_check"]) if "key_check" in values else None
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            # Missing fields, or values of the wrong type
+            raise ValueError(f"Encryption header is invalid: {e!r}")
+        if segment_size <= 0:
+            raise ValueError("Encryption header has an invalid segment size")
+
+        try:
+            # Headers without KDF parameters were written with the defaults
+            kdf = KDFParameters(**values.get("kdf", {}))
+        except TypeError as e:
+            raise ValueError(f"Encryption header has invalid KDF parameters: {e}")
+
+        return cls(
+            salt=salt,
+            nonce=nonce,
+            segment_size=segment_size,
+            kdf=kdf,
+            key_check=key_check,
+            version=version,
+            raw=prefix + body,
+        )
+
+
+@dataclasses.dataclass
+class CompressedFile:
+    file_path: pathlib.Path
+    file_size: int
+    compress_size: int
+    crc: int
+    compress_type: int = dataclasses.field(default=zipfile.ZIP_DEFLATED)
+    seconds: float = dataclasses.field(default=0.0)
+    digest: t.Optional[str] = dataclasses.field(default=None)
+
+    # Compressed data; returned inline for small files, otherwise in a temporary file
+    data: t.Optional[bytes] = dataclasses.field(default=None, repr=False)
+    data_path: t.Optional[pathlib.Path] = dataclasses.field(default=None)
+
+
+@dataclasses.dataclass
+class CodecStatistics:
+    files: int = dataclasses.field(default=0)
+    file_size: int = dataclasses.field(default=0)
+    compress_size: int = dataclasses.field(default=0)
+    seconds: float = dataclasses.field(default=0.0)
+
+
+@dataclasses.dataclass
+class CompressionStatistics:
+    codecs: t.Dict[int, CodecStatistics] = dataclasses.field(default_factory=dict)
+
+    def record(
+        self, compress_type: int, file_size: int, compress_size: int, seconds: float
+    ) -> t.NoReturn:
+        codec = self.codecs.setdefault(compress_type, CodecStatistics())
+        codec.files += 1
+        codec.file_size += file_size
+        codec.compress_size += compress_size
+        codec.seconds += seconds
+
+    def seconds_saved(self, compress_type: int) -> t.Optional[float]:
+        """
+        The seconds_saved function estimates the time a compression method saved compared
+        to deflating the same files, using the throughput of the files which were deflated
+        (at the default level) in the same backup. Negative if the method was slower.
+
+        :param self: Access the attributes of the class
+        :param compress_type:int: Compression method
+        :return: The estimated seconds saved, or None if no files were deflated
+        """
+        deflate = self.codecs.get(zipfile.ZIP_DEFLATED)
+        if deflate is None or not deflate.seconds or not deflate.file_size:
+            return None
+
+        codec = self.codecs[compress_type]
+        deflate_seconds = codec.file_size * deflate.seconds / deflate.file_size
+        return deflate_seconds - codec.seconds
+
+
+@dataclasses.dataclass
+class LocationPlan:
+    location: pathlib.Path
+    files: int = dataclasses.field(default=0)
+    file_size: int = dataclasses.field(default=0)
+
+    # Bytes sampled from the location's files, and their size once compressed
+    sample_size: int = dataclasses.field(default=0)
+    sample_compress_size: int = dataclasses.field(default=0)
+
+    @property
+    def compress_ratio(self) -> float:
+        if not self.sample_size:
+            return 1.0
+        return self.sample_compress_size / self.sample_size
+
+    @property
+    def estimated_compress_size(self) -> int:
+        return round(self.file_size * self.compress_ratio)
+
+    def dict(self) -> t.Dict[str, t.Any]:
+        return {
+            "location": str(self.location),
+            "files": self.files,
+            "file_size": self.file_size,
+            "compress_ratio": round(self.compress_ratio, 4),
+            "estimated_compress_size": self.estimated_compress_size,
+        }
+
+
+@dataclasses.dataclass
+class BackupPlan:
+    destination: pathlib.Path
+    locations: t.List[LocationPlan] = dataclasses.field(default_factory=list)
+    largest_files: t.List[t.Tuple[str, int]] = dataclasses.field(default_factory=list)
+
+    # Throughput (bytes per second) measured while sampling the locations
+    hash_throughput: float = dataclasses.field(default=0.0)
+    compress_throughput: float = dataclasses.field(default=0.0)
+    jobs: int = dataclasses.field(default=1)
+
+    # Number of copies of the backup which exist at the destination at once while it is
+    # written (e.g. the spooled archive and the backup file), and the space available
+    copies: int = dataclasses.field(default=1)
+    free_space: t.Optional[int] = dataclasses.field(default=None)
+
+    @property
+    def files(self) -> int:
+        return sum(location.files for location in self.locations)
+
+    @property
+    def file_size(self) -> int:
+        return sum(location.file_size for location in self.locations)
+
+    @property
+    def estimated_compress_size(self) -> int:
+        return sum(location.estimated_compress_size for location in self.locations)
+
+    @property
+    def estimated_seconds(self) -> float:
+        """
+        Estimated time to hash and compress all files. Files are hashed from the same read
+        which compresses them, by one of the compressing processes.
+        """
+        seconds = 0.0
+        if self.hash_throughput:
+            seconds += self.file_size / self.hash_throughput
+        if self.compress_throughput:
+            seconds += self.file_size / self.compress_throughput
+        return seconds / self.jobs
+
+    @property
+    def required_space(self) -> int:
+        return self.estimated_compress_size * self.copies
+
+    @property
+    def has_enough_space(self) -> bool:
+        # Unknown free space is not reported as a problem
+        return self.free_space is None or self.free_space >= self.required_space
+
+    def dict(self) -> t.Dict[str, t.Any]:
+        return {
+            "destination": str(self.destination),
+            "files": self.files,
+            "file_size": self.file_size,
+            "estimated_compress_size": self.estimated_compress_size,
+            "estimated_seconds": round(self.estimated_seconds, 3),
+            "hash_throughput": round(self.hash_throughput),
+            "compress_throughput": round(self.compress_throughput),
+            "jobs": self.jobs,
+            "required_space": self.required_space,
+            "free_space": self.free_space,
+            "has_enough_space": self.has_enough_space,
+            "locations": [location.dict() for location in self.locations],
+            "largest_files": [
+                {"path": path, "file_size": file_size}
+                for path, file_size in self.largest_files
+            ],
+        }
+
 
 @dataclasses.dataclass
 class BackupManifest:
@@ -51,20 +326,60 @@ class BackupManifest:
     existing: bool = dataclasses.field(default=False)
     old_user: str = dataclasses.field(default=config.CURRENT_USER)
     old_user_home_dir: str = dataclasses.field(default=config.CURRENT_USER_HOME_DIR)
+    hash_files: bool = dataclasses.field(default=True)
+    hash_jobs: t.Optional[int] = dataclasses.field(default=config.HASH_JOBS)
+    hash_cache: t.Optional[HashCache] = dataclasses.field(default=None)
+    excludes: t.List[str] = dataclasses.field(
+        default_factory=lambda: list(config.BACKUP_EXCLUDES)
+    )
+    includes: t.List[str] = dataclasses.field(
+        default_factory=lambda: list(config.BACKUP_INCLUDES)
+    )
+    symlink_policy: str = dataclasses.field(default=config.SYMLINK_POLICY)
 
     # Initialized later
     all_backup_files: t.List[pathlib.Path] = None
     file_digests: t.Dict[str, str] = None
 
+    # Incremental backups only store files which were added or changed since their
+    # parent backup; 'file_digests' always describes the full state of the backup
+    parent_backup: t.Optional[str] = None
+    parent_manifest_digest: t.Optional[str] = None
+    stored_files: t.Optional[t.List[str]] = None
+    deleted_files: t.List[str] = dataclasses.field(default_factory=list)
+
+    # Size and mtime (in nanoseconds) of each file when it was backed up; restores skip
+    # files whose destination still matches. Older backups do not record them
+    file_stats: t.Dict[str, t.List[int]] = dataclasses.field(default_factory=dict)
+
+    MANIFEST_NAME: t.ClassVar[str] = "manifest.json"
+
     def __post_init__(self):
         if not self.existing:
-            self.all_backup_files = [
-                location
-                for location in util.get_recursive_file_list(self.backup_locations)
-            ]
-            self.file_digests = {
-                str(f): util.get_file_sha256_hash(f) for f in self.all_backup_files
-            }
+            with PROFILER.phase("walk") as phase:
+                self.all_backup_files = [
+                    location
+                    for location in util.get_recursive_file_list(
+                        self.backup_locations,
+                        excludes=self.excludes,
+                        includes=self.includes,
+                        symlink_policy=self.symlink_policy,
+                        base_dir=self.old_user_home_dir,
+                    )
+                ]
+                phase.files = len(self.all_backup_files)
+
+            # Digests may instead be recorded while the files are being archived
+            self.file_digests = {}
+            if self.hash_files:
+                with PROFILER.phase("hash") as phase:
+                    hashes = (
+                        self.hash_cache.get_file_sha256_hashes
+                        if self.hash_cache
+                        else util.get_file_sha256_hashes
+                    )(self.all_backup_files, jobs=self.hash_jobs)
+                    phase.files = len(hashes)
+                self.file_digests = {str(f): digest for f, digest in hashes.items()}
 
         logger.debug(f"Class 'BackupManifest' instantiated: {pformat(self)}")
 
@@ -72,12 +387,91 @@ class BackupManifest:
         return (
             f"BackupManifest(backup_locations={self.backup_locations}, "
             f"old_user={self.old_user}, "
-            f"old_user_home_dir={self.old_user_home_dir})"
+            f"old_user_home_dir={self.old_user_home_dir}, "
+            f"parent_backup={self.parent_backup})"
+        )
+
+    @classmethod
+    def from_zip_file(cls, zip_file: zipfile.ZipFile) -> t.Tuple["BackupManifest", str]:
+        """
+        The from_zip_file function reads the manifest of a backup.
+
+        :param zip_file:zipfile.ZipFile: Backup opened for reading
+        :return: A tuple of the manifest and the sha256 hash of its contents
+        """
+        contents = zip_file.read(cls.MANIFEST_NAME)
+        manifest = cls(
+            existing=True, **json.loads(contents.decode(config.DEFAULT_ENCODING))
+        )
+
+        return manifest, hashlib.sha256(contents).hexdigest()
+
+    @property
+    def is_incremental(self) -> bool:
+        return self.parent_backup is not None
+
+    def record_stat(
+        self, file_path: pathlib.Path, stat_result: os.stat_result
+    ) -> t.NoReturn:
+        """
+        The record_stat function records the size and mtime of a backed up file.
+
+        :param self: Access the attributes of the class
+        :param file_path:pathlib.Path: Path of the file
+        :param stat_result:os.stat_result: Stat of the file before it was read
+        :return: None
+        """
+        self.file_stats[str(file_path)] = [stat_result.st_size, stat_result.st_mtime_ns]
+
+    def files_stored(self) -> t.List[str]:
+        """
+        The files_stored function returns the files whose contents are stored in the backup
+        itself; for an incremental backup, the other files are stored in its parents.
+
+        :param self: Access the attributes of the class
+        :return: A list of file paths
+        """
+        if self.stored_files is None:
+            return list(self.file_digests)
+        return list(self.stored_files)
+
+    def parent_backup_path(self, backup_file: pathlib.Path) -> pathlib.Path:
+        """
+        The parent_backup_path function locates the parent of an incremental backup. The
+        parent is looked up where it was when the backup was made, and otherwise next to
+        the backup itself, so chains of backups can be moved together.
+
+        :param self: Access the attributes of the class
+        :param backup_file:pathlib.Path: Location of this backup
+        :return: The location of the parent backup
+        """
+        candidates = [
+            pathlib.Path(self.parent_backup),
+            backup_file.parent / pathlib.Path(self.parent_backup).name,
+        ]
+        for candidate in candidates:
+            if candidate.is_file():
+                return candidate
+
+        raise FileNotFoundError(
+            f"Parent backup '{self.parent_backup}' of '{backup_file}' was not found"
         )
 
     def dict(self):
+        # Runtime options are not part of the manifest; 'dataclasses.asdict' is
+        # avoided since it would deep-copy them (e.g. the hash cache connection)
+        excluded = [
+            "all_backup_files",
+            "excludes",
+            "existing",
+            "hash_cache",
+            "hash_files",
+            "hash_jobs",
+            "includes",
+            "symlink_policy",
+        ]
         return {
-            k: v
-            for k, v in dataclasses.asdict(self).items()
-            if k not in ["all_backup_files", "existing"]
+            f.name: getattr(self, f.name)
+            for f in dataclasses.fields(self)
+            if f.name not in excluded
         }
@@ -1,26 +1,164 @@
+import os
 import pathlib
+import struct
 import typing as t
+import zipfile
 
-class EncryptedData:
-    encrypted_data: bytes
-    salt_size: int
-    nonce_size: int
-    tag_size: int
+from macos_installation.classes.cache import HashCache  # type: ignore
+
+class KDFParameters:
+    name: str
+    n: int
+    r: int
+    p: int
+    SUPPORTED_NAMES: t.ClassVar[t.Tuple[str, ...]]
+    def __post_init__(self) -> None: ...
+    @property
+    def memory_cost(self) -> int: ...
+    def dict(self) -> t.Dict[str, t.Any]: ...
+    def __init__(self, name, n, r, p) -> None: ...
+
+class EncryptionHeader:
     salt: bytes
     nonce: bytes
-    raw_data: bytes
-    tag: bytes
+    segment_size: int
+    kdf: KDFParameters
+    key_check: t.Optional[bytes]
+    version: int
+    MAGIC: t.ClassVar[bytes]
+    PREFIX: t.ClassVar[struct.Struct]
+    MAX_BODY_SIZE: t.ClassVar[int]
+    SUPPORTED_VERSIONS: t.ClassVar[t.Tuple[int, ...]]
+    raw: bytes
     def __post_init__(self) -> None: ...
-    def __init__(self, encrypted_data, salt_size, nonce_size, tag_size) -> None: ...
+    def body(self) -> t.Dict[str, t.Any]: ...
+    def to_bytes(self) -> bytes: ...
+    @classmethod
+    def from_stream(
+        cls, stream: t.IO[bytes], prefix: bytes = ...
+    ) -> EncryptionHeader: ...
+    def __init__(
+        self, salt, nonce, segment_size, kdf, key_check, version, raw
+    ) -> None: ...
+
+class CompressedFile:
+    file_path: pathlib.Path
+    file_size: int
+    compress_size: int
+    crc: int
+    compress_type: int
+    seconds: float
+    digest: t.Optional[str]
+    data: t.Optional[bytes]
+    data_path: t.Optional[pathlib.Path]
+    def __init__(
+        self,
+        file_path,
+        file_size,
+        compress_size,
+        crc,
+        compress_type,
+        seconds,
+        digest,
+        data,
+        data_path,
+    ) -> None: ...
+
+class CodecStatistics:
+    files: int
+    file_size: int
+    compress_size: int
+    seconds: float
+    def __init__(self, files, file_size, compress_size, seconds) -> None: ...
+
+class CompressionStatistics:
+    codecs: t.Dict[int, CodecStatistics]
+    def record(
+        self, compress_type: int, file_size: int, compress_size: int, seconds: float
+    ) -> t.NoReturn: ...
+    def seconds_saved(self, compress_type: int) -> t.Optional[float]: ...
+    def __init__(self, codecs) -> None: ...
+
+class LocationPlan:
+    location: pathlib.Path
+    files: int
+    file_size: int
+    sample_size: int
+    sample_compress_size: int
+    @property
+    def compress_ratio(self) -> float: ...
+    @property
+    def estimated_compress_size(self) -> int: ...
+    def dict(self) -> t.Dict[str, t.Any]: ...
+    def __init__(
+        self, location, files, file_size, sample_size, sample_compress_size
+    ) -> None: ...
+
+class BackupPlan:
+    destination: pathlib.Path
+    locations: t.List[LocationPlan]
+    largest_files: t.List[t.Tuple[str, int]]
+    hash_throughput: float
+    compress_throughput: float
+    jobs: int
+    copies: int
+    free_space: t.Optional[int]
+    @property
+    def files(self) -> int: ...
+    @property
+    def file_size(self) -> int: ...
+    @property
+    def estimated_compress_size(self) -> int: ...
+    @property
+    def estimated_seconds(self) -> float: ...
+    @property
+    def required_space(self) -> int: ...
+    @property
+    def has_enough_space(self) -> bool: ...
+    def dict(self) -> t.Dict[str, t.Any]: ...
+    def __init__(
+        self,
+        destination,
+        locations,
+        largest_files,
+        hash_throughput,
+        compress_throughput,
+        jobs,
+        copies,
+        free_space,
+    ) -> None: ...
 
 class BackupManifest:
     backup_locations: t.List[t.Union[str, pathlib.Path]]
     existing: bool
     old_user: str
     old_user_home_dir: str
+    hash_files: bool
+    hash_jobs: t.Optional[int]
+    hash_cache: t.Optional[HashCache]
+    excludes: t.List[str]
+    includes: t.List[str]
+    symlink_policy: str
     all_backup_files: t.List[pathlib.Path]
     file_digests: t.Dict[str, str]
+    parent_backup: t.Optional[str]
+    parent_manifest_digest: t.Optional[str]
+    stored_files: t.Optional[t.List[str]]
+    deleted_files: t.List[str]
+    file_stats: t.Dict[str, t.List[int]]
+    MANIFEST_NAME: t.ClassVar[str]
     def __post_init__(self) -> None: ...
+    @classmethod
+    def from_zip_file(
+        cls, zip_file: zipfile.ZipFile
+    ) -> t.Tuple[BackupManifest, str]: ...
+    @property
+    def is_incremental(self) -> bool: ...
+    def record_stat(
+        self, file_path: pathlib.Path, stat_result: os.stat_result
+    ) -> t.NoReturn: ...
+    def files_stored(self) -> t.List[str]: ...
+    def parent_backup_path(self, backup_file: pathlib.Path) -> pathlib.Path: ...
     def dict(self): ...
     def __init__(
         self,
@@ -28,6 +166,17 @@ class BackupManifest:
         existing,
         old_user,
         old_user_home_dir,
+        hash_files,
+        hash_jobs,
+        hash_cache,
+        excludes,
+        includes,
+        symlink_policy,
         all_backup_files,
         file_digests,
+        parent_backup,
+        parent_manifest_digest,
+        stored_files,
+        deleted_files,
+        file_stats,
     ) -> None: ...
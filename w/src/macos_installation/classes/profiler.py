@@ -0,0 +1,178 @@
+import contextlib
+import cProfile
+import dataclasses
+import json
+import logging
+import os
+import pathlib
+import resource
+import sys
+import threading
+import time
+import typing as t
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def get_peak_rss() -> int:
+    """
+    The get_peak_rss function returns the peak resident set size of the process so far.
+
+    :return: The peak RSS in bytes
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+@dataclasses.dataclass
+class Phase:
+    name: str
+    start_ns: int
+    thread_id: int
+    end_ns: t.Optional[int] = dataclasses.field(default=None)
+
+    # Work done in the phase, counted by the code it times
+    bytes: int = dataclasses.field(default=0)
+    files: int = dataclasses.field(default=0)
+
+    # Peak RSS of the process when the phase ended; it only grows, so the phase it grew
+    # in is the phase which allocated the memory
+    peak_rss: int = dataclasses.field(default=0)
+
+    @property
+    def seconds(self) -> float:
+        return ((self.end_ns or time.perf_counter_ns()) - self.start_ns) / 1e9
+
+
+class Profiler(object):
+    """
+    Records how long each phase of a command takes, how many bytes and files it processed,
+    and the peak memory of the process. Phases are timed with the 'phase' context manager,
+    which does nothing unless the profiler is enabled; the results can be printed as a
+    summary table and exported as a Chrome trace (which speedscope also opens).
+    """
+
+    def __init__(self):
+        self.enabled: bool = False
+        self.phases: t.List[Phase] = []
+        self.start_ns: int = time.perf_counter_ns()
+        self.__lock = threading.Lock()
+        self.__cprofile: t.Optional[cProfile.Profile] = None
+
+    def __repr__(self):
+        return f"Profiler(enabled={self.enabled}, phases={len(self.phases)})"
+
+    def start(self, cprofile: bool = False) -> t.NoReturn:
+        """
+        The start function discards recorded phases and enables the profiler.
+
+        :param self: Access the attributes of the class
+        :param cprofile:bool=False: Also profile every function call of the main thread
+        :return: None
+        """
+        self.enabled = True
+        self.phases = []
+        self.start_ns = time.perf_counter_ns()
+        self.__cprofile = cProfile.Profile() if cprofile else None
+        if self.__cprofile is not None:
+            self.__cprofile.enable()
+
+    def stop(self) -> t.NoReturn:
+        self.enabled = False
+        if self.__cprofile is not None:
+            self.__cprofile.disable()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> t.Iterator[Phase]:
+        """
+        The phase function times the code it wraps as a phase of the command. The yielded
+        phase counts the bytes and files the code processed; when the profiler is disabled,
+        it is not recorded.
+
+        :param self: Access the attributes of the class
+        :param name:str: Name of the phase
+        :return: A context manager yielding the phase
+        """
+        phase = Phase(name, time.perf_counter_ns(), threading.get_ident())
+        try:
+            yield phase
+        finally:
+            if self.enabled:
+                phase.end_ns = time.perf_counter_ns()
+                phase.peak_rss = get_peak_rss()
+                with self.__lock:
+                    self.phases.append(phase)
+
+    def summary(self) -> t.List[t.List[t.Any]]:
+        """
+        The summary function sums the recorded phases by name, in the order they started.
+        Phases can be nested (e.g. key derivation happens within encryption), so the time
+        of a phase includes the time of the phases within it.
+
+        :param self: Access the attributes of the class
+        :return: Rows of the name, count, seconds, bytes, files, MB/s, and peak RSS in MiB
+        """
+        totals: t.Dict[str, t.List[t.Any]] = {}
+        for phase in sorted(self.phases, key=lambda p: p.start_ns):
+            row = totals.setdefault(phase.name, [phase.name, 0, 0.0, 0, 0, 0])
+            row[1] += 1
+            row[2] += phase.seconds
+            row[3] += phase.bytes
+            row[4] += phase.files
+            row[5] = max(row[5], phase.peak_rss)
+
+        return [
+            [
+                name,
+                count,
+                f"{seconds:.3f}",
+                size,
+                files,
+                f"{size / 1024 ** 2 / seconds:.1f}" if size and seconds else "N/A",
+                f"{peak_rss / 1024 ** 2:.1f}",
+            ]
+            for name, count, seconds, size, files, peak_rss in totals.values()
+        ]
+
+    def chrome_trace(self) -> t.Dict[str, t.Any]:
+        """
+        The chrome_trace function returns the recorded phases in the Chrome trace event
+        format, as complete events with microsecond timestamps.
+
+        :param self: Access the attributes of the class
+        :return: The trace, to be serialized as JSON
+        """
+        return {
+            "displayTimeUnit": "ms",
+            "traceEvents": [
+                {
+                    "name": phase.name,
+                    "cat": "phase",
+                    "ph": "X",
+                    "ts": (phase.start_ns - self.start_ns) / 1000,
+                    "dur": (phase.end_ns - phase.start_ns) / 1000,
+                    "pid": os.getpid(),
+                    "tid": phase.thread_id,
+                    "args": {
+                        "bytes": phase.bytes,
+                        "files": phase.files,
+                        "peak_rss": phase.peak_rss,
+                    },
+                }
+                for phase in self.phases
+            ],
+        }
+
+    def write_trace(self, path: pathlib.Path) -> t.NoReturn:
+        path.write_text(json.dumps(self.chrome_trace(), indent=2))
+        logger.debug(f"Wrote trace of {len(self.phases)} phases to '{path}'")
+
+    def write_cprofile(self, path: pathlib.Path) -> t.NoReturn:
+        if self.__cprofile is not None:
+            self.__cprofile.dump_stats(str(path))
+            logger.debug(f"Wrote cProfile statistics to '{path}'")
+
+
+# Profiler of the running command; enabled by the '--profile' option
+PROFILER: t.Final[Profiler] = Profiler()
@@ -0,0 +1,35 @@
+import contextlib
+import pathlib
+import typing as t
+
+def get_peak_rss() -> int: ...
+
+class Phase:
+    name: str
+    start_ns: int
+    thread_id: int
+    end_ns: t.Optional[int]
+    bytes: int
+    files: int
+    peak_rss: int
+    @property
+    def seconds(self) -> float: ...
+    def __init__(
+        self, name, start_ns, thread_id, end_ns, bytes, files, peak_rss
+    ) -> None: ...
+
+class Profiler:
+    enabled: bool
+    phases: t.List[Phase]
+    start_ns: int
+    def __init__(self) -> None: ...
+    def start(self, cprofile: bool = ...) -> t.NoReturn: ...
+    def stop(self) -> t.NoReturn: ...
+    @contextlib.contextmanager
+    def phase(self, name: str) -> t.Iterator[Phase]: ...
+    def summary(self) -> t.List[t.List[t.Any]]: ...
+    def chrome_trace(self) -> t.Dict[str, t.Any]: ...
+    def write_trace(self, path: pathlib.Path) -> t.NoReturn: ...
+    def write_cprofile(self, path: pathlib.Path) -> t.NoReturn: ...
+
+PROFILER: t.Final[Profiler]
@@ -0,0 +1,480 @@
+import contextlib
+import hashlib
+import hmac
+import json
+import logging
+import os
+import pathlib
+import sys
+import tempfile
+import typing as t
+import zlib
+
+import click
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from macos_installation import config
+from macos_installation.classes.data import KDFParameters
+from macos_installation.classes.session import KeySession
+from macos_installation.functions import chunking, encryption
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Reference to a chunk in a snapshot: the chunk ID and the chunk's (uncompressed) length
+ChunkReference = t.Tuple[str, int]
+
+
+class ChunkRepository(object):
+    """
+    Local directory which stores backups as deduplicated chunks. Files are split into
+    content-defined chunks (see 'chunking.iter_chunks'), and every unique chunk is stored
+    once, compressed and (if the repository has a password) encrypted, under its ID. A
+    backup is a snapshot: the backup manifest plus the list of chunks of every file.
+
+    Chunk IDs are the sha256 hash of the chunk, or, for encrypted repositories, an HMAC
+    keyed with a key derived from the password, so IDs do not reveal the chunk contents.
+    All chunks of an encrypted repository are encrypted under the repository's salt, so
+    opening it only requires a single key derivation.
+    """
+
+    VERSION: t.ClassVar[int] = 1
+    CONFIG_NAME: t.ClassVar[str] = "repository.json"
+    LOCK_NAME: t.ClassVar[str] = "lock"
+    TEMP_PREFIX: t.ClassVar[str] = ".tmp-"
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        password: t.Optional[str] = None,
+        kdf: t.Optional[KDFParameters] = None,
+        create: bool = False,
+    ):
+        # Inputs
+        self.path = path
+        self.chunks_dir = self.path / "chunks"
+        self.snapshots_dir = self.path / "snapshots"
+
+        # Chunks written / reused by this instance, reported after a backup
+        self.new_chunks: int = 0
+        self.new_chunk_bytes: int = 0
+        self.reused_chunks: int = 0
+
+        self.__key_session: t.Optional[KeySession] = None
+        self.__id_key: t.Optional[bytes] = None
+
+        config_path = self.path / self.CONFIG_NAME
+        if not config_path.exists():
+            # Only backups create repositories; anything else pointed at a directory
+            # without one would otherwise leave an empty repository behind
+            if not create:
+                click.secho(f"'{self.path}' is not a repository!", fg="red")
+                sys.exit(1)
+            self._initialize(password, kdf)
+
+        self.config: t.Dict[str, t.Any] = json.loads(
+            config_path.read_text(encoding=config.DEFAULT_ENCODING)
+        )
+        self._open(password)
+
+        logger.debug(f"Class 'ChunkRepository' instantiated: {self}")
+
+    def __repr__(self):
+        return (
+            f"ChunkRepository(path={self.path}, encrypted={self.is_encrypted}, "
+            f"chunker={self.config['chunker']})"
+        )
+
+    def _initialize(
+        self, password: t.Optional[str], kdf: t.Optional[KDFParameters]
+    ) -> t.NoReturn:
+        """
+        The _initialize function creates a new repository. The chunking parameters are
+        recorded, since chunks only deduplicate if every backup is split the same way.
+
+        :param self: Access the attributes of the class
+        :param password:t.Optional[str]: Password of the repository; None for no encryption
+        :param kdf:t.Optional[KDFParameters]: Key derivation parameters; defaults to the default parameters
+        :return: None
+        """
+        repository_config: t.Dict[str, t.Any] = {
+            "version": self.VERSION,
+            "chunker": {
+                "min_size": config.CHUNK_MIN_SIZE,
+                "avg_size": config.CHUNK_AVG_SIZE,
+                "max_size": config.CHUNK_MAX_SIZE,
+            },
+            "encryption": None,
+        }
+
+        if password is not None:
+            kdf = kdf or KDFParameters()
+            salt = encryption.generate_salt()
+            self.__key_session = KeySession(password, kdf, encryption_salt=salt)
+            key, _ = self.__key_session.encryption_key()
+            repository_config["encryption"] = {
+                "kdf": kdf.dict(),
+                "salt": salt.hex(),
+                "key_check": self._key_check(key),
+            }
+
+        self.chunks_dir.mkdir(parents=True, exist_ok=True)
+        self.snapshots_dir.mkdir(parents=True, exist_ok=True)
+        self._write_atomic(
+            self.path / self.CONFIG_NAME,
+            json.dumps(repository_config, indent=2, sort_keys=True).encode(
+                config.DEFAULT_ENCODING
+            ),
+        )
+        click.secho(f"Created repository '{self.path}'", fg="green")
+
+    def _open(self, password: t.Optional[str]) -> t.NoReturn:
+        """
+        The _open function checks the password against the repository, and prepares the
+        keys used for chunk IDs and encryption. It exits with an error message if the
+        repository is not supported, or the password is missing or incorrect.
+
+        :param self: Access the attributes of the class
+        :param password:t.Optional[str]: Password of the repository
+        :return: None
+        """
+        if self.config["version"] != self.VERSION:
+            click.secho(
+                f"Unsupported repository version: {self.config['version']}", fg="red"
+            )
+            sys.exit(1)
+
+        encryption_config = self.config["encryption"]
+        if encryption_config is None:
+            if password is not None:
+                click.secho(f"Repository '{self.path}' is not encrypted!", fg="red")
+                sys.exit(1)
+            return
+
+        if password is None:
+            click.secho(
+                "A password must be specified for an encrypted repository!", fg="red"
+            )
+            sys.exit(1)
+
+        # A newly initialized repository already has its key session
+        if self.__key_session is None:
+            self.__key_session = KeySession(
+                password,
+                KDFParameters(**encryption_config["kdf"]),
+                encryption_salt=bytes.fromhex(encryption_config["salt"]),
+            )
+
+        key, _ = self.__key_session.encryption_key()
+        if not hmac.compare_digest(
+            self._key_check(key), encryption_config["key_check"]
+        ):
+            click.secho(
+                f"Password for repository '{self.path}' was incorrect!", fg="red"
+            )
+            sys.exit(1)
+
+        self.__id_key = encryption.derive_subkey(key, b"macos-installation chunk id")
+
+    @staticmethod
+    def _key_check(key: bytes) -> str:
+        return encryption.derive_subkey(key, b"macos-installation key check").hex()
+
+    @staticmethod
+    def _write_atomic(path: pathlib.Path, data: bytes) -> t.NoReturn:
+        """
+        The _write_atomic function writes data to a temporary file next to path, and then
+        renames it into place, so an interrupted write never leaves a partial file behind.
+
+        :param path:pathlib.Path: Destination of the data
+        :param data:bytes: Data to write
+        :return: None
+        """
+        with tempfile.NamedTemporaryFile(
+            dir=path.parent, prefix=ChunkRepository.TEMP_PREFIX, delete=False
+        ) as temp_file:
+            temp_file.write(data)
+        os.replace(temp_file.name, path)
+
+    @property
+    def is_encrypted(self) -> bool:
+        return self.config["encryption"] is not None
+
+    def chunk_id(self, chunk: bytes) -> str:
+        if self.__id_key is not None:
+            return hmac.new(self.__id_key, chunk, hashlib.sha256).hexdigest()
+        return hashlib.sha256(chunk).hexdigest()
+
+    def _chunk_path(self, chunk_id: str) -> pathlib.Path:
+        return self.chunks_dir / chunk_id[:2] / chunk_id
+
+    def _seal(self, data: bytes) -> bytes:
+        data = zlib.compress(data)
+        if self.__key_session is not None:
+            data = encryption.encrypt_bytes(data, self.__key_session)
+        return data
+
+    def _unseal(self, data: bytes) -> bytes:
+        if self.__key_session is not None:
+            data = encryption.decrypt_bytes(data, self.__key_session)
+        return zlib.decompress(data)
+
+    def write_chunk(self, chunk: bytes) -> str:
+        """
+        The write_chunk function stores a chunk, unless the repository already has it.
+
+        :param self: Access the attributes of the class
+        :param chunk:bytes: Chunk to store
+        :return: The ID of the chunk
+        """
+        chunk_id = self.chunk_id(chunk)
+        chunk_path = self._chunk_path(chunk_id)
+
+        if chunk_path.exists():
+            self.reused_chunks += 1
+            return chunk_id
+
+        data = self._seal(chunk)
+        chunk_path.parent.mkdir(exist_ok=True)
+        self._write_atomic(chunk_path, data)
+        self.new_chunks += 1
+        self.new_chunk_bytes += len(data)
+
+        return chunk_id
+
+    def read_chunk(self, chunk_id: str) -> bytes:
+        """
+        The read_chunk function reads a chunk, and verifies it matches its ID.
+
+        :param self: Access the attributes of the class
+        :param chunk_id:str: ID of the chunk
+        :return: The chunk
+        """
+        chunk = self._unseal(self._chunk_path(chunk_id).read_bytes())
+        if not hmac.compare_digest(self.chunk_id(chunk), chunk_id):
+            raise ValueError(f"Chunk '{chunk_id}' is corrupt")
+        return chunk
+
+    def write_file(
+        self, file_path: pathlib.Path
+    ) -> t.Tuple[str, t.List[ChunkReference]]:
+        """
+        The write_file function splits a file into chunks and stores the chunks the
+        repository does not have yet. The file is hashed from the same read.
+
+        :param self: Access the attributes of the class
+        :param file_path:pathlib.Path: File to store
+        :return: A tuple of the sha256 hash of the file, and references to its chunks
+        """
+        digest = hashlib.sha256()
+        chunk_references: t.List[ChunkReference] = []
+
+        with file_path.open("rb") as f:
+            for chunk in chunking.iter_chunks(f, **self.config["chunker"]):
+                digest.update(chunk)
+                chunk_references.append((self.write_chunk(chunk), len(chunk)))
+
+        return digest.hexdigest(), chunk_references
+
+    def read_file(
+        self, chunk_references: t.Iterable[ChunkReference]
+    ) -> t.Iterator[bytes]:
+        """
+        The read_file function reads the chunks of a file one at a time.
+
+        :param self: Access the attributes of the class
+        :param chunk_references:t.Iterable[ChunkReference]: References to the chunks of the file
+        :return: An iterator of the (verified) chunks, in order
+        """
+        for chunk_id, _ in chunk_references:
+            yield self.read_chunk(chunk_id)
+
+    def restore_file(
+        self, chunk_references: t.Iterable[ChunkReference], file_path: pathlib.Path
+    ) -> t.NoReturn:
+        """
+        The restore_file function writes the chunks of a file to the given path.
+
+        :param self: Access the attributes of the class
+        :param chunk_references:t.Iterable[ChunkReference]: References to the chunks of the file
+        :param file_path:pathlib.Path: Path to write the file to
+        :return: None
+        """
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        with file_path.open("wb") as f:
+            for chunk in self.read_file(chunk_references):
+                f.write(chunk)
+
+    def _snapshot_path(self, name: str) -> pathlib.Path:
+        return self.snapshots_dir / f"{name}.json"
+
+    def snapshot_names(self) -> t.List[str]:
+        """
+        The snapshot_names function returns the names of all snapshots, oldest first.
+
+        :param self: Access the attributes of the class
+        :return: A list of snapshot names
+        """
+        snapshot_paths = sorted(
+            self.snapshots_dir.glob("*.json"), key=lambda p: (p.stat().st_mtime, p.name)
+        )
+        return [p.stem for p in snapshot_paths]
+
+    def write_snapshot(
+        self,
+        name: str,
+        manifest: t.Dict[str, t.Any],
+        files: t.Dict[str, t.List[ChunkReference]],
+    ) -> t.NoReturn:
+        """
+        The write_snapshot function stores a snapshot. It is written after all of its
+        chunks, so an interrupted backup only leaves unreferenced chunks behind (which
+        are removed by 'garbage_collect').
+
+        :param self: Access the attributes of the class
+        :param name:str: Name of the snapshot
+        :param manifest:t.Dict[str, t.Any]: Backup manifest
+        :param files:t.Dict[str, t.List[ChunkReference]]: References to the chunks of every file
+        :return: None
+        """
+        if pathlib.Path(name).name != name or name.startswith("."):
+            click.secho(f"Invalid snapshot name: '{name}'", fg="red")
+            sys.exit(1)
+
+        snapshot_path = self._snapshot_path(name)
+        if snapshot_path.exists():
+            click.secho(
+                f"Snapshot '{name}' already exists in repository '{self.path}'!",
+                fg="red",
+            )
+            sys.exit(1)
+
+        contents = json.dumps(
+            {"manifest": manifest, "files": files}, default=str, sort_keys=True
+        ).encode(config.DEFAULT_ENCODING)
+        self._write_atomic(snapshot_path, self._seal(contents))
+
+    def read_snapshot(self, name: str) -> t.Dict[str, t.Any]:
+        """
+        The read_snapshot function reads a snapshot. It exits with an error message if
+        the snapshot does not exist.
+
+        :param self: Access the attributes of the class
+        :param name:str: Name of the snapshot
+        :return: A dictionary with the backup manifest and the chunks of every file
+        """
+        snapshot_path = self._snapshot_path(name)
+        if not snapshot_path.exists():
+            click.secho(
+                f"Snapshot '{name}' does not exist in repository '{self.path}'!",
+                fg="red",
+            )
+            sys.exit(1)
+
+        return json.loads(
+            self._unseal(snapshot_path.read_bytes()).decode(config.DEFAULT_ENCODING)
+        )
+
+    def _chunk_paths(self) -> t.Iterator[pathlib.Path]:
+        return (p for p in self.chunks_dir.glob("*/*") if p.is_file())
+
+    @contextlib.contextmanager
+    def lock(self) -> t.Iterator[None]:
+        """
+        The lock function takes an exclusive lock on the repository for the duration of
+        a backup or garbage collection. Otherwise garbage collection could remove chunks
+        a running backup has just found already stored (or is still writing), leaving its
+        snapshot referencing missing chunks. It exits with an error message if the lock
+        is already held. Without 'fcntl' (i.e. on Windows), nothing is locked.
+
+        :param self: Access the attributes of the class
+        :return: A context manager holding the lock
+        """
+        with (self.path / self.LOCK_NAME).open("a") as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    click.secho(
+                        f"Repository '{self.path}' is in use by another backup or "
+                        "garbage collection!",
+                        fg="red",
+                    )
+                    sys.exit(1)
+
+            # The lock is released when the file is closed
+            yield
+
+    def garbage_collect(self, dry_run: bool = False) -> t.Tuple[int, int]:
+        """
+        The garbage_collect function removes the chunks which no snapshot references
+        anymore, as well as files left behind by interrupted writes.
+
+        :param self: Access the attributes of the class
+        :param dry_run:bool=False: Only count the files which would be removed
+        :return: A tuple of the number of files removed, and their total size in bytes
+        """
+        with contextlib.ExitStack() as stack:
+            # Counting only reads the repository
+            if not dry_run:
+                stack.enter_context(self.lock())
+            return self._garbage_collect(dry_run)
+
+    def _garbage_collect(self, dry_run: bool) -> t.Tuple[int, int]:
+        referenced_ids = {
+            chunk_id
+            for name in self.snapshot_names()
+            for chunk_references in self.read_snapshot(name)["files"].values()
+            for chunk_id, _ in chunk_references
+        }
+
+        removed_files, removed_bytes = 0, 0
+        for path in [*self._chunk_paths(), *self.path.glob(f"*/{self.TEMP_PREFIX}*")]:
+            if path.name in referenced_ids:
+                continue
+
+            removed_files += 1
+            removed_bytes += path.stat().st_size
+            if not dry_run:
+                path.unlink()
+
+        return removed_files, removed_bytes
+
+    def statistics(self) -> t.Dict[str, t.Any]:
+        """
+        The statistics function returns the size of the repository. The logical size is
+        the total size of every file in every snapshot; the unique size counts every
+        referenced chunk once, and the stored size is what the chunks take up on disk.
+
+        :param self: Access the attributes of the class
+        :return: A dictionary of statistics
+        """
+        snapshot_names = self.snapshot_names()
+        files, logical_size = 0, 0
+        unique_chunks: t.Dict[str, int] = {}
+
+        for name in snapshot_names:
+            for chunk_references in self.read_snapshot(name)["files"].values():
+                files += 1
+                for chunk_id, chunk_size in chunk_references:
+                    logical_size += chunk_size
+                    unique_chunks[chunk_id] = chunk_size
+
+        unique_size = sum(unique_chunks.values())
+        stored_size = sum(
+            p.stat().st_size for p in self._chunk_paths() if p.name in unique_chunks
+        )
+
+        return {
+            "snapshots": len(snapshot_names),
+            "files": files,
+            "chunks": len(unique_chunks),
+            "logical_size": logical_size,
+            "unique_size": unique_size,
+            "stored_size": stored_size,
+            "dedup_ratio": logical_size / unique_size if unique_size else 1.0,
+            "compression_ratio": unique_size / stored_size if stored_size else 1.0,
+        }
@@ -0,0 +1,54 @@
+import logging
+import pathlib
+import typing as t
+
+from macos_installation.classes.data import KDFParameters  # type: ignore
+
+logger: logging.Logger
+
+ChunkReference = t.Tuple[str, int]
+
+class ChunkRepository:
+    VERSION: t.ClassVar[int]
+    CONFIG_NAME: t.ClassVar[str]
+    LOCK_NAME: t.ClassVar[str]
+    TEMP_PREFIX: t.ClassVar[str]
+    path: pathlib.Path
+    chunks_dir: pathlib.Path
+    snapshots_dir: pathlib.Path
+    config: t.Dict[str, t.Any]
+    new_chunks: int
+    new_chunk_bytes: int
+    reused_chunks: int
+    def __init__(
+        self,
+        path: pathlib.Path,
+        password: t.Optional[str] = ...,
+        kdf: t.Optional[KDFParameters] = ...,
+        create: bool = ...,
+    ) -> None: ...
+    @property
+    def is_encrypted(self) -> bool: ...
+    def chunk_id(self, chunk: bytes) -> str: ...
+    def write_chunk(self, chunk: bytes) -> str: ...
+    def read_chunk(self, chunk_id: str) -> bytes: ...
+    def write_file(
+        self, file_path: pathlib.Path
+    ) -> t.Tuple[str, t.List[ChunkReference]]: ...
+    def read_file(
+        self, chunk_references: t.Iterable[ChunkReference]
+    ) -> t.Iterator[bytes]: ...
+    def restore_file(
+        self, chunk_references: t.Iterable[ChunkReference], file_path: pathlib.Path
+    ) -> t.NoReturn: ...
+    def snapshot_names(self) -> t.List[str]: ...
+    def write_snapshot(
+        self,
+        name: str,
+        manifest: t.Dict[str, t.Any],
+        files: t.Dict[str, t.List[ChunkReference]],
+    ) -> t.NoReturn: ...
+    def read_snapshot(self, name: str) -> t.Dict[str, t.Any]: ...
+    def lock(self) -> t.ContextManager[None]: ...
+    def garbage_collect(self, dry_run: bool = ...) -> t.Tuple[int, int]: ...
+    def statistics(self) -> t.Dict[str, t.Any]: ...
@@ -0,0 +1,140 @@
+import logging
+import threading
+import typing as t
+
+from macos_installation import config
+from macos_installation.classes.data import KDFParameters
+from macos_installation.classes.profiler import PROFILER
+from macos_installation.functions import encryption
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class KeySession(object):
+    def __init__(
+        self,
+        password: t.Union[bytes, str],
+        kdf: t.Optional[KDFParameters] = None,
+        encryption_salt: t.Optional[bytes] = None,
+    ):
+        try:
+            password = password.encode(config.DEFAULT_ENCODING)
+        except AttributeError:
+            # Password is already encoded
+            pass
+
+        # Inputs
+        self.__password: bytes = password
+        self.kdf: KDFParameters = kdf or KDFParameters()
+
+        # Derived keys, by salt and parameters; kept for the lifetime of the session
+        self.__keys: t.Dict[t.Tuple[bytes, KDFParameters], bytes] = {}
+        # Generated on first use, unless pinned (e.g. by a chunk repository, so all of
+        # its chunks are encrypted with keys derived from one password-derived key)
+        self.__encryption_salt: t.Optional[bytes] = encryption_salt
+        self.__lock = threading.Lock()
+        # One lock per key, so only derivations of the same key wait for each other
+        self.__key_locks: t.Dict[t.Tuple[bytes, KDFParameters], threading.Lock] = {}
+
+        # Number of key derivations performed
+        self.derivations: int = 0
+
+        logger.debug(f"Class 'KeySession' instantiated: {self}")
+
+    def __repr__(self):
+        return f"KeySession(kdf={self.kdf}, derived_keys={len(self.__keys)})"
+
+    @classmethod
+    def from_password(
+        cls,
+        password: t.Union[bytes, str, "KeySession"],
+        kdf: t.Optional[KDFParameters] = None,
+    ) -> "KeySession":
+        """
+        The from_password function returns the given session, or a new session for the
+        given password, so functions can accept either.
+
+        :param password:t.Union[bytes, str, KeySession]: Password or existing session
+        :param kdf:t.Optional[KDFParameters]=None: Key derivation parameters of a new session
+        :return: A key session for the password
+        """
+        if isinstance(password, cls):
+            return password
+        return cls(password, kdf)
+
+    def key_for(self, salt: bytes, kdf: t.Optional[KDFParameters] = None) -> bytes:
+        """
+        The key_for function returns the key derived from the session's password and the
+        given salt. The expensive key derivation only happens the first time a salt (and
+        set of parameters) is seen; later calls return the cached key. Threads deriving
+        the same key wait for one derivation, while different keys are derived
+        concurrently.
+
+        :param self: Access the attributes of the class
+        :param salt:bytes: Salt to derive the key with
+        :param kdf:t.Optional[KDFParameters]=None: Key derivation parameters; defaults to the session's
+        :return: The derived key
+        """
+        kdf = kdf or self.kdf
+        with self.__lock:
+            key_lock = self.__key_locks.setdefault((salt, kdf), threading.Lock())
+
+        with key_lock:
+            if (salt, kdf) not in self.__keys:
+                with PROFILER.phase("kdf"):
+                    key, _ = encryption.generate_key(self.__password, salt, kdf=kdf)
+                with self.__lock:
+                    self.__keys[(salt, kdf)] = key
+                    self.derivations += 1
+                logger.debug(f"Derived key #{self.derivations} for {self}")
+
+            return self.__keys[(salt, kdf)]
+
+    def encryption_key(self) -> t.Tuple[bytes, bytes]:
+        """
+        The encryption_key function returns a key and salt for encrypting new data, derived
+        with the session's parameters. The salt is generated once per session, so encrypting
+        several times only derives one key; every container still gets its own segment key
+        from its random header nonce.
+
+        :param self: Access the attributes of the class
+        :return: A tuple of the key and salt
+        """
+        salt = self._encryption_salt()
+        return self.key_for(salt), salt
+
+    def _encryption_salt(self) -> bytes:
+        with self.__lock:
+            if self.__encryption_salt is None:
+                self.__encryption_salt = encryption.generate_salt()
+
+            return self.__encryption_salt
+
+    def prefetch(
+        self, salt: t.Optional[bytes] = None, kdf: t.Optional[KDFParameters] = None
+    ) -> threading.Thread:
+        """
+        The prefetch function starts deriving a key on a background thread, so the
+        expensive key derivation overlaps with other work (e.g. walking and hashing files,
+        or opening an archive). A later call needing the same key waits for the derivation
+        to finish instead of starting another; if it fails, that call derives the key again
+        and raises the error. Without a salt, the key for encrypting new data is derived.
+
+        :param self: Access the attributes of the class
+        :param salt:t.Optional[bytes]=None: Salt to derive the key with
+        :param kdf:t.Optional[KDFParameters]=None: Key derivation parameters; defaults to the session's
+        :return: The started thread
+        """
+        if salt is None:
+            salt = self._encryption_salt()
+
+        def derive_key():
+            try:
+                self.key_for(salt, kdf)
+            except Exception as e:
+                logger.debug(f"Prefetching key failed for {self}: {e!r}")
+
+        thread = threading.Thread(target=derive_key, name="kdf-prefetch", daemon=True)
+        thread.start()
+        logger.debug(f"Prefetching key for {self}")
+        return thread
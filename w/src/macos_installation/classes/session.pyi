@@ -0,0 +1,28 @@
+import logging
+import threading
+import typing as t
+
+from macos_installation.classes.data import KDFParameters  # type: ignore
+
+logger: logging.Logger
+
+class KeySession:
+    derivations: int
+    kdf: KDFParameters
+    def __init__(
+        self,
+        password: t.Union[bytes, str],
+        kdf: t.Optional[KDFParameters] = ...,
+        encryption_salt: t.Optional[bytes] = ...,
+    ) -> None: ...
+    @classmethod
+    def from_password(
+        cls,
+        password: t.Union[bytes, str, KeySession],
+        kdf: t.Optional[KDFParameters] = ...,
+    ) -> KeySession: ...
+    def key_for(self, salt: bytes, kdf: t.Optional[KDFParameters] = ...) -> bytes: ...
+    def encryption_key(self) -> t.Tuple[bytes, bytes]: ...
+    def prefetch(
+        self, salt: t.Optional[bytes] = ..., kdf: t.Optional[KDFParameters] = ...
+    ) -> threading.Thread: ...
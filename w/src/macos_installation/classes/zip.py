@@ -1,44 +1,168 @@
 import contextlib
-import io
 import logging
+import mmap
+import os
 import pathlib
+import shutil
 import sys
+import tempfile
 import typing as t
 import zipfile
 from pprint import pformat
 
 import click
 
-from macos_installation.functions import encryption
+from macos_installation import config
+from macos_installation.classes.data import EncryptionHeader, KDFParameters
+from macos_installation.classes.session import KeySession
+from macos_installation.functions import encryption, util
 
 logger: logging.Logger = logging.getLogger(__name__)
 
 
+class MappedFile(mmap.mmap):
+    """
+    Read-only memory map of a file, which can be used anywhere a seekable binary
+    file object is expected (e.g. by 'zipfile.ZipFile').
+    """
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return False
+
+
 class InMemoryZip(object):
+    # Leading bytes of unencrypted archives: a local file header, or the end of central
+    # directory record of an empty archive
+    ZIP_SIGNATURES: t.ClassVar[t.Tuple[bytes, ...]] = (b"PK\x03\x04", b"PK\x05\x06")
+
     def __init__(
-        self, file: t.Optional[pathlib.Path] = None, password: t.Optional[str] = None
+        self,
+        file: t.Optional[pathlib.Path] = None,
+        password: t.Optional[t.Union[str, KeySession]] = None,
+        spool_threshold: t.Optional[int] = None,
+        spool_dir: t.Optional[pathlib.Path] = None,
+        kdf: t.Optional[KDFParameters] = None,
     ):
         # Inputs
         self.file_path = file
-        self.__password = password
-
-        self.zip_contents: t.Optional[t.IO[bytes]] = io.BytesIO(
-            self.file_path.read_bytes() if self.file_path else None
+        self.__key_session: t.Optional[KeySession] = (
+            KeySession.from_password(password, kdf) if password is not None else None
         )
+        self.spool_threshold = (
+            config.ZIP_SPOOL_THRESHOLD if spool_threshold is None else spool_threshold
+        )
+        self.spool_dir = spool_dir
+
+        # Existing archives are memory-mapped instead of read into memory; new
+        # archives are built in a spooled file which moves to disk when it grows
+        self.__file_handle: t.Optional[t.IO[bytes]] = None
+        self.__decrypted_contents: t.Optional[t.IO[bytes]] = None
+        self.__decrypted_view: t.Optional[t.IO[bytes]] = None
+        self.zip_contents: t.Optional[t.IO[bytes]] = None
+
+        # Whether the contents are encrypted; detected on first use, and again whenever
+        # the contents change
+        self.__encrypted: t.Optional[bool] = None
+        if self.file_path and self.file_path.stat().st_size > 0:
+            self.__file_handle = self.file_path.open("rb")
+            self.zip_contents = MappedFile(
+                self.__file_handle.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        else:
+            self.zip_contents = self._new_spool()
 
         logger.debug(
             "Class 'InMemoryZip' instantiated: "
-            f"{pformat({k: v for k, v in self.__dict__.items() if '__password' not in k})}"
+            f"{pformat({k: v for k, v in self.__dict__.items() if '__' not in k})}"
+        )
+
+    def __enter__(self) -> "InMemoryZip":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _new_spool(self) -> t.IO[bytes]:
+        """
+        The _new_spool function creates the storage for new archive contents. Data stays
+        in memory until it grows past the spool threshold, after which it is moved to a
+        temporary file in the spool directory (or the default temporary directory).
+        A threshold of 0 writes to the temporary file straight away.
+
+        :param self: Access the attributes of the class
+        :return: An empty, writable file object
+        """
+        if self.spool_threshold == 0:
+            return tempfile.TemporaryFile(dir=self.spool_dir)
+
+        return tempfile.SpooledTemporaryFile(
+            max_size=self.spool_threshold, dir=self.spool_dir
         )
 
+    def _replace_contents(self, contents: t.IO[bytes]) -> t.NoReturn:
+        """
+        The _replace_contents function swaps in new archive contents. A memory-mapped
+        source file is released straight away; previous spooled contents are released
+        once nothing references them anymore.
+
+        :param self: Access the attributes of the class
+        :param contents:t.IO[bytes]: The new archive contents
+        :return: None
+        """
+        if self.__file_handle is not None:
+            self.zip_contents.close()
+            self.__file_handle.close()
+            self.__file_handle = None
+        self.zip_contents = contents
+        self.__decrypted_contents = None
+        self.__decrypted_view = None
+        self.__encrypted = None
+
+    def close(self) -> t.NoReturn:
+        """
+        The close function releases the storage held by the archive contents.
+
+        :param self: Access the attributes of the class
+        :return: None
+        """
+        if self.__decrypted_contents is not None:
+            self.__decrypted_contents.close()
+            self.__decrypted_contents = None
+        if self.__decrypted_view is not None:
+            self.__decrypted_view.close()
+            self.__decrypted_view = None
+        if self.zip_contents is not None:
+            self.zip_contents.close()
+            self.zip_contents = None
+        self.__encrypted = None
+        if self.__file_handle is not None:
+            self.__file_handle.close()
+            self.__file_handle = None
+
+    @property
+    def size(self) -> int:
+        """
+        The size of the archive contents, in bytes.
+        """
+        position = self.zip_contents.tell()
+        self.zip_contents.seek(0, os.SEEK_END)
+        size = self.zip_contents.tell()
+        self.zip_contents.seek(position)
+        return size
+
     @property
     def is_encrypted(self) -> bool:
         """
         The is_encrypted function returns True if the file is encrypted and False otherwise.
-        Admittedly, this is not the best test in the world considering that a corrupt
-        ZIP file that's unencrypted would show up as being encrypted in this check.
-        In the future, will look into replacing the encryption with a better method
-        which can actually verify if something is encrypted or not.
+        Only the first bytes of the contents are read: encrypted contents start with the
+        magic bytes of the encryption header, and archives with a ZIP signature. The result
+        is cached until the contents change.
 
         If False, then it is not encrypted.
         If True, then it is encrypted.
@@ -46,13 +170,40 @@ class InMemoryZip(object):
         :param self: Access attributes of the class
         :return: True if the file is encrypted, and false otherwise
         """
-        try:
-            zipfile.ZipFile(
-                file=self.zip_contents, mode="r", compression=zipfile.ZIP_DEFLATED
-            )
+        if self.__encrypted is None:
+            self.zip_contents.seek(0)
+            prefix = self.zip_contents.read(len(EncryptionHeader.MAGIC))
+            self.zip_contents.seek(0)
+
+            if not prefix or prefix.startswith(self.ZIP_SIGNATURES):
+                self.__encrypted = False
+            elif prefix == EncryptionHeader.MAGIC:
+                self.__encrypted = True
+            else:
+                # Legacy encrypted files have no header, and start with a random salt;
+                # anything which is not a readable archive (e.g. an archive with data
+                # prepended to it) is assumed to be one
+                try:
+                    zipfile.ZipFile(file=self.zip_contents, mode="r")
+                    self.__encrypted = False
+                except zipfile.BadZipFile:
+                    self.__encrypted = True
+
+        return self.__encrypted
+
+    @property
+    def is_legacy_encrypted(self) -> bool:
+        """
+        Whether the contents are encrypted in the legacy (headerless) format, which can
+        only be decrypted as a whole, instead of segment by segment.
+        """
+        if not self.is_encrypted:
             return False
-        except zipfile.BadZipFile:
-            return True
+
+        self.zip_contents.seek(0)
+        prefix = self.zip_contents.read(len(EncryptionHeader.MAGIC))
+        self.zip_contents.seek(0)
+        return prefix != EncryptionHeader.MAGIC
 
     def decrypt(self) -> t.NoReturn:
         """
@@ -63,35 +214,60 @@ class InMemoryZip(object):
         :return: None
         """
         if self.is_encrypted:
-            if self.has_password:
-                try:
-                    self.zip_contents = io.BytesIO(
-                        encryption.decrypt_bytes(
-                            self.zip_contents.getvalue(), self.__password
-                        )
-                    )
-                    restore_zip = zipfile.ZipFile(
-                        file=self.zip_contents,
-                        mode="r",
-                        compression=zipfile.ZIP_DEFLATED,
-                    )
-                    if crc_test := restore_zip.testzip() is not None:
-                        click.secho(
-                            f"Bad CRC or file headers on '{self.file_path.name}': {crc_test}",
-                            fg="red",
-                        )
-                        sys.exit(1)
-                except ValueError:
-                    click.secho(
-                        f"Password for encrypted ZIP file '{self.file_path.name}' was incorrect!",
-                        fg="red",
-                    )
-                    sys.exit(1)
-            else:
-                click.secho(
-                    "A password must be specified for an encrypted ZIP file!", fg="red"
-                )
-                sys.exit(1)
+            self._replace_contents(self.read_unencrypted())
+
+    def _decrypt_contents(self) -> t.IO[bytes]:
+        """
+        The _decrypt_contents function decrypts the contents of the zip file into a new spooled
+        file, leaving the encrypted contents untouched. It exits with an error message if no
+        password was given, the password was incorrect, or the encrypted or decrypted ZIP file
+        is corrupt.
+
+        :param self: Access the attributes and methods of the class in python
+        :return: The decrypted contents
+        """
+        if not self.has_password:
+            click.secho(
+                "A password must be specified for an encrypted ZIP file!", fg="red"
+            )
+            sys.exit(1)
+
+        try:
+            decrypted_contents = self._new_spool()
+            self.zip_contents.seek(0)
+            encryption.decrypt_stream(
+                self.zip_contents, decrypted_contents, self.__key_session
+            )
+        except encryption.InvalidPasswordError:
+            click.secho(
+                f"Password for encrypted ZIP file '{self.file_path.name}' was incorrect!",
+                fg="red",
+            )
+            sys.exit(1)
+        except ValueError:
+            click.secho(
+                f"File '{self.file_path.name}' is corrupt or truncated!", fg="red"
+            )
+            sys.exit(1)
+
+        try:
+            restore_zip = zipfile.ZipFile(
+                file=decrypted_contents,
+                mode="r",
+                compression=zipfile.ZIP_DEFLATED,
+            )
+            crc_test = restore_zip.testzip()
+        except (zipfile.BadZipFile, ValueError):
+            click.secho(f"File '{self.file_path.name}' is corrupt!", fg="red")
+            sys.exit(1)
+        if crc_test is not None:
+            click.secho(
+                f"Bad CRC or file headers on '{self.file_path.name}': {crc_test}",
+                fg="red",
+            )
+            sys.exit(1)
+
+        return decrypted_contents
 
     def encrypt(self) -> t.NoReturn:
         """
@@ -101,16 +277,47 @@ class InMemoryZip(object):
         :return: None
         """
         if not self.is_encrypted:
-            self.zip_contents = io.BytesIO(
-                encryption.encrypt_bytes(self.zip_contents.getvalue(), self.__password)
+            encrypted_contents = self._new_spool()
+            self.zip_contents.seek(0)
+            encryption.encrypt_stream(
+                self.zip_contents, encrypted_contents, self.__key_session
             )
+            self._replace_contents(encrypted_contents)
 
     @property
     def has_password(self) -> bool:
         """
         Determines if the in-memory ZIP is using a password or not.
         """
-        return self.__password is not None
+        return self.__key_session is not None
+
+    @property
+    def key_session(self) -> t.Optional[KeySession]:
+        """
+        The key session of the in-memory ZIP, which can be shared with related archives
+        (e.g. the parents of an incremental backup) so keys are only derived once.
+        """
+        return self.__key_session
+
+    def prefetch_key(self) -> t.NoReturn:
+        """
+        The prefetch_key function starts deriving the key of encrypted contents on a
+        background thread (see 'KeySession.prefetch'), so it overlaps with the work done
+        before the contents are first decrypted. Contents which are not encrypted, or
+        whose header cannot be read, are left for decryption to report.
+
+        :param self: Access the attributes and methods of the class in python
+        :return: None
+        """
+        if not self.has_password or not self.is_encrypted:
+            return
+
+        self.zip_contents.seek(0)
+        try:
+            salt, kdf = encryption.read_key_salt(self.zip_contents)
+        except ValueError:
+            return
+        self.__key_session.prefetch(salt, kdf)
 
     @contextlib.contextmanager
     def open_zip_file(
@@ -129,33 +336,92 @@ class InMemoryZip(object):
             yield zip_file
         finally:
             zip_file.close()
+            if mode != "r":
+                self.__encrypted = None
 
     def read(self) -> bytes:
         """
         The read function reads the in memory zip file and returns it as bytes.
+        This copies the whole archive into memory; prefer write_to_file or
+        zip_contents for large archives.
 
         :param self: Refer to the object of the class
         :return: The bytes of the in-memory zip file
         """
-        return self.zip_contents.getvalue()
+        self.zip_contents.seek(0)
+        return self.zip_contents.read()
 
     def read_unencrypted(self) -> t.IO[bytes]:
-        if self.is_encrypted:
-            self.decrypt()
-            contents = self.zip_contents
-            self.encrypt()
-        else:
-            contents = self.zip_contents
+        """
+        The read_unencrypted function returns the unencrypted contents of the zip file.
+        Encrypted contents are decrypted once into a separate view, which is reused by later
+        calls; the encrypted contents themselves are left as they are.
+
+        :param self: Access the attributes and methods of the class in python
+        :return: The unencrypted contents
+        """
+        if not self.is_encrypted:
+            return self.zip_contents
+
+        if self.__decrypted_contents is None:
+            self.__decrypted_contents = self._decrypt_contents()
+
+        return self.__decrypted_contents
+
+    def open_unencrypted(self) -> t.IO[bytes]:
+        """
+        The open_unencrypted function returns the unencrypted contents of the zip file for
+        random access, e.g. to extract a few members. Unlike 'read_unencrypted', encrypted
+        contents are not decrypted up front; segments are decrypted as they are read (see
+        'encryption.open_decrypted_stream'). Contents in the legacy encryption format cannot
+        be verified piecewise, and are decrypted as a whole instead. It exits with an error
+        message if no password was given, the password was incorrect, or the contents are
+        corrupt or truncated.
+
+        :param self: Access the attributes and methods of the class in python
+        :return: The unencrypted contents
+        """
+        if not self.is_encrypted:
+            return self.zip_contents
+
+        if self.__decrypted_view is None:
+            if not self.has_password:
+                click.secho(
+                    "A password must be specified for an encrypted ZIP file!", fg="red"
+                )
+                sys.exit(1)
+
+            try:
+                self.__decrypted_view = encryption.open_decrypted_stream(
+                    self.zip_contents, self.__key_session
+                )
+            except encryption.InvalidPasswordError:
+                click.secho(
+                    f"Password for encrypted ZIP file '{self.file_path.name}' was incorrect!",
+                    fg="red",
+                )
+                sys.exit(1)
+            except ValueError:
+                click.secho(
+                    f"File '{self.file_path.name}' is corrupt or truncated!", fg="red"
+                )
+                sys.exit(1)
+
+            if self.__decrypted_view is None:
+                return self.read_unencrypted()
 
-        return contents
+        return self.__decrypted_view
 
     def write_to_file(self, filename: pathlib.Path) -> t.NoReturn:
         """
         The write_to_file function writes the contents of the file to a new file.
+        The contents are streamed to a temporary file next to the destination, which
+        is then renamed into place, so a partially written file is never left behind.
 
         :param self: Access the attributes and methods of the class in which it is used
         :param filename: Specify the file to write the data to
         :return: None
         """
-        with open(filename, "wb") as f:
-            f.write(self.read())
+        self.zip_contents.seek(0)
+        with util.atomic_write(filename) as f:
+            shutil.copyfileobj(self.zip_contents, f, length=config.COPY_BUFFER_SIZE)
@@ -1,25 +1,53 @@
 import logging
+import mmap
 import pathlib
 import typing as t
 import zipfile
 
+from macos_installation.classes.data import KDFParameters  # type: ignore
+from macos_installation.classes.session import KeySession  # type: ignore
+
 logger: logging.Logger
 
+class MappedFile(mmap.mmap):
+    def readable(self) -> bool: ...
+    def seekable(self) -> bool: ...
+    def writable(self) -> bool: ...
+
 class InMemoryZip:
+    ZIP_SIGNATURES: t.ClassVar[t.Tuple[bytes, ...]]
     file_path: t.Optional[pathlib.Path]
-    zip_contents: t.Optional[str]
+    spool_threshold: int
+    spool_dir: t.Optional[pathlib.Path]
+    zip_contents: t.Optional[t.IO[bytes]]
     def __init__(
-        self, file: t.Optional[pathlib.Path] = ..., password: t.Optional[str] = ...
+        self,
+        file: t.Optional[pathlib.Path] = ...,
+        password: t.Optional[t.Union[str, KeySession]] = ...,
+        spool_threshold: t.Optional[int] = ...,
+        spool_dir: t.Optional[pathlib.Path] = ...,
+        kdf: t.Optional[KDFParameters] = ...,
     ) -> None: ...
+    def __enter__(self) -> InMemoryZip: ...
+    def __exit__(self, *args) -> None: ...
+    def close(self) -> t.NoReturn: ...
+    @property
+    def size(self) -> int: ...
     @property
     def is_encrypted(self) -> bool: ...
+    @property
+    def is_legacy_encrypted(self) -> bool: ...
     def decrypt(self) -> t.NoReturn: ...
     def encrypt(self) -> t.NoReturn: ...
     @property
     def has_password(self) -> bool: ...
+    @property
+    def key_session(self) -> t.Optional[KeySession]: ...
+    def prefetch_key(self) -> t.NoReturn: ...
     def open_zip_file(
         self, mode: t.Literal["r", "w", "x", "a"] = ...
     ) -> zipfile.ZipFile: ...
     def read(self) -> bytes: ...
     def read_unencrypted(self) -> t.IO[bytes]: ...
+    def open_unencrypted(self) -> t.IO[bytes]: ...
     def write_to_file(self, filename: pathlib.Path) -> t.NoReturn: ...
@@ -1,22 +1,97 @@
 import logging
 import pathlib
+import sys
 import typing as t
 from pprint import pformat
 
 import click
-import coloredlogs
 
 from macos_installation import config
-from macos_installation.classes.zip import InMemoryZip
 from macos_installation.cli import decorators
-from macos_installation.cli.backup import BackupCommand
-from macos_installation.cli.decrypt import DecryptCommand
-from macos_installation.cli.encrypt import EncryptCommand
-from macos_installation.cli.print_backup_locations import PrintBackupLocationsCommand
-from macos_installation.cli.restore import RestoreCommand
+
+# Command modules, and the dependencies they need (e.g. 'Cryptodome' and 'tabulate'), are
+# only imported once their command runs, so '--help' and light commands start quickly
+if t.TYPE_CHECKING:
+    from macos_installation.classes.data import KDFParameters
 
 logger: logging.Logger = logging.getLogger(__name__)
 
+
+def _kdf_parameters(params: t.Dict[str, t.Any]) -> t.Optional["KDFParameters"]:
+    """
+    The _kdf_parameters function returns the key derivation parameters to encrypt with;
+    calibrated for this host if requested, otherwise None for the defaults.
+
+    :param params:t.Dict[str, t.Any]: Options passed to the command
+    :return: The key derivation parameters, or None
+    """
+    if not (params["password"] and params["kdf_calibrate"]):
+        return None
+
+    from macos_installation.functions import encryption
+
+    kdf = encryption.calibrate_kdf(
+        time_target=params["kdf_time_target"],
+        memory_limit=params["kdf_memory_limit"] * 1024**2,
+    )
+    click.secho(
+        f"Calibrated key derivation: {kdf.name} N={kdf.n}, r={kdf.r}, p={kdf.p} "
+        f"({kdf.memory_cost // 1024**2} MiB)",
+        fg="green",
+    )
+    return kdf
+
+
+def _check_backup_target(params: t.Dict[str, t.Any]) -> t.NoReturn:
+    """
+    The _check_backup_target function exits with an error message unless exactly one of
+    a backup file and a chunk repository was given.
+
+    :param params:t.Dict[str, t.Any]: Options passed to the command
+    :return: None
+    """
+    if (params["backup_file"] is None) == (params["repository"] is None):
+        click.secho(
+            "Exactly one of '--backup-file' and '--repository' must be specified!",
+            fg="red",
+        )
+        sys.exit(1)
+
+
+def _finish_profile(
+    profile: t.Optional[pathlib.Path], cprofile: t.Optional[pathlib.Path]
+) -> t.NoReturn:
+    """
+    The _finish_profile function stops the profiler once the command has finished, prints
+    the time spent in each phase, and writes the trace and cProfile statistics.
+
+    :param profile:t.Optional[pathlib.Path]: File to write the Chrome trace to
+    :param cprofile:t.Optional[pathlib.Path]: File to write the cProfile statistics to
+    :return: None
+    """
+    import tabulate
+
+    from macos_installation.classes.profiler import PROFILER
+
+    PROFILER.stop()
+
+    # Printed to stderr, so the output of the command is unchanged
+    headers = ["Phase", "Count", "Seconds", "Bytes", "Files", "MB/s", "Peak RSS (MiB)"]
+    click.echo(
+        tabulate.tabulate(
+            PROFILER.summary(), headers, tablefmt="github", disable_numparse=True
+        ),
+        err=True,
+    )
+
+    if profile is not None:
+        PROFILER.write_trace(profile)
+        click.echo(f"Trace written to '{profile}'", err=True)
+    if cprofile is not None:
+        PROFILER.write_cprofile(cprofile)
+        click.echo(f"cProfile statistics written to '{cprofile}'", err=True)
+
+
 # ---------------------------------------------------------------------
 # Main CLI group
 # ---------------------------------------------------------------------
@@ -35,15 +110,48 @@ logger: logging.Logger = logging.getLogger(__name__)
     help="Enable dry-run functionality",
     **config.BASE_CLI_OPTIONS,
 )
+@click.option(
+    "--spool-threshold",
+    default=config.ZIP_SPOOL_THRESHOLD,
+    help="Size in bytes above which archives are spooled to disk; 0 always uses disk",
+    type=click.IntRange(min=0),
+    **config.BASE_CLI_OPTIONS,
+)
+@click.option(
+    "--profile",
+    help=(
+        "Time each phase of the command, print a summary, and write a Chrome trace "
+        "(also opened by speedscope) to this file"
+    ),
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    **config.BASE_CLI_OPTIONS,
+)
+@click.option(
+    "--cprofile",
+    help="Profile every function call of the main thread, writing the statistics here",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    **config.BASE_CLI_OPTIONS,
+)
 @click.pass_context
 def cli_entrypoint(ctx, **kwargs) -> None:
     ctx.ensure_object(dict)
     ctx.obj["debug"] = kwargs["debug"]
     ctx.obj["dry_run"] = kwargs["dry_run"]
+    ctx.obj["spool_threshold"] = kwargs["spool_threshold"]
+
+    if kwargs["profile"] is not None or kwargs["cprofile"] is not None:
+        from macos_installation.classes.profiler import PROFILER
+
+        PROFILER.start(cprofile=kwargs["cprofile"] is not None)
+        ctx.call_on_close(
+            lambda: _finish_profile(kwargs["profile"], kwargs["cprofile"])
+        )
 
     level = logging.DEBUG if kwargs.get("debug", False) else logging.INFO
 
     logging.basicConfig(level=level)
+    import coloredlogs
+
     coloredlogs.install(level=level)
 
     logger.debug(f"Debug mode is: {'Enabled' if ctx.obj['debug'] else 'Disabled'}")
@@ -56,7 +164,15 @@ def cli_entrypoint(ctx, **kwargs) -> None:
 
 
 @cli_entrypoint.command("backup")
-@decorators.common_backup_file(exists=False)
+@decorators.common_backup_file(exists=False, required=False)
+@decorators.common_repository(exists=False)
+@click.option(
+    "-s",
+    "--snapshot",
+    help="Name of the snapshot in the repository; defaults to the current date and time",
+    type=str,
+    **config.BASE_CLI_OPTIONS,
+)
 @click.option(
     "-l",
     "--extra-location",
@@ -65,17 +181,130 @@ def cli_entrypoint(ctx, **kwargs) -> None:
     type=click.Path(exists=True, path_type=pathlib.Path, resolve_path=True),
     **config.BASE_CLI_OPTIONS,
 )
+@click.option(
+    "-i",
+    "--incremental-from",
+    help="Previous backup file; only files added or changed since it are stored",
+    type=click.Path(
+        exists=True, dir_okay=False, path_type=pathlib.Path, resolve_path=True
+    ),
+    **config.BASE_CLI_OPTIONS,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    default=config.COMPRESSION_JOBS,
+    help="Number of processes compressing files into the backup file",
+    type=click.IntRange(min=1),
+    **config.BASE_CLI_OPTIONS,
+)
+@click.option(
+    "-c",
+    "--compression",
+    default=config.COMPRESSION_POLICY,
+    help=(
+        "Compression policy; 'auto' stores already compressed files and deflates "
+        "the rest, 'max' also compresses text with LZMA"
+    ),
+    type=click.Choice(config.COMPRESSION_POLICIES),
+    **config.BASE_CLI_OPTIONS,
+)
+@click.option(
+    "-x",
+    "--exclude",
+    help=(
+        "Glob of files / directories to skip, in addition to the configured ones; "
+        "relative to the home directory if it contains a '/'; multiple allowed"
+    ),
+    multiple=True,
+    type=str,
+    **config.BASE_CLI_OPTIONS,
+)
+@click.option(
+    "--include",
+    help="Glob of files to back up; if given, other files are skipped; multiple allowed",
+    multiple=True,
+    type=str,
+    **config.BASE_CLI_OPTIONS,
+)
+@click.option(
+    "--symlinks",
+    default=config.SYMLINK_POLICY,
+    help=(
+        "How symbolic links are handled; 'files' backs up linked files but does not "
+        "descend into linked directories, 'follow' also descends into them"
+    ),
+    type=click.Choice(config.SYMLINK_POLICIES),
+    **config.BASE_CLI_OPTIONS,
+)
+@click.option(
+    "--hash-cache/--no-hash-cache",
+    default=True,
+    help="Reuse digests of files unchanged since the last backup",
+    **config.BASE_CLI_OPTIONS,
+)
+@click.option(
+    "--plan-format",
+    default="table",
+    help="Format of the backup plan printed in dry-run mode",
+    type=click.Choice(["table", "json"]),
+    **config.BASE_CLI_OPTIONS,
+)
 @decorators.common_password()
+@decorators.common_kdf()
 @click.pass_context
 def backup(ctx, **kwargs) -> t.Any:
     """
     Backup current macOS installation.
     """
+    from macos_installation.classes.repository import ChunkRepository
+    from macos_installation.classes.session import KeySession
+    from macos_installation.classes.zip import InMemoryZip
+    from macos_installation.cli.backup import BackupCommand
+
     params = {**ctx.obj, **kwargs}
     logger.debug(f"Options passed to command 'backup': {pformat(params)}")
-    zip_object = InMemoryZip(password=kwargs["password"])
+    _check_backup_target(params)
+
+    if kwargs["repository"] is not None:
+        if kwargs["incremental_from"] is not None:
+            click.secho(
+                "Option '--incremental-from' cannot be used with '--repository'; "
+                "repository backups only store new chunks",
+                fg="red",
+            )
+            sys.exit(1)
+
+        # Nothing is created in dry-run mode
+        chunk_repository = (
+            ChunkRepository(
+                kwargs["repository"],
+                kwargs["password"],
+                kdf=_kdf_parameters(params),
+                create=True,
+            )
+            if not params["dry_run"]
+            else None
+        )
+        BackupCommand(None, chunk_repository, **params).main()
+        return
+
+    # The key is derived on a background thread while files are walked, hashed and
+    # compressed; nothing is encrypted in dry-run mode
+    key_session = (
+        KeySession(kwargs["password"], _kdf_parameters(params))
+        if kwargs["password"] is not None
+        else None
+    )
+    if key_session is not None and not params["dry_run"]:
+        key_session.prefetch()
 
-    BackupCommand(zip_object, **params).main()
+    with InMemoryZip(
+        password=key_session,
+        spool_threshold=params["spool_threshold"],
+        spool_dir=kwargs["backup_file"].parent,
+    ) as zip_object:
+        BackupCommand(zip_object, **params).main()
 
 
 # ---------------------------------------------------------------------
@@ -84,20 +313,31 @@ def backup(ctx, **kwargs) -> t.Any:
 
 
 @cli_entrypoint.command("decrypt")
-@decorators.common_backup_file()
+@decorators.common_backup_file(multiple=True)
+@click.option(
+    "-j",
+    "--jobs",
+    default=config.ENCRYPTION_JOBS,
+    help="Number of threads decrypting files",
+    type=click.IntRange(min=1),
+    **config.BASE_CLI_OPTIONS,
+)
 @decorators.common_password(
     confirmation_prompt=False, prompt_required=True, required=True
 )
 @click.pass_context
 def decrypt(ctx, **kwargs) -> t.Any:
     """
-    Decrypt an encrypted backup file.
+    Decrypt encrypted backup files.
     """
+    from macos_installation.classes.session import KeySession
+    from macos_installation.cli.decrypt import DecryptCommand
+
     params = {**ctx.obj, **kwargs}
     logger.debug(f"Options passed to command 'decrypt': {pformat(params)}")
-    zip_object = InMemoryZip(kwargs["backup_file"], kwargs["password"])
-
-    DecryptCommand(zip_object, **params).main()
+    # One session for all files, so keys derived for one are reused for the others
+    key_session = KeySession(kwargs["password"])
+    DecryptCommand(key_session, **params).main()
 
 
 # ---------------------------------------------------------------------
@@ -106,18 +346,30 @@ def decrypt(ctx, **kwargs) -> t.Any:
 
 
 @cli_entrypoint.command("encrypt")
-@decorators.common_backup_file()
+@decorators.common_backup_file(multiple=True)
+@click.option(
+    "-j",
+    "--jobs",
+    default=config.ENCRYPTION_JOBS,
+    help="Number of threads encrypting files",
+    type=click.IntRange(min=1),
+    **config.BASE_CLI_OPTIONS,
+)
 @decorators.common_password(prompt_required=True, required=True)
+@decorators.common_kdf()
 @click.pass_context
 def encrypt(ctx, **kwargs) -> t.Any:
     """
-    Encrypt an unencrypted backup file.
+    Encrypt unencrypted backup files.
     """
+    from macos_installation.classes.session import KeySession
+    from macos_installation.cli.encrypt import EncryptCommand
+
     params = {**ctx.obj, **kwargs}
     logger.debug(f"Options passed to command 'encrypt': {pformat(params)}")
-    zip_object = InMemoryZip(kwargs["backup_file"], kwargs["password"])
-
-    EncryptCommand(zip_object, **params).main()
+    # One session for all files, so keys derived for one are reused for the others
+    key_session = KeySession(kwargs["password"], _kdf_parameters(params))
+    EncryptCommand(key_session, **params).main()
 
 
 # ---------------------------------------------------------------------
@@ -139,6 +391,10 @@ def print_backup_locations(ctx, **kwargs) -> t.Any:
     """
     Print base backup locations.
     """
+    from macos_installation.cli.print_backup_locations import (
+        PrintBackupLocationsCommand,
+    )
+
     params = {**ctx.obj, **kwargs}
     logger.debug(
         f"Options passed to command 'print-backup-locations': {pformat(params)}"
@@ -150,21 +406,141 @@ def print_backup_locations(ctx, **kwargs) -> t.Any:
     PrintBackupLocationsCommand(**params).main()
 
 
+# ---------------------------------------------------------------------
+# repository-gc
+# ---------------------------------------------------------------------
+
+
+@cli_entrypoint.command("repository-gc")
+@decorators.common_repository(required=True)
+@decorators.common_password(confirmation_prompt=False)
+@click.pass_context
+def repository_gc(ctx, **kwargs) -> t.Any:
+    """
+    Remove chunks no snapshot references from a repository.
+    """
+    from macos_installation.classes.repository import ChunkRepository
+    from macos_installation.cli.repository import RepositoryGcCommand
+
+    params = {**ctx.obj, **kwargs}
+    logger.debug(f"Options passed to command 'repository-gc': {pformat(params)}")
+    chunk_repository = ChunkRepository(kwargs["repository"], kwargs["password"])
+    RepositoryGcCommand(chunk_repository, **params).main()
+
+
+# ---------------------------------------------------------------------
+# repository-stats
+# ---------------------------------------------------------------------
+
+
+@cli_entrypoint.command("repository-stats")
+@decorators.common_repository(required=True)
+@decorators.common_password(confirmation_prompt=False)
+@click.option(
+    "-t",
+    "--tablefmt",
+    default="github",
+    help="Table format output (uses 'tabulate' module)",
+    type=str,
+    **config.BASE_CLI_OPTIONS,
+)
+@click.pass_context
+def repository_stats(ctx, **kwargs) -> t.Any:
+    """
+    Print the size and deduplication ratio of a repository.
+    """
+    from macos_installation.classes.repository import ChunkRepository
+    from macos_installation.cli.repository import RepositoryStatsCommand
+
+    params = {**ctx.obj, **kwargs}
+    logger.debug(f"Options passed to command 'repository-stats': {pformat(params)}")
+    chunk_repository = ChunkRepository(kwargs["repository"], kwargs["password"])
+    RepositoryStatsCommand(chunk_repository, **params).main()
+
+
 # ---------------------------------------------------------------------
 # restore
 # ---------------------------------------------------------------------
 
 
 @cli_entrypoint.command("restore")
-@decorators.common_backup_file()
+@decorators.common_backup_file(required=False)
+@decorators.common_repository()
+@click.option(
+    "-s",
+    "--snapshot",
+    help="Name of the snapshot in the repository; defaults to the latest snapshot",
+    type=str,
+    **config.BASE_CLI_OPTIONS,
+)
+@click.option(
+    "--path",
+    help=(
+        "Glob of files / directories to restore, leaving everything else untouched; "
+        "relative to the home directory if it contains a '/'; multiple allowed"
+    ),
+    multiple=True,
+    type=str,
+    **config.BASE_CLI_OPTIONS,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    default=config.RESTORE_JOBS,
+    help="Number of threads extracting, decompressing and verifying files",
+    type=click.IntRange(min=1),
+    **config.BASE_CLI_OPTIONS,
+)
+@click.option(
+    "--delta/--no-delta",
+    default=False,
+    help=(
+        "Only restore files which differ from their destination, instead of replacing "
+        "whole locations; other files at the destination are kept"
+    ),
+    **config.BASE_CLI_OPTIONS,
+)
+@click.option(
+    "--backup-strategy",
+    default=config.RESTORE_BACKUP_STRATEGY,
+    help=(
+        "How existing paths are backed up before they are replaced; 'rename' moves "
+        "them aside, 'reflink' and 'hardlink' share data with the backup, and 'copy' "
+        "copies it; falls back to copying where needed"
+    ),
+    type=click.Choice(config.BACKUP_STRATEGIES),
+    **config.BASE_CLI_OPTIONS,
+)
 @decorators.common_password(confirmation_prompt=False)
 @click.pass_context
 def restore(ctx, **kwargs) -> t.Any:
     """
     Restore a previous macOS installation backup.
     """
+    from macos_installation.classes.zip import InMemoryZip
+
     params = {**ctx.obj, **kwargs}
     logger.debug(f"Options passed to command 'restore': {pformat(params)}")
-    zip_object = InMemoryZip(kwargs["backup_file"], kwargs["password"])
+    _check_backup_target(params)
+
+    if kwargs["repository"] is not None:
+        from macos_installation.classes.repository import ChunkRepository
+        from macos_installation.cli.restore import RestoreCommand
+
+        chunk_repository = ChunkRepository(kwargs["repository"], kwargs["password"])
+        RestoreCommand(None, chunk_repository, **params).main()
+        return
+
+    with InMemoryZip(
+        kwargs["backup_file"],
+        kwargs["password"],
+        spool_threshold=params["spool_threshold"],
+    ) as zip_object:
+        # The manifest can only be read with the key, so its derivation on a background
+        # thread only overlaps with importing the restore command; the keys of parent
+        # backups are prefetched once their paths are known (see 'RestoreCommand')
+        zip_object.prefetch_key()
+
+        from macos_installation.cli.restore import RestoreCommand
 
-    RestoreCommand(zip_object, **params).main()
+        RestoreCommand(zip_object, **params).main()
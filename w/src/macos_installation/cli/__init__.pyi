@@ -5,4 +5,6 @@ def backup(ctx, **kwargs) -> t.Any: ...
 def decrypt(ctx, **kwargs) -> t.Any: ...
 def encrypt(ctx, **kwargs) -> t.Any: ...
 def print_backup_locations(ctx, **kwargs) -> t.Any: ...
+def repository_gc(ctx, **kwargs) -> t.Any: ...
+def repository_stats(ctx, **kwargs) -> t.Any: ...
 def restore(ctx, **kwargs) -> t.Any: ...
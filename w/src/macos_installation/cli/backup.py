@@ -1,31 +1,64 @@
+import datetime
 import json
 import logging
 import pathlib
+import sys
 import typing as t
+import zipfile
 from pprint import pformat
 
 import click
+import tabulate
 
 from macos_installation import config
-from macos_installation.classes.data import BackupManifest
+from macos_installation.classes.cache import HashCache
+from macos_installation.classes.data import (
+    BackupManifest,
+    BackupPlan,
+    CompressionStatistics,
+)
+from macos_installation.classes.profiler import PROFILER
+from macos_installation.classes.repository import ChunkRepository
 from macos_installation.classes.zip import InMemoryZip
+from macos_installation.functions import archive, compression, planner
 
 logger: logging.Logger = logging.getLogger(__name__)
 
 
 class BackupCommand(object):
-    def __init__(self, zip_object: InMemoryZip, **kwargs):
-        self.backup_file: pathlib.Path = kwargs["backup_file"]
+    def __init__(
+        self,
+        zip_object: t.Optional[InMemoryZip],
+        chunk_repository: t.Optional[ChunkRepository] = None,
+        **kwargs,
+    ):
+        self.backup_file: t.Optional[pathlib.Path] = kwargs["backup_file"]
         self.debug: bool = kwargs["debug"]
         self.dry_run: bool = kwargs["dry_run"]
         self.extra_location: t.List[pathlib.Path] = list(kwargs["extra_location"])
+        self.incremental_from: t.Optional[pathlib.Path] = kwargs["incremental_from"]
+        self.use_hash_cache: bool = kwargs["hash_cache"]
+        self.jobs: int = kwargs["jobs"]
+        self.compression: str = kwargs["compression"]
+        self.exclude: t.List[str] = list(kwargs["exclude"])
+        self.include: t.List[str] = list(kwargs["include"])
+        self.symlinks: str = kwargs["symlinks"]
+        self.plan_format: str = kwargs["plan_format"]
+        self.repository: t.Optional[pathlib.Path] = kwargs["repository"]
+        self.snapshot: str = kwargs["snapshot"] or datetime.datetime.now().strftime(
+            "%Y-%m-%d_%H-%M-%S"
+        )
 
-        # Injected dependencies
+        # Injected dependencies; backups go to a ZIP file, or to a chunk repository
         self.__zip_object = zip_object
+        self.__chunk_repository = chunk_repository
 
         # Evaluated later
         self._backup_locations: t.Optional[t.List[pathlib.Path]] = None
         self._backup_manifest: t.Optional[BackupManifest] = None
+        self._hash_cache: t.Optional[HashCache] = None
+        self._backup_plan: t.Optional[BackupPlan] = None
+        self.compression_statistics = CompressionStatistics()
 
         logger.debug(f"Class 'BackupCommand' instantiated: {pformat(self.__dict__)}")
 
@@ -40,45 +73,345 @@ class BackupCommand(object):
     @property
     def backup_manifest(self) -> BackupManifest:
         if self._backup_manifest is None:
-            self._backup_manifest = BackupManifest(self.backup_locations)
+            self._backup_manifest = BackupManifest(
+                self.backup_locations,
+                # Incremental backups compare every digest against the parent up front;
+                # otherwise digests are recorded while the files are archived
+                hash_files=self.incremental_from is not None,
+                hash_cache=self.hash_cache,
+                excludes=config.BACKUP_EXCLUDES + self.exclude,
+                includes=config.BACKUP_INCLUDES + self.include,
+                symlink_policy=self.symlinks,
+            )
+            if self.incremental_from is not None:
+                self._compare_to_parent()
         return self._backup_manifest
 
-    def main(self) -> t.NoReturn:
+    @property
+    def backup_plan(self) -> BackupPlan:
+        if self._backup_plan is None:
+            stored_files = None
+            if self.backup_manifest.is_incremental:
+                stored_files = set(self.backup_manifest.stored_files)
+
+            backup_files = [
+                backup_file
+                for backup_file in self.backup_manifest.all_backup_files
+                if stored_files is None or str(backup_file) in stored_files
+            ]
+            with PROFILER.phase("plan") as phase:
+                self._backup_plan = planner.plan_backup(
+                    backup_files,
+                    self.backup_locations,
+                    self.repository or self.backup_file,
+                    policy=self.compression,
+                    jobs=self.jobs,
+                    # Backup files are spooled next to the destination before they are
+                    # written; repositories only store new chunks
+                    copies=1 if self.repository else 2,
+                )
+                phase.files = self._backup_plan.files
+                phase.bytes = self._backup_plan.file_size
+        return self._backup_plan
+
+    @property
+    def hash_cache(self) -> t.Optional[HashCache]:
+        # Files stored in a chunk repository are hashed while they are chunked; dry runs
+        # leave the cache on disk alone
+        if (
+            self._hash_cache is None
+            and self.use_hash_cache
+            and not self.repository
+            and not self.dry_run
+        ):
+            self._hash_cache = HashCache(config.HASH_CACHE_PATH)
+        return self._hash_cache
+
+    def _compare_to_parent(self) -> t.NoReturn:
         """
-        Perform the main backup function.
+        Compare the backup manifest against the manifest of the parent backup. Only files
+        which were added or changed since the parent are stored; files which no longer
+        exist are recorded as deleted.
+        """
+        with PROFILER.phase("compare"), InMemoryZip(
+            self.incremental_from,
+            self.__zip_object.key_session,
+            spool_threshold=self.__zip_object.spool_threshold,
+        ) as parent_zip_object, zipfile.ZipFile(
+            parent_zip_object.open_unencrypted(), mode="r"
+        ) as parent_zip:
+            try:
+                parent_manifest, parent_digest = BackupManifest.from_zip_file(
+                    parent_zip
+                )
+            except KeyError:
+                click.secho(
+                    f"File '{self.incremental_from}' is not a backup file!", fg="red"
+                )
+                sys.exit(1)
+
+        parent_digests = parent_manifest.file_digests
+        manifest = self._backup_manifest
+        manifest.parent_backup = str(self.incremental_from)
+        manifest.parent_manifest_digest = parent_digest
+        manifest.stored_files = [
+            path
+            for path, digest in manifest.file_digests.items()
+            if parent_digests.get(path) != digest
+        ]
+        manifest.deleted_files = sorted(
+            set(parent_digests) - set(manifest.file_digests)
+        )
+
+    def _write_files(self, zip_file: zipfile.ZipFile) -> t.NoReturn:
+        """
+        Write the backup files to the ZIP file, recording their digests in the manifest.
+        With more than one job, files are compressed concurrently by worker processes, and
+        written in the same order. Each file is hashed from the same read which compresses
+        it into the backup; files whose digest is already known (from the hash cache, or
+        hashed to compare against the parent backup) are not hashed again. Incremental
+        backups only write the files which were added or changed since the parent backup.
         """
-        message = f"Creating backup file '{self.backup_file.name}' of the following locations:\n"
-        for bl in self.backup_locations:
-            message += f"- {bl.absolute()}\n"
-
-        if not self.dry_run:
-            click.secho(message, fg="green")
-
-            with self.__zip_object.open_zip_file(mode="a") as zip_file:
-                # Write all files
-                for backup_file in self.backup_manifest.all_backup_files:
-                    zip_file.write(backup_file)
-
-                # Add backup manifest of all files, and user information
-                # for later usage
-                zip_file.writestr(
-                    "manifest.json",
-                    json.dumps(
-                        self.backup_manifest.dict(),
-                        default=str,
-                        indent=2,
-                        sort_keys=True,
-                    ),
+        new_cache_entries = []
+
+        stored_files = None
+        if self.backup_manifest.is_incremental:
+            stored_files = set(self.backup_manifest.stored_files)
+
+        # Stat every file before it is read, and look up known digests; the size and
+        # mtime of every file are recorded, so restores can skip unchanged files
+        pending = []
+        for backup_file in self.backup_manifest.all_backup_files:
+            file_stat = backup_file.stat()
+            self.backup_manifest.record_stat(backup_file, file_stat)
+            if stored_files is not None and str(backup_file) not in stored_files:
+                continue
+
+            cached_digest = self.backup_manifest.file_digests.get(str(backup_file))
+            if cached_digest is None and self.hash_cache:
+                cached_digest = self.hash_cache.get(backup_file, file_stat)
+            pending.append((backup_file, file_stat, cached_digest))
+
+        with PROFILER.phase("compress") as phase:
+            digests = archive.write_files_to_zip(
+                zip_file,
+                [(backup_file, cached is None) for backup_file, _, cached in pending],
+                jobs=self.jobs,
+                spool_dir=self.backup_file.parent,
+                policy=self.compression,
+                statistics=self.compression_statistics,
+            )
+            for (backup_file, file_stat, cached_digest), digest in zip(
+                pending, digests
+            ):
+                if digest is not None:
+                    new_cache_entries.append((backup_file, file_stat, digest))
+
+                self.backup_manifest.file_digests[str(backup_file)] = (
+                    digest or cached_digest
                 )
+                phase.files += 1
+                phase.bytes += file_stat.st_size
+
+        if self.hash_cache:
+            self.hash_cache.set_many(new_cache_entries)
+            evicted = self.hash_cache.evict_missing()
+            logger.debug(f"Evicted {evicted} missing files from the hash cache")
+
+    def _print_compression_statistics(self) -> t.NoReturn:
+        """
+        Print the space and time each compression method saved. Time saved is estimated
+        against deflating the same files, at the throughput deflate had in this backup.
+        """
+        table = []
+        for compress_type, codec in sorted(self.compression_statistics.codecs.items()):
+            seconds_saved = self.compression_statistics.seconds_saved(compress_type)
+            table.append(
+                [
+                    compression.COMPRESSION_NAMES.get(compress_type, compress_type),
+                    codec.files,
+                    codec.file_size,
+                    codec.compress_size,
+                    codec.file_size - codec.compress_size,
+                    f"{codec.seconds:.3f}",
+                    # Adding 0.0 avoids printing negative zero
+                    "N/A"
+                    if seconds_saved is None
+                    else f"{round(seconds_saved, 3) + 0.0:.3f}",
+                ]
+            )
+
+        headers = [
+            "Codec",
+            "Files",
+            "Bytes In",
+            "Bytes Out",
+            "Bytes Saved",
+            "Seconds",
+            "Seconds Saved (vs. deflate)",
+        ]
+        click.echo(tabulate.tabulate(table, headers, tablefmt="github"))
+
+    def _print_backup_plan(self) -> t.NoReturn:
+        """
+        Print the backup plan: the files and bytes of each location, the largest files,
+        and the estimated size of the backup and time it takes.
+        """
+        plan = self.backup_plan
+        if self.plan_format == "json":
+            click.echo(json.dumps(plan.dict(), indent=2, sort_keys=True))
+            return
 
-            # Use this temporary variable in case it needs to be updated
-            backup_path = self.backup_file
+        table = [
+            [
+                location.location,
+                location.files,
+                location.file_size,
+                location.estimated_compress_size,
+            ]
+            for location in plan.locations
+        ]
+        table.append(
+            ["Total", plan.files, plan.file_size, plan.estimated_compress_size]
+        )
+        headers = ["Location", "Files", "Bytes", "Estimated Bytes Out"]
+        click.echo(tabulate.tabulate(table, headers, tablefmt="github"))
+        click.echo()
 
-            if self.__zip_object.has_password:
+        headers = ["Largest Files", "Bytes"]
+        click.echo(tabulate.tabulate(plan.largest_files, headers, tablefmt="github"))
+        click.echo()
+
+        table = [
+            ["Hash throughput (bytes/s)", round(plan.hash_throughput)],
+            ["Compress throughput (bytes/s)", round(plan.compress_throughput)],
+            ["Estimated seconds", f"{plan.estimated_seconds:.3f}"],
+            ["Required space (bytes)", plan.required_space],
+            [
+                "Free space (bytes)",
+                "N/A" if plan.free_space is None else plan.free_space,
+            ],
+        ]
+        click.echo(tabulate.tabulate(table, tablefmt="github", disable_numparse=True))
+
+    def _check_free_space(self) -> t.NoReturn:
+        """
+        Warn if the destination of the backup does not have enough free space for it.
+        """
+        plan = self.backup_plan
+        if not plan.has_enough_space:
+            click.secho(
+                f"Warning: not enough free space for '{plan.destination}'; "
+                f"the backup needs about {plan.required_space} bytes, "
+                f"but only {plan.free_space} bytes are free",
+                fg="yellow",
+            )
+
+    def _write_snapshot(self) -> t.NoReturn:
+        """
+        Store all backup files in the chunk repository, recording their digests in the
+        manifest, and then store the snapshot which references their chunks.
+        """
+        with self.__chunk_repository.lock():
+            self._store_files()
+
+        click.secho(
+            f"Stored {self.__chunk_repository.new_chunks} new chunks "
+            f"({self.__chunk_repository.new_chunk_bytes} bytes); "
+            f"{self.__chunk_repository.reused_chunks} chunks were already stored",
+            fg="green",
+        )
+
+    def _store_files(self) -> t.NoReturn:
+        files = {}
+        with PROFILER.phase("store") as phase:
+            for backup_file in self.backup_manifest.all_backup_files:
+                file_stat = backup_file.stat()
+                self.backup_manifest.record_stat(backup_file, file_stat)
+                digest, chunk_references = self.__chunk_repository.write_file(
+                    backup_file
+                )
+                self.backup_manifest.file_digests[str(backup_file)] = digest
+                files[str(backup_file)] = chunk_references
+                phase.files += 1
+                phase.bytes += file_stat.st_size
+
+        self.__chunk_repository.write_snapshot(
+            self.snapshot, self.backup_manifest.dict(), files
+        )
+
+    def _write_zip_file(self) -> t.NoReturn:
+        """
+        Write all backup files and the manifest to the ZIP file, encrypt it if a
+        password was given, and write it to the backup file.
+        """
+        with self.__zip_object.open_zip_file(mode="a") as zip_file:
+            # Write all files
+            self._write_files(zip_file)
+
+            # Add backup manifest of all files, and user information
+            # for later usage
+            zip_file.writestr(
+                BackupManifest.MANIFEST_NAME,
+                json.dumps(
+                    self.backup_manifest.dict(),
+                    default=str,
+                    indent=2,
+                    sort_keys=True,
+                ),
+            )
+
+        # Use this temporary variable in case it needs to be updated
+        backup_path = self.backup_file
+
+        if self.__zip_object.has_password:
+            with PROFILER.phase("encrypt") as phase:
+                phase.bytes = self.__zip_object.size
                 self.__zip_object.encrypt()
-                backup_path = pathlib.Path(f"{backup_path.absolute()}.enc")
+            backup_path = pathlib.Path(f"{backup_path.absolute()}.enc")
 
+        with PROFILER.phase("write") as phase:
+            phase.bytes = self.__zip_object.size
             self.__zip_object.write_to_file(backup_path)
-        else:
-            message = f"[DRY-RUN] {message}"
-            click.secho(message, fg="yellow")
+        self._print_compression_statistics()
+
+    def main(self) -> t.NoReturn:
+        """
+        Perform the main backup function.
+        """
+        try:
+            if self.repository:
+                target = f"snapshot '{self.snapshot}' in repository '{self.repository}'"
+            else:
+                target = f"backup file '{self.backup_file.name}'"
+
+            message = f"Creating {target} of the following locations:\n"
+            for bl in self.backup_locations:
+                message += f"- {bl.absolute()}\n"
+
+            if self.incremental_from is not None:
+                message += (
+                    f"Incremental backup of '{self.incremental_from.name}': "
+                    f"{len(self.backup_manifest.stored_files)} added or changed files, "
+                    f"{len(self.backup_manifest.deleted_files)} deleted files\n"
+                )
+
+            if not self.dry_run:
+                click.secho(message, fg="green")
+                self._check_free_space()
+
+                if self.repository:
+                    self._write_snapshot()
+                else:
+                    self._write_zip_file()
+            elif self.plan_format == "json":
+                # Only the plan is printed, so it can be parsed
+                self._print_backup_plan()
+            else:
+                message = f"[DRY-RUN] {message}"
+                click.secho(message, fg="yellow")
+                self._print_backup_plan()
+                self._check_free_space()
+        finally:
+            if self._hash_cache is not None:
+                self._hash_cache.close()
@@ -1,20 +1,48 @@
 import pathlib
 import typing as t
 
-from macos_installation.classes.data import BackupManifest  # type: ignore
+from macos_installation.classes.cache import HashCache  # type: ignore
+from macos_installation.classes.data import (  # type: ignore
+    BackupManifest,
+    BackupPlan,
+    CompressionStatistics,
+)
+from macos_installation.classes.repository import ChunkRepository  # type: ignore
 from macos_installation.classes.zip import InMemoryZip  # type: ignore
 
 class BackupCommand:
-    backup_file: pathlib.Path
+    backup_file: t.Optional[pathlib.Path]
     debug: bool
     dry_run: bool
     extra_location: t.List[pathlib.Path]
-    def __init__(self, zip_object: InMemoryZip, **kwargs) -> None:
+    incremental_from: t.Optional[pathlib.Path]
+    use_hash_cache: bool
+    jobs: int
+    compression: str
+    exclude: t.List[str]
+    include: t.List[str]
+    symlinks: str
+    plan_format: str
+    compression_statistics: CompressionStatistics
+    repository: t.Optional[pathlib.Path]
+    snapshot: str
+    def __init__(
+        self,
+        zip_object: t.Optional[InMemoryZip],
+        chunk_repository: t.Optional[ChunkRepository] = ...,
+        **kwargs,
+    ) -> None:
         self._backup_locations = None
         self._backup_manifest = None
+        self._hash_cache = None
+        self._backup_plan = None
         ...
     @property
     def backup_locations(self) -> t.List[pathlib.Path]: ...
     @property
     def backup_manifest(self) -> BackupManifest: ...
+    @property
+    def backup_plan(self) -> BackupPlan: ...
+    @property
+    def hash_cache(self) -> t.Optional[HashCache]: ...
     def main(self) -> t.NoReturn: ...
@@ -6,7 +6,9 @@ import click
 from macos_installation import config
 
 
-def common_backup_file(exists: bool = True) -> t.Callable:
+def common_backup_file(
+    exists: bool = True, required: bool = True, multiple: bool = False
+) -> t.Callable:
     def inner_f(f):
         """
         The inner_f function is a decorator that takes the function f as an argument.
@@ -19,8 +21,13 @@ def common_backup_file(exists: bool = True) -> t.Callable:
         f = click.option(
             "-b",
             "--backup-file",
-            help="Location of backup/restore ZIP file",
-            required=True,
+            help=(
+                "Location of backup/restore ZIP file; can be given multiple times"
+                if multiple
+                else "Location of backup/restore ZIP file"
+            ),
+            multiple=multiple,
+            required=required,
             type=click.Path(exists=exists, path_type=pathlib.Path, resolve_path=True),
             **config.BASE_CLI_OPTIONS,
         )(f)
@@ -63,3 +70,71 @@ def common_password(
         return f
 
     return inner_f
+
+
+def common_kdf() -> t.Callable:
+    """
+    The common_kdf function is a decorator that adds the key derivation options to a
+    click command which encrypts data. By default the fixed scrypt parameters are used;
+    with calibration enabled, the strongest parameters within the time and memory budget
+    of the current host are used instead. The parameters are stored in the encrypted file.
+
+    :return: A function that is decorated with the click options
+    """
+
+    def inner_f(f):
+        f = click.option(
+            "--kdf-memory-limit",
+            default=config.KDF_MEMORY_LIMIT // 1024**2,
+            help="Maximum memory (MiB) used by key derivation when calibrating",
+            type=click.IntRange(min=1),
+            **config.BASE_CLI_OPTIONS,
+        )(f)
+        f = click.option(
+            "--kdf-time-target",
+            default=config.KDF_TIME_TARGET,
+            help="Target time (seconds) of key derivation when calibrating",
+            type=click.FloatRange(min=0, min_open=True),
+            **config.BASE_CLI_OPTIONS,
+        )(f)
+        f = click.option(
+            "--kdf-calibrate/--no-kdf-calibrate",
+            default=False,
+            help="Calibrate key derivation parameters for this host",
+            **config.BASE_CLI_OPTIONS,
+        )(f)
+
+        return f
+
+    return inner_f
+
+
+def common_repository(exists: bool = True, required: bool = False) -> t.Callable:
+    """
+    The common_repository function is a decorator that adds the chunk repository option
+    to a click command. A chunk repository is a directory which stores the files of all
+    its backups as deduplicated chunks, instead of in a separate ZIP file per backup.
+
+    :param exists:bool=True: Determine if the repository must already exist
+    :param required:bool=False: Tell click that the parameter is required
+    :return: A function that is decorated with the click option
+    """
+
+    def inner_f(f):
+        f = click.option(
+            "-r",
+            "--repository",
+            help="Location of deduplicating chunk repository",
+            required=required,
+            type=click.Path(
+                exists=exists,
+                file_okay=False,
+                path_type=pathlib.Path,
+                resolve_path=True,
+            ),
+            **config.BASE_CLI_OPTIONS,
+        )(f)
+
+        return f
+
+    return inner_f
@@ -1,6 +1,10 @@
 import typing as t
 
-def common_backup_file(exists: bool = ...) -> t.Callable: ...
+def common_backup_file(
+    exists: bool = ..., required: bool = ..., multiple: bool = ...
+) -> t.Callable: ...
 def common_password(
     confirmation_prompt: bool = ..., prompt_required: bool = ..., required: bool = ...
 ) -> t.Callable: ...
+def common_kdf() -> t.Callable: ...
+def common_repository(exists: bool = ..., required: bool = ...) -> t.Callable: ...
@@ -1,28 +1,97 @@
+import concurrent.futures
+import contextlib
 import logging
+import os
 import pathlib
+import sys
 import typing as t
 from pprint import pformat
 
 import click
 
+from macos_installation.classes.profiler import PROFILER
+from macos_installation.classes.session import KeySession
 from macos_installation.classes.zip import InMemoryZip
+from macos_installation.functions import encryption, util
 
 logger: logging.Logger = logging.getLogger(__name__)
 
 
 class DecryptCommand(object):
-    def __init__(self, zip_object: InMemoryZip, **kwargs):
+    def __init__(self, key_session: KeySession, **kwargs):
         self.debug: bool = kwargs["debug"]
         self.dry_run: bool = kwargs["dry_run"]
+        self.backup_files: t.List[pathlib.Path] = list(kwargs["backup_file"])
+        self.jobs: int = kwargs["jobs"]
 
-        self.__zip_object = zip_object
+        self.__key_session = key_session
 
         logger.debug(f"Class 'DecryptCommand' instantiated: {pformat(self.__dict__)}")
 
+    def _decrypt_file(self, file_path: pathlib.Path) -> t.Optional[pathlib.Path]:
+        """
+        The _decrypt_file function streams an encrypted file through the decryption into
+        a new file next to it, one segment at a time, so memory use does not grow with
+        the file size. Every segment is authenticated before it is written; if one fails,
+        a ValueError is raised and the new file is discarded. A wrong password raises an
+        InvalidPasswordError instead.
+
+        :param self: Access the attributes of the class
+        :param file_path:pathlib.Path: File to decrypt
+        :return: The decrypted file, or None if the file is not encrypted
+        """
+        with InMemoryZip(file_path) as zip_object:
+            if not zip_object.is_encrypted:
+                return None
+
+        decrypted_file_path = pathlib.Path(str(file_path).removesuffix(".enc"))
+        with contextlib.ExitStack() as stack:
+            phase = stack.enter_context(PROFILER.phase("decrypt"))
+            src = stack.enter_context(file_path.open("rb"))
+            dst = stack.enter_context(util.atomic_write(decrypted_file_path))
+            phase.bytes = os.fstat(src.fileno()).st_size
+            phase.files = 1
+            encryption.decrypt_stream(src, dst, self.__key_session)
+
+        return decrypted_file_path
+
     def main(self) -> t.NoReturn:
-        self.__zip_object.decrypt()
-        decrypted_file_path = pathlib.Path(
-            f"{str(self.__zip_object.file_path.absolute()).replace('.enc', '')}"
-        )
-        self.__zip_object.write_to_file(decrypted_file_path)
-        click.secho(f"Decrypted file written to '{decrypted_file_path}'", fg="green")
+        with contextlib.ExitStack() as stack:
+            if self.jobs > 1:
+                executor = stack.enter_context(
+                    concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs)
+                )
+                decrypted_file_paths = executor.map(
+                    self._decrypt_file, self.backup_files
+                )
+            else:
+                decrypted_file_paths = map(self._decrypt_file, self.backup_files)
+
+            for file_path in self.backup_files:
+                try:
+                    decrypted_file_path = next(decrypted_file_paths)
+                except encryption.InvalidPasswordError:
+                    if self.jobs > 1:
+                        executor.shutdown(cancel_futures=True)
+                    click.secho(
+                        f"Password for encrypted ZIP file '{file_path.name}' "
+                        "was incorrect!",
+                        fg="red",
+                    )
+                    sys.exit(1)
+                except ValueError:
+                    if self.jobs > 1:
+                        executor.shutdown(cancel_futures=True)
+                    click.secho(
+                        f"File '{file_path.name}' is corrupt or truncated!", fg="red"
+                    )
+                    sys.exit(1)
+
+                if decrypted_file_path is None:
+                    click.secho(
+                        f"File '{file_path}' is not encrypted, skipping", fg="yellow"
+                    )
+                    continue
+                click.secho(
+                    f"Decrypted file written to '{decrypted_file_path}'", fg="green"
+                )
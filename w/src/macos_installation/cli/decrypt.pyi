@@ -1,9 +1,12 @@
+import pathlib
 import typing as t
 
-from macos_installation.classes.zip import InMemoryZip  # type: ignore
+from macos_installation.classes.session import KeySession  # type: ignore
 
 class DecryptCommand:
     debug: bool
     dry_run: bool
-    def __init__(self, zip_object: InMemoryZip, **kwargs) -> None: ...
+    backup_files: t.List[pathlib.Path]
+    jobs: int
+    def __init__(self, key_session: KeySession, **kwargs) -> None: ...
     def main(self) -> t.NoReturn: ...
@@ -1,28 +1,77 @@
+import concurrent.futures
+import contextlib
 import logging
+import os
 import pathlib
 import typing as t
 from pprint import pformat
 
 import click
 
+from macos_installation.classes.profiler import PROFILER
+from macos_installation.classes.session import KeySession
 from macos_installation.classes.zip import InMemoryZip
+from macos_installation.functions import encryption, util
 
 logger: logging.Logger = logging.getLogger(__name__)
 
 
 class EncryptCommand(object):
-    def __init__(self, zip_object: InMemoryZip, **kwargs):
+    def __init__(self, key_session: KeySession, **kwargs):
         self.debug: bool = kwargs["debug"]
         self.dry_run: bool = kwargs["dry_run"]
+        self.backup_files: t.List[pathlib.Path] = list(kwargs["backup_file"])
+        self.jobs: int = kwargs["jobs"]
 
-        self.__zip_object = zip_object
+        self.__key_session = key_session
 
         logger.debug(f"Class 'EncryptCommand' instantiated: {pformat(self.__dict__)}")
 
+    def _encrypt_file(self, file_path: pathlib.Path) -> t.Optional[pathlib.Path]:
+        """
+        The _encrypt_file function streams a file through the encryption into a new file
+        next to it, one segment at a time, so memory use does not grow with the file size.
+
+        :param self: Access the attributes of the class
+        :param file_path:pathlib.Path: File to encrypt
+        :return: The encrypted file, or None if the file is already encrypted
+        """
+        with InMemoryZip(file_path) as zip_object:
+            if zip_object.is_encrypted:
+                return None
+
+        encrypted_file_path = pathlib.Path(f"{file_path}.enc")
+        with contextlib.ExitStack() as stack:
+            phase = stack.enter_context(PROFILER.phase("encrypt"))
+            src = stack.enter_context(file_path.open("rb"))
+            dst = stack.enter_context(util.atomic_write(encrypted_file_path))
+            phase.bytes = os.fstat(src.fileno()).st_size
+            phase.files = 1
+            encryption.encrypt_stream(src, dst, self.__key_session)
+
+        return encrypted_file_path
+
     def main(self) -> t.NoReturn:
-        self.__zip_object.encrypt()
-        encrypted_file_path = pathlib.Path(
-            f"{self.__zip_object.file_path.absolute()}.enc"
-        )
-        self.__zip_object.write_to_file(encrypted_file_path)
-        click.secho(f"Encrypted file written to '{encrypted_file_path}'", fg="green")
+        with contextlib.ExitStack() as stack:
+            if self.jobs > 1:
+                executor = stack.enter_context(
+                    concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs)
+                )
+                encrypted_file_paths = executor.map(
+                    self._encrypt_file, self.backup_files
+                )
+            else:
+                encrypted_file_paths = map(self._encrypt_file, self.backup_files)
+
+            for file_path, encrypted_file_path in zip(
+                self.backup_files, encrypted_file_paths
+            ):
+                if encrypted_file_path is None:
+                    click.secho(
+                        f"File '{file_path}' is already encrypted, skipping",
+                        fg="yellow",
+                    )
+                    continue
+                click.secho(
+                    f"Encrypted file written to '{encrypted_file_path}'", fg="green"
+                )
@@ -0,0 +1,78 @@
+import logging
+import typing as t
+from pprint import pformat
+
+import click
+import tabulate
+
+from macos_installation.classes.repository import ChunkRepository
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class RepositoryGcCommand(object):
+    def __init__(self, chunk_repository: ChunkRepository, **kwargs):
+        self.debug: bool = kwargs["debug"]
+        self.dry_run: bool = kwargs["dry_run"]
+
+        # Injected dependencies
+        self.__chunk_repository = chunk_repository
+
+        logger.debug(
+            f"Class 'RepositoryGcCommand' instantiated: {pformat(self.__dict__)}"
+        )
+
+    def main(self) -> t.NoReturn:
+        """
+        Remove the chunks which are not referenced by any snapshot.
+        """
+        removed_files, removed_bytes = self.__chunk_repository.garbage_collect(
+            dry_run=self.dry_run
+        )
+        message = (
+            f"Removed {removed_files} unreferenced files ({removed_bytes} bytes) "
+            f"from repository '{self.__chunk_repository.path}'"
+        )
+
+        if not self.dry_run:
+            click.secho(message, fg="green")
+        else:
+            click.secho(f"[DRY-RUN] {message}", fg="yellow")
+
+
+class RepositoryStatsCommand(object):
+    def __init__(self, chunk_repository: ChunkRepository, **kwargs):
+        self.debug: bool = kwargs["debug"]
+        self.dry_run: bool = kwargs["dry_run"]
+        self.tablefmt: str = kwargs["tablefmt"]
+
+        # Injected dependencies
+        self.__chunk_repository = chunk_repository
+
+        logger.debug(
+            f"Class 'RepositoryStatsCommand' instantiated: {pformat(self.__dict__)}"
+        )
+
+    def main(self) -> t.NoReturn:
+        """
+        Print the size of the repository, and how well its contents deduplicate.
+        """
+        statistics = self.__chunk_repository.statistics()
+        table = [
+            ["Snapshots", statistics["snapshots"]],
+            ["Files (all snapshots)", statistics["files"]],
+            ["Unique chunks", statistics["chunks"]],
+            ["Logical size (bytes)", statistics["logical_size"]],
+            ["Unique size (bytes)", statistics["unique_size"]],
+            ["Stored size (bytes)", statistics["stored_size"]],
+            ["Deduplication ratio", f"{statistics['dedup_ratio']:.2f}"],
+            ["Compression ratio", f"{statistics['compression_ratio']:.2f}"],
+        ]
+        print(
+            tabulate.tabulate(
+                table,
+                ["Statistic", "Value"],
+                tablefmt=self.tablefmt,
+                disable_numparse=True,
+            )
+        )
@@ -0,0 +1,16 @@
+import typing as t
+
+from macos_installation.classes.repository import ChunkRepository  # type: ignore
+
+class RepositoryGcCommand:
+    debug: bool
+    dry_run: bool
+    def __init__(self, chunk_repository: ChunkRepository, **kwargs) -> None: ...
+    def main(self) -> t.NoReturn: ...
+
+class RepositoryStatsCommand:
+    debug: bool
+    dry_run: bool
+    tablefmt: str
+    def __init__(self, chunk_repository: ChunkRepository, **kwargs) -> None: ...
+    def main(self) -> t.NoReturn: ...
@@ -1,10 +1,15 @@
-import json
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
 import logging
 import os
 import pathlib
 import shutil
+import stat
 import sys
 import tempfile
+import threading
 import typing as t
 import zipfile
 from pprint import pformat
@@ -13,52 +18,587 @@ import click
 
 from macos_installation import config
 from macos_installation.classes.data import BackupManifest
+from macos_installation.classes.profiler import PROFILER
+from macos_installation.classes.repository import ChunkReference, ChunkRepository
 from macos_installation.classes.zip import InMemoryZip
-from macos_installation.functions import template, util
+from macos_installation.functions import archive, template, util
 
 logger: logging.Logger = logging.getLogger(__name__)
 
 
 class RestoreCommand(object):
-    def __init__(self, zip_object: InMemoryZip, **kwargs):
+    def __init__(
+        self,
+        zip_object: t.Optional[InMemoryZip],
+        chunk_repository: t.Optional[ChunkRepository] = None,
+        **kwargs,
+    ):
         self.debug: bool = kwargs["debug"]
         self.dry_run: bool = kwargs["dry_run"]
+        self.snapshot: t.Optional[str] = kwargs["snapshot"]
+        self.path: t.List[str] = list(kwargs["path"])
+        self.jobs: int = kwargs["jobs"]
+        self.delta: bool = kwargs["delta"]
+        self.backup_strategy: str = kwargs["backup_strategy"]
 
-        # Injected dependencies
+        # Injected dependencies; backups come from a ZIP file, or a chunk repository
         self.__zip_object = zip_object
+        self.__chunk_repository = chunk_repository
 
         # Evaluated later
         self._backup_manifest: t.Optional[BackupManifest] = None
-        self._temp_dir: t.Optional[tempfile.TemporaryDirectory] = None
+        self._selected_files: t.Optional[t.List[str]] = None
+        self.__restore_zip: t.Optional[zipfile.ZipFile] = None
+        self.__snapshot_files: t.Optional[t.Dict[str, t.List[ChunkReference]]] = None
+
+        # Backups opened by each restore thread, and the handles to close afterwards
+        self.__local = threading.local()
+        self.__handles: t.Optional[contextlib.ExitStack] = None
+        self.__handles_lock = threading.Lock()
 
         logger.debug(f"Class 'RestoreCommand' instantiated: {pformat(self.__dict__)}")
 
     @property
     def backup_manifest(self) -> BackupManifest:
-        if self._backup_manifest is None:
-            restore_zip = zipfile.ZipFile(
-                self.__zip_object.read_unencrypted(),
-                mode="r",
-                compression=zipfile.ZIP_DEFLATED,
+        if self._backup_manifest is None and self.__chunk_repository is not None:
+            self._read_snapshot()
+        elif self._backup_manifest is None:
+            # Only the central directory and the manifest are read here; members are
+            # read while they are restored
+            with PROFILER.phase("open"):
+                try:
+                    self.__restore_zip = zipfile.ZipFile(
+                        self.__zip_object.open_unencrypted(),
+                        mode="r",
+                        compression=zipfile.ZIP_DEFLATED,
+                    )
+                except (zipfile.BadZipFile, ValueError):
+                    # Unencrypted archives are recognized by their first bytes alone;
+                    # memory maps raise ValueError when seeking before the start
+                    click.secho(
+                        f"File '{self.__zip_object.file_path}' is corrupt!", fg="red"
+                    )
+                    sys.exit(1)
+                self._backup_manifest, _ = BackupManifest.from_zip_file(
+                    self.__restore_zip
+                )
+            self._prefetch_parent_key(
+                self._backup_manifest, self.__zip_object.file_path
             )
 
-            # Extract contents
-            restore_zip.extractall(path=self.temp_dir.name)
+        return self._backup_manifest
+
+    @property
+    def selected_files(self) -> t.List[str]:
+        """
+        The files of the backup to restore: all of them, or those matching the '--path'
+        patterns. A file also matches if one of its parent directories does.
+        """
+        if self._selected_files is None:
+            if not self.path:
+                self._selected_files = list(self.backup_manifest.file_digests)
+            else:
+                self._selected_files = self._match_files(self.backup_manifest)
+
+        return self._selected_files
 
-            # Get the info dict
-            temp_json: t.Dict[str, str] = json.loads(
-                restore_zip.read("manifest.json").decode(config.DEFAULT_ENCODING)
+    def _match_files(self, manifest: BackupManifest) -> t.List[str]:
+        """
+        Return the files of the manifest matching the '--path' patterns (see
+        'util.compile_path_patterns'). Relative patterns, and patterns in the current home
+        directory, are anchored to the home directory the backup was made from. Exits with
+        an error message if no file matches.
+        """
+        current_home_dir = str(config.CURRENT_USER_HOME_DIR)
+        patterns = []
+        for pattern in self.path:
+            pattern = os.path.expanduser(pattern)
+            if pattern.startswith(f"{current_home_dir}/"):
+                pattern = (
+                    str(manifest.old_user_home_dir) + pattern[len(current_home_dir) :]
+                )
+            patterns.append(pattern)
+
+        matches = util.compile_path_patterns(
+            patterns, base_dir=manifest.old_user_home_dir
+        )
+        matched_files = [
+            file_path
+            for file_path in manifest.file_digests
+            if any(
+                matches(str(p), p.name)
+                for p in [
+                    pathlib.PurePath(file_path),
+                    *pathlib.PurePath(file_path).parents,
+                ]
             )
-            self._backup_manifest = BackupManifest(existing=True, **temp_json)
+        ]
 
-        return self._backup_manifest
+        if not matched_files:
+            click.secho(
+                f"No files in the backup match the paths: {', '.join(self.path)}",
+                fg="red",
+            )
+            sys.exit(1)
 
-    @property
-    def temp_dir(self) -> tempfile.TemporaryDirectory:
-        if self._temp_dir is None:
-            self._temp_dir = tempfile.TemporaryDirectory()
+        return matched_files
+
+    def _read_snapshot(self) -> t.NoReturn:
+        """
+        Read the manifest and the chunk references of the snapshot (by default, the latest)
+        from the chunk repository.
+        """
+        if self.snapshot is None:
+            snapshot_names = self.__chunk_repository.snapshot_names()
+            if not snapshot_names:
+                click.secho(
+                    f"Repository '{self.__chunk_repository.path}' has no snapshots!",
+                    fg="red",
+                )
+                sys.exit(1)
+            self.snapshot = snapshot_names[-1]
+
+        with PROFILER.phase("open"):
+            snapshot = self.__chunk_repository.read_snapshot(self.snapshot)
+        self._backup_manifest = BackupManifest(existing=True, **snapshot["manifest"])
+        self.__snapshot_files = snapshot["files"]
+
+    def _backup_chain(
+        self,
+    ) -> t.Iterator[t.Tuple[BackupManifest, zipfile.ZipFile, pathlib.Path]]:
+        """
+        Yield the manifest, contents and location of the backup, followed by those of its
+        parents if it is an incremental backup. Parent backups are opened with the same key
+        session, and only once they are needed; each is closed again before the next one is
+        opened.
+        """
+        manifest, backup_file = self.backup_manifest, self.__zip_object.file_path
+        yield manifest, self.__restore_zip, backup_file
+
+        while manifest.is_incremental:
+            try:
+                parent_file = manifest.parent_backup_path(backup_file)
+            except FileNotFoundError as e:
+                click.secho(f"{e}!", fg="red")
+                sys.exit(1)
+
+            with InMemoryZip(
+                parent_file,
+                self.__zip_object.key_session,
+                spool_threshold=self.__zip_object.spool_threshold,
+            ) as parent_zip_object, zipfile.ZipFile(
+                parent_zip_object.open_unencrypted(), mode="r"
+            ) as parent_zip:
+                parent_manifest, parent_digest = BackupManifest.from_zip_file(
+                    parent_zip
+                )
+                if parent_digest != manifest.parent_manifest_digest:
+                    click.secho(
+                        f"Parent backup '{parent_file}' does not match the backup "
+                        f"'{backup_file.name}' was made from!",
+                        fg="red",
+                    )
+                    sys.exit(1)
+
+                logger.debug(f"Restoring files from parent backup '{parent_file}'")
+                self._prefetch_parent_key(parent_manifest, parent_file)
+                yield parent_manifest, parent_zip, parent_file
+
+            manifest, backup_file = parent_manifest, parent_file
+
+    def _prefetch_parent_key(
+        self, manifest: BackupManifest, backup_file: pathlib.Path
+    ) -> t.NoReturn:
+        """
+        Start deriving the key of the parent of an incremental backup on a background
+        thread, as soon as its manifest has been read, so the derivation overlaps with the
+        work done before the parent is opened (e.g. comparing files in delta mode, and
+        planning the members of the backup). A missing parent is reported when it is
+        opened.
+        """
+        if not manifest.is_incremental:
+            return
+
+        try:
+            parent_file = manifest.parent_backup_path(backup_file)
+        except FileNotFoundError:
+            return
+
+        with InMemoryZip(
+            parent_file, self.__zip_object.key_session
+        ) as parent_zip_object:
+            parent_zip_object.prefetch_key()
+
+    def _plan_members(
+        self, file_paths: t.Iterable[str]
+    ) -> t.List[t.Tuple[str, t.Optional[pathlib.Path]]]:
+        """
+        Return each of the given files with the backup it is read from (None for a chunk
+        repository). Members of a backup are listed in central directory offset order, so
+        the archive is read front to back. Files which an incremental backup did not store
+        are read from the nearest parent backup which stored them, walking the chain until
+        every file is found; only the manifests of the chain are read here.
+        """
+        if self.__chunk_repository is not None:
+            return [(file_path, None) for file_path in sorted(file_paths)]
+
+        remaining = set(file_paths)
+        members = []
+
+        with contextlib.closing(self._backup_chain()) as backup_chain:
+            for manifest, zip_file, backup_file in backup_chain:
+                stored_files = remaining.intersection(manifest.files_stored())
+                members.extend(
+                    (stored_file, backup_file)
+                    for stored_file in sorted(
+                        stored_files,
+                        key=lambda f: zip_file.getinfo(
+                            archive.get_arcname(f)
+                        ).header_offset,
+                    )
+                )
+                remaining -= stored_files
+
+                if not remaining:
+                    return members
+
+        click.secho(
+            f"Backup chain of '{self.__zip_object.file_path.name}' is missing "
+            f"{len(remaining)} files!",
+            fg="red",
+        )
+        sys.exit(1)
+
+    def _zip_file(self, backup_file: pathlib.Path) -> zipfile.ZipFile:
+        """
+        Return the backup opened for reading by the current thread. Each thread opens the
+        backups it reads from itself, so threads never share a file position; the handles
+        are closed once all files are staged.
+        """
+        if not hasattr(self.__local, "zip_files"):
+            self.__local.zip_files = {}
+        zip_files = self.__local.zip_files
+        if backup_file not in zip_files:
+            with self.__handles_lock:
+                zip_object = self.__handles.enter_context(
+                    InMemoryZip(
+                        backup_file,
+                        self.__zip_object.key_session,
+                        spool_threshold=self.__zip_object.spool_threshold,
+                    )
+                )
+                zip_files[backup_file] = self.__handles.enter_context(
+                    zipfile.ZipFile(zip_object.open_unencrypted(), mode="r")
+                )
+
+        return zip_files[backup_file]
+
+    @staticmethod
+    def _is_legacy_encrypted(backup_file: pathlib.Path) -> bool:
+        """
+        Return whether the backup is encrypted in the legacy format, which can only be
+        decrypted as a whole.
+        """
+        with InMemoryZip(backup_file) as zip_object:
+            return zip_object.is_legacy_encrypted
+
+    def _stage_member(
+        self,
+        file_path: str,
+        backup_file: t.Optional[pathlib.Path],
+        staged_path: t.Optional[pathlib.Path],
+    ) -> str:
+        """
+        Stream the contents of a file out of the backup (or chunk repository) to its
+        staging path, or nowhere in dry-run mode, hashing them on the way.
+
+        :return: The sha256 hash of the contents
+        """
+        digest = hashlib.sha256()
+        with contextlib.ExitStack() as stack:
+            if backup_file is None:
+                contents = self.__chunk_repository.read_file(
+                    self.__snapshot_files[file_path]
+                )
+            else:
+                member = stack.enter_context(
+                    self._zip_file(backup_file).open(archive.get_arcname(file_path))
+                )
+                contents = iter(
+                    functools.partial(member.read, config.COPY_BUFFER_SIZE), b""
+                )
+
+            f = stack.enter_context(staged_path.open("wb")) if staged_path else None
+            for block in contents:
+                digest.update(block)
+                if f is not None:
+                    f.write(block)
+
+        # Restored files keep their mtime, so later delta restores can skip them cheaply
+        file_stat = self.backup_manifest.file_stats.get(file_path)
+        if staged_path is not None and file_stat is not None:
+            os.utime(staged_path, ns=(file_stat[1], file_stat[1]))
+
+        return digest.hexdigest()
+
+    def _stage_files(
+        self, staged_paths: t.Dict[str, t.Optional[pathlib.Path]]
+    ) -> t.NoReturn:
+        """
+        Stage the given files, with 'jobs' threads reading, decompressing, hashing and
+        writing files concurrently (decompression, decryption and hashing release the GIL).
+        Files are scheduled in archive order, and staging directories must already exist,
+        so threads never race to create them. Exits with an error message if the contents
+        of any file do not match the digest in the manifest.
+
+        :param staged_paths:t.Dict[str, t.Optional[pathlib.Path]]: Files to stage, and their staging paths
+        """
+        members = self._plan_members(staged_paths)
+        self.__local = threading.local()
+
+        # Every thread opens the backups itself, and backups in the legacy encryption
+        # format can only be decrypted as a whole; they are restored by one thread, so
+        # they are only decrypted once
+        jobs = self.jobs
+        if jobs > 1 and any(
+            self._is_legacy_encrypted(backup_file)
+            for backup_file in {b for _, b in members if b is not None}
+        ):
+            logger.debug("Restoring with 1 thread from legacy encrypted backups")
+            jobs = 1
+        if jobs == 1 and self.__zip_object is not None:
+            # Files are staged by this thread, which already opened the backup to read
+            # its manifest
+            self.__local.zip_files = {self.__zip_object.file_path: self.__restore_zip}
+
+        with contextlib.ExitStack() as self.__handles, contextlib.ExitStack() as stack:
+            phase = stack.enter_context(PROFILER.phase("restore"))
+            if jobs > 1:
+                executor = stack.enter_context(
+                    concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+                )
+                digests = executor.map(
+                    lambda m: self._stage_member(*m, staged_paths[m[0]]), members
+                )
+            else:
+                digests = (self._stage_member(*m, staged_paths[m[0]]) for m in members)
+
+            for (file_path, _), digest in zip(members, digests):
+                phase.files += 1
+                phase.bytes += self.backup_manifest.file_stats.get(file_path, [0])[0]
+                if digest != self.backup_manifest.file_digests[file_path]:
+                    if jobs > 1:
+                        executor.shutdown(cancel_futures=True)
+                    click.secho(
+                        f"Contents of '{file_path}' do not match the backup manifest!",
+                        fg="red",
+                    )
+                    sys.exit(1)
+
+    @staticmethod
+    def _staging_path(restore_location: pathlib.Path, directory: bool) -> pathlib.Path:
+        """
+        Create a staging file (or directory) next to the restore location, so it is on the
+        same filesystem and can be renamed into place. Its mode is the default for new
+        files (or directories), rather than the private mode of temporary files.
+        """
+        restore_location.parent.mkdir(parents=True, exist_ok=True)
+        prefix = f".{restore_location.name}.restore-"
+
+        if directory:
+            staging_path = pathlib.Path(
+                tempfile.mkdtemp(dir=restore_location.parent, prefix=prefix)
+            )
+            os.chmod(staging_path, 0o777 & ~util.get_umask())
+        else:
+            fd, name = tempfile.mkstemp(dir=restore_location.parent, prefix=prefix)
+            os.close(fd)
+            staging_path = pathlib.Path(name)
+            os.chmod(staging_path, 0o666 & ~util.get_umask())
+
+        return staging_path
+
+    def _replace_path(
+        self, restore_location: pathlib.Path, staged_path: pathlib.Path
+    ) -> t.NoReturn:
+        """
+        Rename a staged file or directory to its restore location, after backing up and
+        removing whatever is there. By default, existing paths are renamed aside rather
+        than copied, since they are about to be replaced anyway.
+        """
+        with PROFILER.phase("replace"):
+            if restore_location.exists():
+                backup_path = util.create_backup(
+                    restore_location, strategy=self.backup_strategy
+                )
+                click.secho(
+                    f"Path '{restore_location}' exists. "
+                    f"Creating backup to '{backup_path}'.",
+                    fg="yellow",
+                )
+
+            if restore_location.is_dir() and not restore_location.is_symlink():
+                shutil.rmtree(restore_location)
+            elif os.path.lexists(restore_location):
+                restore_location.unlink()
+
+            os.replace(staged_path, restore_location)
+
+    def _restore_location(self, backup_path: str) -> pathlib.Path:
+        return pathlib.Path(
+            backup_path.replace(
+                str(self.backup_manifest.old_user_home_dir),
+                str(config.CURRENT_USER_HOME_DIR),
+            )
+        )
+
+    def _identical_files(self, file_paths: t.Iterable[str]) -> t.Set[str]:
+        """
+        Return the files whose destination already has the contents in the backup. A
+        destination of a different size differs; one with the size and mtime recorded in
+        the manifest is taken to be identical; any other destination is hashed.
+        """
+        identical_files = set()
+        candidates: t.Dict[pathlib.Path, str] = {}
+
+        for file_path in file_paths:
+            restore_location = self._restore_location(file_path)
+            try:
+                stat_result = restore_location.lstat()
+            except FileNotFoundError:
+                continue
+
+            file_stat = self.backup_manifest.file_stats.get(file_path)
+            if not stat.S_ISREG(stat_result.st_mode) or (
+                file_stat is not None and stat_result.st_size != file_stat[0]
+            ):
+                continue
+            if file_stat is not None and stat_result.st_mtime_ns == file_stat[1]:
+                identical_files.add(file_path)
+                continue
+
+            candidates[restore_location] = file_path
+
+        hashes = util.get_file_sha256_hashes(candidates, jobs=config.HASH_JOBS)
+        identical_files.update(
+            file_path
+            for restore_location, file_path in candidates.items()
+            if hashes[restore_location] == self.backup_manifest.file_digests[file_path]
+        )
+
+        return identical_files
+
+    def _restore_selected_files(self) -> t.NoReturn:
+        """
+        Restore the selected files, leaving the other files in their directories untouched.
+        Each file is staged next to its destination; once every file has been verified,
+        each replaces the existing file, which is backed up first. In delta mode, files
+        whose destination is identical are skipped, without reading them from the backup.
+        """
+        restore_files = self.selected_files
+        identical_files = set()
+        if self.delta:
+            identical_files = self._identical_files(restore_files)
+            restore_files = [f for f in restore_files if f not in identical_files]
+
+        staged_paths: t.Dict[str, t.Optional[pathlib.Path]] = {
+            file_path: None for file_path in restore_files
+        }
+        replaced_files = 0
+        try:
+            if not self.dry_run:
+                for file_path in staged_paths:
+                    staged_paths[file_path] = self._staging_path(
+                        self._restore_location(file_path), directory=False
+                    )
+
+            self._stage_files(staged_paths)
+
+            for file_path in sorted(staged_paths):
+                restore_location = self._restore_location(file_path)
+                if restore_location.exists() or restore_location.is_symlink():
+                    replaced_files += 1
+
+                message = f"Restoring '{file_path}' to '{restore_location}'"
+                if self.dry_run:
+                    click.secho(f"[DRY-RUN] {message}", fg="yellow")
+                    continue
+
+                click.secho(message, fg="green")
+                self._replace_path(restore_location, staged_paths[file_path])
+        finally:
+            for staged_path in staged_paths.values():
+                if staged_path is not None:
+                    staged_path.unlink(missing_ok=True)
+
+        if self.delta:
+            message = (
+                f"Delta restore: skipped {len(identical_files)} identical files, "
+                f"replaced {replaced_files} changed files, "
+                f"restored {len(staged_paths) - replaced_files} new files"
+            )
+            if self.dry_run:
+                click.secho(f"[DRY-RUN] {message}", fg="yellow")
+            else:
+                click.secho(message, fg="green")
+
+    def _restore_files(self) -> t.NoReturn:
+        """
+        Restore every backup location. Files are streamed out of the backup into a staging
+        directory next to their location, and hashed on the way; each byte is read and
+        written once, on the filesystem it is restored to. Only once every file has been
+        verified, are the staged locations renamed into place, replacing (and backing up)
+        the existing ones. In dry-run mode, files are only verified.
+        """
+        # Locations nested in another location are restored along with it
+        locations: t.Dict[str, pathlib.Path] = {}
+        for backup_location in sorted(map(str, self.backup_manifest.backup_locations)):
+            if not any(backup_location.startswith(f"{l}/") for l in locations):
+                locations[backup_location] = self._restore_location(backup_location)
+
+        staging_dirs: t.Dict[str, pathlib.Path] = {}
+        staged_paths: t.Dict[str, t.Optional[pathlib.Path]] = {
+            file_path: None for file_path in self.selected_files
+        }
+        try:
+            if not self.dry_run:
+                for backup_location, restore_location in locations.items():
+                    staging_dirs[backup_location] = self._staging_path(
+                        restore_location, directory=True
+                    )
 
-        return self._temp_dir
+                for file_path in staged_paths:
+                    backup_location = next(
+                        l
+                        for l in locations
+                        if file_path == l or file_path.startswith(f"{l}/")
+                    )
+                    staged_paths[file_path] = staging_dirs[backup_location] / (
+                        pathlib.PurePath(file_path).relative_to(backup_location)
+                        if file_path != backup_location
+                        else pathlib.PurePath(file_path).name
+                    )
+
+                # Directories are created up front, in order, rather than by the threads
+                for directory in sorted({p.parent for p in staged_paths.values()}):
+                    directory.mkdir(parents=True, exist_ok=True)
+
+            self._stage_files(staged_paths)
+
+            for backup_location, restore_location in locations.items():
+                message = f"Restoring '{backup_location}' to '{restore_location}'"
+                if self.dry_run:
+                    click.secho(f"[DRY-RUN] {message}", fg="yellow")
+                    continue
+
+                click.secho(message, fg="green")
+                staged_path = staging_dirs[backup_location]
+                if backup_location in self.backup_manifest.file_digests:
+                    staged_path /= restore_location.name
+                self._replace_path(restore_location, staged_path)
+        finally:
+            for staging_dir in staging_dirs.values():
+                shutil.rmtree(staging_dir, ignore_errors=True)
 
     def _configure_git(self) -> t.NoReturn:
         if not self.dry_run:
@@ -117,47 +657,18 @@ class RestoreCommand(object):
             for key in ssh_path.glob("**/*id_*"):
                 os.chmod(key, 0o600)
 
-    def _validate_extracted_files(self) -> t.NoReturn:
-        for sp, digest_hash in self.backup_manifest.file_digests.items():
-            extracted_hash = util.get_file_sha256_hash(
-                file_path=pathlib.Path(self.temp_dir.name + sp)
-            )
-            assert extracted_hash == digest_hash
-
-    def _restore_files(self) -> t.NoReturn:
-        for backup_location in self.backup_manifest.backup_locations:
-            temp_location = pathlib.Path(self.temp_dir.name + backup_location)
-            restore_location = pathlib.Path(
-                backup_location.replace(
-                    self.backup_manifest.old_user_home_dir,
-                    str(config.CURRENT_USER_HOME_DIR),
-                )
-            )
-
-            message = f"Moving '{temp_location}' to '{restore_location}'"
-            if not self.dry_run:
-                click.secho(message, fg="green")
-                if restore_location.exists():
-                    backup_path = util.create_backup(restore_location)
-
-                    try:
-                        shutil.rmtree(restore_location, ignore_errors=True)
-                    except NotADirectoryError:
-                        restore_location.unlink()
-
-                    click.secho(
-                        f"Path '{restore_location}' exists. Creating backup to '{backup_path}'.",
-                        fg="yellow",
-                    )
-                shutil.move(src=temp_location, dst=restore_location)
-            else:
-                click.secho(f"[DRY-RUN] {message}", fg="yellow")
-
     def main(self) -> t.NoReturn:
         """
         Perform the main restore function.
         """
-        self._validate_extracted_files()
-        self._restore_files()
+        if self.path or self.delta:
+            self._restore_selected_files()
+        else:
+            self._restore_files()
+
+        # Restoring selected paths leaves the rest of the configuration alone
+        if self.path:
+            return
+
         self._configure_git()
         self._configure_ssh()
@@ -1,22 +1,66 @@
-import tempfile
+import pathlib
 import typing as t
+import zipfile
 
 from macos_installation.classes.data import BackupManifest  # type: ignore
+from macos_installation.classes.repository import ChunkRepository  # type: ignore
 from macos_installation.classes.zip import InMemoryZip  # type: ignore
 
 class RestoreCommand:
     debug: bool
     dry_run: bool
-    def __init__(self, zip_object: InMemoryZip, **kwargs) -> None:
-        self._temp_dir = None
+    snapshot: t.Optional[str]
+    path: t.List[str]
+    jobs: int
+    delta: bool
+    backup_strategy: str
+    def __init__(
+        self,
+        zip_object: t.Optional[InMemoryZip],
+        chunk_repository: t.Optional[ChunkRepository] = ...,
+        **kwargs,
+    ) -> None:
         self._backup_manifest = None
+        self._selected_files = None
         ...
     @property
     def backup_manifest(self) -> BackupManifest: ...
     @property
-    def temp_dir(self) -> tempfile.TemporaryDirectory: ...
-    def main(self) -> t.NoReturn: ...
-    def _validate_extracted_files(self) -> t.NoReturn: ...
+    def selected_files(self) -> t.List[str]: ...
+    def _match_files(self, manifest: BackupManifest) -> t.List[str]: ...
+    def _read_snapshot(self) -> t.NoReturn: ...
+    def _backup_chain(
+        self,
+    ) -> t.Iterator[t.Tuple[BackupManifest, zipfile.ZipFile, pathlib.Path]]: ...
+    def _prefetch_parent_key(
+        self, manifest: BackupManifest, backup_file: pathlib.Path
+    ) -> t.NoReturn: ...
+    def _plan_members(
+        self, file_paths: t.Iterable[str]
+    ) -> t.List[t.Tuple[str, t.Optional[pathlib.Path]]]: ...
+    def _zip_file(self, backup_file: pathlib.Path) -> zipfile.ZipFile: ...
+    @staticmethod
+    def _is_legacy_encrypted(backup_file: pathlib.Path) -> bool: ...
+    def _stage_member(
+        self,
+        file_path: str,
+        backup_file: t.Optional[pathlib.Path],
+        staged_path: t.Optional[pathlib.Path],
+    ) -> str: ...
+    def _stage_files(
+        self, staged_paths: t.Dict[str, t.Optional[pathlib.Path]]
+    ) -> t.NoReturn: ...
+    @staticmethod
+    def _staging_path(
+        restore_location: pathlib.Path, directory: bool
+    ) -> pathlib.Path: ...
+    def _replace_path(
+        self, restore_location: pathlib.Path, staged_path: pathlib.Path
+    ) -> t.NoReturn: ...
+    def _restore_location(self, backup_path: str) -> pathlib.Path: ...
+    def _identical_files(self, file_paths: t.Iterable[str]) -> t.Set[str]: ...
+    def _restore_selected_files(self) -> t.NoReturn: ...
     def _restore_files(self) -> t.NoReturn: ...
     def _configure_git(self) -> t.NoReturn: ...
     def _configure_ssh(self) -> t.NoReturn: ...
+    def main(self) -> t.NoReturn: ...
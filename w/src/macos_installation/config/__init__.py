@@ -1,9 +1,9 @@
 import getpass
+import os
 import pathlib
+import sys
 import typing as t
 
-from macos_installation.functions import util
-
 # Basic variables
 CURRENT_USER: t.Final[str] = getpass.getuser()
 CURRENT_USER_HOME_DIR: t.Final[pathlib.Path] = pathlib.Path.home()
@@ -14,37 +14,155 @@ PACKAGE_DIR: t.Final[pathlib.Path] = (
 
 # Compound variables
 TEMPLATES_DIR: t.Final[pathlib.Path] = PACKAGE_DIR / "templates"
+CACHE_DIR: t.Final[pathlib.Path] = (
+    CURRENT_USER_HOME_DIR / "Library" / "Caches"
+    if sys.platform == "darwin"
+    else pathlib.Path(
+        os.environ.get("XDG_CACHE_HOME", CURRENT_USER_HOME_DIR / ".cache")
+    )
+) / "macos-installation"
+HASH_CACHE_PATH: t.Final[pathlib.Path] = CACHE_DIR / "hash-cache.sqlite3"
+
+# Buffer / storage sizes (bytes)
+COPY_BUFFER_SIZE: t.Final[int] = 1024 * 1024
+ENCRYPTION_SEGMENT_SIZE: t.Final[int] = 1024 * 1024
+ZIP_SPOOL_THRESHOLD: t.Final[int] = 64 * 1024 * 1024
+
+# Content-defined chunking of repository backups (bytes); chunks are cut where the
+# content matches a pattern, so they are roughly CHUNK_AVG_SIZE bytes long
+CHUNK_MIN_SIZE: t.Final[int] = 16 * 1024
+CHUNK_AVG_SIZE: t.Final[int] = 64 * 1024
+CHUNK_MAX_SIZE: t.Final[int] = 256 * 1024
+
+# Compression of backup files: the policy choosing each member's compression method
+# (see 'compression.choose_compression'), the number of bytes sampled from each file,
+# and the entropies (bits per byte) above which a sample is considered incompressible,
+# and below which it is considered highly compressible text
+COMPRESSION_POLICY: t.Final[str] = "auto"
+COMPRESSION_POLICIES: t.Final[t.Tuple[str, ...]] = (
+    "auto",
+    "max",
+    "store",
+    "deflate",
+    "bzip2",
+    "lzma",
+)
+COMPRESSION_SAMPLE_SIZE: t.Final[int] = 8 * 1024
+COMPRESSION_ENTROPY_INCOMPRESSIBLE: t.Final[float] = 7.5
+COMPRESSION_ENTROPY_TEXT: t.Final[float] = 5.0
+
+# Number of threads used to hash files
+HASH_JOBS: t.Final[int] = min(32, (os.cpu_count() or 1) + 4)
+
+# Number of processes used to compress files; 1 compresses in the main process
+COMPRESSION_JOBS: t.Final[int] = 1
+
+# Number of threads used to restore files; 1 restores in the main thread
+RESTORE_JOBS: t.Final[int] = 1
+
+# Number of threads used to encrypt or decrypt files; 1 uses the main thread
+ENCRYPTION_JOBS: t.Final[int] = 1
+
+# How existing paths are backed up before a restore replaces them; see
+# 'util.create_backup'. Renaming them aside copies nothing
+RESTORE_BACKUP_STRATEGY: t.Final[str] = "rename"
+BACKUP_STRATEGIES: t.Final[t.Tuple[str, ...]] = (
+    "rename",
+    "reflink",
+    "hardlink",
+    "copy",
+)
+
+# Dry-run backup plans: the number of files sampled from each location, the number of
+# bytes sampled from each file, and the number of largest files reported
+PLAN_SAMPLE_FILES: t.Final[int] = 16
+PLAN_SAMPLE_SIZE: t.Final[int] = 64 * 1024
+PLAN_LARGEST_FILES: t.Final[int] = 10
+
+# Key derivation calibration budget
+KDF_MEMORY_LIMIT: t.Final[int] = 256 * 1024 * 1024
+KDF_TIME_TARGET: t.Final[float] = 0.5
 
 # CLI options
-BASE_CLI_CONTEXT_SETTINGS: t.Final[t.Dict[str, t.Any]] = {
-    "auto_envvar_prefix": "MACOS_INSTALL",
-    "help_option_names": ["-h", "--help"],
-    "ignore_unknown_options": True,
-    "max_content_width": util.get_terminal_size()[0],
-    "token_normalize_func": lambda x: x.lower(),
-}
 BASE_CLI_OPTIONS: t.Final[t.Dict[str, t.Any]] = {
     "show_default": True,
     "show_envvar": True,
 }
 
-# Files / directories to back up
-BACKUP_LOCATIONS: t.List[pathlib.Path] = [
-    p
-    for p in [
-        CURRENT_USER_HOME_DIR / ".git-template",
-        CURRENT_USER_HOME_DIR / ".gitconfig",
-        CURRENT_USER_HOME_DIR / ".gitignore_global",
-        CURRENT_USER_HOME_DIR / ".gnupg",
-        CURRENT_USER_HOME_DIR / ".jump",
-        CURRENT_USER_HOME_DIR / ".ssh",
-        CURRENT_USER_HOME_DIR / ".vim",
-        CURRENT_USER_HOME_DIR / ".vimrc",
-        CURRENT_USER_HOME_DIR / ".zprofile",
-        CURRENT_USER_HOME_DIR / ".zsh_history",
-        CURRENT_USER_HOME_DIR / ".zshrc",
-        CURRENT_USER_HOME_DIR / "iterm2-colors",
-        CURRENT_USER_HOME_DIR / "iterm2-prefs",
+
+def _base_cli_context_settings() -> t.Dict[str, t.Any]:
+    # Queried with 'os' rather than 'util.get_terminal_size', so '--help' does not import
+    # 'util' and the modules it needs
+    try:
+        columns = os.get_terminal_size(sys.__stdout__.fileno()).columns
+    except (AttributeError, OSError, ValueError):
+        columns = 80
+
+    return {
+        "auto_envvar_prefix": "MACOS_INSTALL",
+        "help_option_names": ["-h", "--help"],
+        "ignore_unknown_options": True,
+        "max_content_width": columns,
+        "token_normalize_func": lambda x: x.lower(),
+    }
+
+
+# Files / directories to back up; only those which exist
+def _backup_locations() -> t.List[pathlib.Path]:
+    return [
+        p
+        for p in [
+            CURRENT_USER_HOME_DIR / ".git-template",
+            CURRENT_USER_HOME_DIR / ".gitconfig",
+            CURRENT_USER_HOME_DIR / ".gitignore_global",
+            CURRENT_USER_HOME_DIR / ".gnupg",
+            CURRENT_USER_HOME_DIR / ".jump",
+            CURRENT_USER_HOME_DIR / ".ssh",
+            CURRENT_USER_HOME_DIR / ".vim",
+            CURRENT_USER_HOME_DIR / ".vimrc",
+            CURRENT_USER_HOME_DIR / ".zprofile",
+            CURRENT_USER_HOME_DIR / ".zsh_history",
+            CURRENT_USER_HOME_DIR / ".zshrc",
+            CURRENT_USER_HOME_DIR / "iterm2-colors",
+            CURRENT_USER_HOME_DIR / "iterm2-prefs",
+        ]
+        if p.exists()
     ]
-    if p.exists()
+
+
+# Values which query the terminal or the file system are computed the first time they
+# are accessed (see '__getattr__'), rather than whenever the package is imported
+_LAZY_VALUES: t.Final[t.Dict[str, t.Callable[[], t.Any]]] = {
+    "BASE_CLI_CONTEXT_SETTINGS": _base_cli_context_settings,
+    "BACKUP_LOCATIONS": _backup_locations,
+}
+
+
+def __getattr__(name: str) -> t.Any:
+    if name not in _LAZY_VALUES:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+    # Stored as a module attribute, so this is only called once per name
+    value = globals()[name] = _LAZY_VALUES[name]()
+    return value
+
+
+# Files / directories skipped while walking the backup locations; see
+# 'util.compile_path_patterns' for the pattern syntax. Relative patterns are anchored to
+# the home directory. Sockets (e.g. gpg-agent's) and other special files are always skipped
+BACKUP_EXCLUDES: t.List[str] = [
+    ".DS_Store",
+    "__pycache__",
+    "*.swp",
+    ".gnupg/*.lock",
+    ".vim/**/.git",
+    ".vim/**/.cache",
 ]
+
+# Files kept while walking the backup locations; if empty, all files are kept
+BACKUP_INCLUDES: t.List[str] = []
+
+# How symbolic links inside the backup locations are handled; see
+# 'util.get_recursive_file_list'
+SYMLINK_POLICY: t.Final[str] = "files"
+SYMLINK_POLICIES: t.Final[t.Tuple[str, ...]] = ("skip", "files", "follow")
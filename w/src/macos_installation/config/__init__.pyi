@@ -6,6 +6,34 @@ CURRENT_USER_HOME_DIR: t.Final[pathlib.Path]
 DEFAULT_ENCODING: t.Final[str]
 PACKAGE_DIR: t.Final[pathlib.Path]
 TEMPLATES_DIR: t.Final[pathlib.Path]
+CACHE_DIR: t.Final[pathlib.Path]
+HASH_CACHE_PATH: t.Final[pathlib.Path]
+COPY_BUFFER_SIZE: t.Final[int]
+ENCRYPTION_SEGMENT_SIZE: t.Final[int]
+ZIP_SPOOL_THRESHOLD: t.Final[int]
+CHUNK_MIN_SIZE: t.Final[int]
+CHUNK_AVG_SIZE: t.Final[int]
+CHUNK_MAX_SIZE: t.Final[int]
+COMPRESSION_POLICY: t.Final[str]
+COMPRESSION_POLICIES: t.Final[t.Tuple[str, ...]]
+COMPRESSION_SAMPLE_SIZE: t.Final[int]
+COMPRESSION_ENTROPY_INCOMPRESSIBLE: t.Final[float]
+COMPRESSION_ENTROPY_TEXT: t.Final[float]
+HASH_JOBS: t.Final[int]
+COMPRESSION_JOBS: t.Final[int]
+RESTORE_JOBS: t.Final[int]
+ENCRYPTION_JOBS: t.Final[int]
+RESTORE_BACKUP_STRATEGY: t.Final[str]
+BACKUP_STRATEGIES: t.Final[t.Tuple[str, ...]]
+PLAN_SAMPLE_FILES: t.Final[int]
+PLAN_SAMPLE_SIZE: t.Final[int]
+PLAN_LARGEST_FILES: t.Final[int]
+KDF_MEMORY_LIMIT: t.Final[int]
+KDF_TIME_TARGET: t.Final[float]
 BASE_CLI_CONTEXT_SETTINGS: t.Final[t.Dict[str, t.Any]]
 BASE_CLI_OPTIONS: t.Final[t.Dict[str, t.Any]]
 BACKUP_LOCATIONS: t.List[pathlib.Path]
+BACKUP_EXCLUDES: t.List[str]
+BACKUP_INCLUDES: t.List[str]
+SYMLINK_POLICY: t.Final[str]
+SYMLINK_POLICIES: t.Final[t.Tuple[str, ...]]
@@ -0,0 +1,381 @@
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import io
+import logging
+import os
+import pathlib
+import platform
+import shutil
+import tempfile
+import time
+import typing as t
+import zipfile
+import zlib
+
+from macos_installation import config
+from macos_installation.classes.data import CompressedFile, CompressionStatistics
+from macos_installation.functions import compression, util
+
+# Compressed data up to this size is returned to the main process directly, instead of
+# through a temporary file
+COMPRESSED_INLINE_LIMIT: t.Final[int] = 1024 * 1024
+
+# General purpose flag bits of ZIP members (see 'zipfile')
+ZIP_FLAG_LZMA_EOS: t.Final[int] = 0x02
+
+# Private attributes of 'zipfile' which 'compress_file' and 'write_compressed_file_to_zip'
+# rely on, by the object they belong to; see 'missing_zipfile_internals'
+ZIPFILE_INTERNALS: t.Final[t.Dict[str, t.Tuple[str, ...]]] = {
+    "zipfile": ("_get_compressor",),
+    "ZipInfo": ("FileHeader",),
+    "ZipFile": (
+        "_allowZip64",
+        "_didModify",
+        "_lock",
+        "_seekable",
+        "_writecheck",
+        "_writing",
+        "start_dir",
+    ),
+}
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def get_arcname(file_path: t.Union[str, pathlib.Path]) -> str:
+    """
+    The get_arcname function returns the name a file is stored under in a ZIP file when no
+    explicit name is given; the same normalization 'zipfile.ZipInfo.from_file' applies.
+
+    :param file_path:t.Union[str, pathlib.Path]: Path of the file
+    :return: The name of the ZIP member
+    """
+    arcname = os.path.normpath(os.path.splitdrive(str(file_path))[1])
+    return arcname.lstrip(os.sep + (os.altsep or ""))
+
+
+@functools.lru_cache(maxsize=None)
+def missing_zipfile_internals() -> t.Tuple[str, ...]:
+    """
+    The missing_zipfile_internals function returns the private attributes of 'zipfile' (see
+    'ZIPFILE_INTERNALS') which the running Python lacks. They are not part of the public API
+    and have changed between Python versions; without them, members compressed ahead of time
+    cannot be written, and 'write_files_to_zip' compresses files serially instead.
+
+    :return: The names of the missing attributes, e.g. 'ZipFile._writing'; empty if none are
+    """
+    with zipfile.ZipFile(io.BytesIO(), mode="w") as zip_file:
+        owners = {"zipfile": zipfile, "ZipInfo": zipfile.ZipInfo(), "ZipFile": zip_file}
+        return tuple(
+            f"{owner}.{name}"
+            for owner, names in ZIPFILE_INTERNALS.items()
+            for name in names
+            if not hasattr(owners[owner], name)
+        )
+
+
+def _check_zipfile_internals() -> t.NoReturn:
+    """
+    The _check_zipfile_internals function raises a RuntimeError naming the private
+    attributes of 'zipfile' which the running Python lacks, if any.
+
+    :return: None
+    """
+    missing = missing_zipfile_internals()
+    if missing:
+        raise RuntimeError(
+            f"'zipfile' of Python {platform.python_version()} lacks {', '.join(missing)}"
+        )
+
+
+def write_file_to_zip(
+    zip_file: zipfile.ZipFile,
+    file_path: pathlib.Path,
+    arcname: t.Optional[str] = None,
+    block_size: int = util.HASH_BLOCK_SIZE,
+    compute_digest: bool = True,
+    compress_type: t.Optional[int] = None,
+    compress_level: t.Optional[int] = None,
+    statistics: t.Optional[CompressionStatistics] = None,
+) -> t.Optional[str]:
+    """
+    The write_file_to_zip function adds a file to an open ZIP file, and returns the SHA256 hash
+    of its contents. The file is read once, in fixed-size blocks; each block is fed to both the
+    digest and the ZIP member's compressor, so hashing does not need a separate pass over the file.
+
+    :param zip_file:zipfile.ZipFile: ZIP file opened for writing
+    :param file_path:pathlib.Path: File to add
+    :param arcname:t.Optional[str]=None: Name of the member; defaults to the file path, like 'ZipFile.write'
+    :param block_size:int=util.HASH_BLOCK_SIZE: Number of bytes read at a time
+    :param compute_digest:bool=True: Hash the file; disable when the digest is already known
+    :param compress_type:t.Optional[int]=None: Compression method of the member; defaults to the ZIP file's
+    :param compress_level:t.Optional[int]=None: Compression level of the member; defaults to the ZIP file's
+    :param statistics:t.Optional[CompressionStatistics]=None: Statistics to record the compression in
+    :return: The sha256 hash of the contents of the file, or None if not computed
+    """
+    zip_info = zipfile.ZipInfo.from_file(file_path, arcname)
+    zip_info.compress_type = (
+        zip_file.compression if compress_type is None else compress_type
+    )
+    # Public as 'compress_level' since Python 3.13
+    setattr(
+        zip_info,
+        "compress_level" if hasattr(zip_info, "compress_level") else "_compresslevel",
+        zip_file.compresslevel if compress_type is None else compress_level,
+    )
+
+    digest = hashlib.sha256() if compute_digest else None
+    buffer = bytearray(block_size)
+    start_time = time.perf_counter()
+
+    with file_path.open("rb", buffering=0) as src, zip_file.open(
+        zip_info, mode="w"
+    ) as dst, memoryview(buffer) as view:
+        while read_size := src.readinto(buffer):
+            block = view[:read_size]
+            if digest:
+                digest.update(block)
+            dst.write(block)
+
+    if statistics is not None:
+        statistics.record(
+            zip_info.compress_type,
+            zip_info.file_size,
+            zip_info.compress_size,
+            time.perf_counter() - start_time,
+        )
+
+    return digest.hexdigest() if digest else None
+
+
+def compress_file(
+    file_path: pathlib.Path,
+    compress_type: int = zipfile.ZIP_DEFLATED,
+    compress_level: t.Optional[int] = None,
+    compute_digest: bool = True,
+    block_size: int = util.HASH_BLOCK_SIZE,
+    spool_dir: t.Optional[pathlib.Path] = None,
+) -> CompressedFile:
+    """
+    The compress_file function compresses a file the way 'zipfile' compresses a ZIP member,
+    and computes its CRC and (optionally) SHA256 hash from the same read. It does not need
+    an open ZIP file, so it can run in a worker process; the result is added to the ZIP file
+    with 'write_compressed_file_to_zip'.
+
+    :param file_path:pathlib.Path: File to compress
+    :param compress_type:int=zipfile.ZIP_DEFLATED: Compression method of the ZIP member
+    :param compress_level:t.Optional[int]=None: Compression level; None for the default
+    :param compute_digest:bool=True: Hash the file; disable when the digest is already known
+    :param block_size:int=util.HASH_BLOCK_SIZE: Number of bytes read at a time
+    :param spool_dir:t.Optional[pathlib.Path]=None: Directory for temporary files of large compressed data
+    :return: The compressed data and its metadata
+    """
+    _check_zipfile_internals()
+    compressor = zipfile._get_compressor(compress_type, compress_level)
+    digest = hashlib.sha256() if compute_digest else None
+    crc, file_size, compress_size = 0, 0, 0
+    start_time = time.perf_counter()
+
+    output = bytearray()
+    output_file: t.Optional[t.IO[bytes]] = None
+
+    def write(data: bytes) -> None:
+        nonlocal output_file, compress_size
+        compress_size += len(data)
+        if output_file is None and len(output) + len(data) > COMPRESSED_INLINE_LIMIT:
+            output_file = tempfile.NamedTemporaryFile(dir=spool_dir, delete=False)
+            output_file.write(output)
+            output.clear()
+        if output_file is not None:
+            output_file.write(data)
+        else:
+            output.extend(data)
+
+    try:
+        with file_path.open("rb") as src:
+            while block := src.read(block_size):
+                file_size += len(block)
+                crc = zlib.crc32(block, crc)
+                if digest:
+                    digest.update(block)
+                write(compressor.compress(block) if compressor else block)
+
+        if compressor:
+            write(compressor.flush())
+    except BaseException:
+        if output_file is not None:
+            output_file.close()
+            os.unlink(output_file.name)
+        raise
+
+    compressed_file = CompressedFile(
+        file_path=file_path,
+        file_size=file_size,
+        compress_size=compress_size,
+        crc=crc,
+        compress_type=compress_type,
+        seconds=time.perf_counter() - start_time,
+        digest=digest.hexdigest() if digest else None,
+    )
+    if output_file is not None:
+        output_file.close()
+        compressed_file.data_path = pathlib.Path(output_file.name)
+    else:
+        compressed_file.data = bytes(output)
+
+    return compressed_file
+
+
+def write_compressed_file_to_zip(
+    zip_file: zipfile.ZipFile,
+    compressed_file: CompressedFile,
+    arcname: t.Optional[str] = None,
+) -> t.NoReturn:
+    """
+    The write_compressed_file_to_zip function adds a file compressed by 'compress_file' to an
+    open ZIP file. Since the CRC and sizes are known up front, the local header is written
+    with its final values, followed by the compressed data as-is. 'zipfile' has no public
+    API for this, so this mirrors what 'ZipFile.open(..., mode="w")' does internally, and
+    raises a RuntimeError if the private attributes it uses are missing (see
+    'missing_zipfile_internals'). A temporary file holding the compressed data is removed
+    afterwards.
+
+    :param zip_file:zipfile.ZipFile: ZIP file opened for writing
+    :param compressed_file:CompressedFile: Compressed file to add
+    :param arcname:t.Optional[str]=None: Name of the member; defaults to the file path, like 'ZipFile.write'
+    :return: None
+    """
+    _check_zipfile_internals()
+
+    zip_info = zipfile.ZipInfo.from_file(compressed_file.file_path, arcname)
+    zip_info.compress_type = compressed_file.compress_type
+    zip_info.file_size = compressed_file.file_size
+    zip_info.compress_size = compressed_file.compress_size
+    zip_info.CRC = compressed_file.crc
+    zip_info.flag_bits = (
+        ZIP_FLAG_LZMA_EOS if zip_info.compress_type == zipfile.ZIP_LZMA else 0x00
+    )
+
+    zip64 = max(zip_info.file_size, zip_info.compress_size) > zipfile.ZIP64_LIMIT
+    if zip64 and not zip_file._allowZip64:
+        raise zipfile.LargeZipFile("Filesize would require ZIP64 extensions")
+
+    try:
+        with zip_file._lock:
+            if zip_file._writing:
+                raise ValueError(
+                    "Can't write to the ZIP file while there is another write handle open on it"
+                )
+            if zip_file._seekable:
+                zip_file.fp.seek(zip_file.start_dir)
+            zip_info.header_offset = zip_file.fp.tell()
+
+            zip_file._writecheck(zip_info)
+            zip_file._didModify = True
+
+            zip_file.fp.write(zip_info.FileHeader(zip64))
+            if compressed_file.data_path is not None:
+                with compressed_file.data_path.open("rb") as src:
+                    shutil.copyfileobj(src, zip_file.fp, util.HASH_BLOCK_SIZE)
+            else:
+                zip_file.fp.write(compressed_file.data)
+
+            zip_file.start_dir = zip_file.fp.tell()
+            zip_file.filelist.append(zip_info)
+            zip_file.NameToInfo[zip_info.filename] = zip_info
+    finally:
+        if compressed_file.data_path is not None:
+            compressed_file.data_path.unlink(missing_ok=True)
+
+
+def write_files_to_zip(
+    zip_file: zipfile.ZipFile,
+    files: t.Iterable[t.Tuple[pathlib.Path, bool]],
+    jobs: int = 1,
+    block_size: int = util.HASH_BLOCK_SIZE,
+    spool_dir: t.Optional[pathlib.Path] = None,
+    policy: str = config.COMPRESSION_POLICY,
+    statistics: t.Optional[CompressionStatistics] = None,
+) -> t.Iterator[t.Optional[str]]:
+    """
+    The write_files_to_zip function adds files to an open ZIP file, in the given order, and
+    yields the SHA256 hash of each file (see 'write_file_to_zip'). With more than one job,
+    files are compressed concurrently in a pool of worker processes; the main process only
+    appends the compressed members, so compression scales with the number of cores. At most
+    two files per worker are compressed ahead of the ZIP file. The compression method of
+    each member is chosen by the compression policy (see 'compression.choose_compression').
+    If the running Python lacks the 'zipfile' internals the workers' members are written
+    with (see 'missing_zipfile_internals'), a warning is logged and files are compressed
+    serially.
+
+    :param zip_file:zipfile.ZipFile: ZIP file opened for writing
+    :param files:t.Iterable[t.Tuple[pathlib.Path, bool]]: Files to add, and whether to hash each of them
+    :param jobs:int=1: Number of worker processes; 1 compresses in the current process
+    :param block_size:int=util.HASH_BLOCK_SIZE: Number of bytes read at a time
+    :param spool_dir:t.Optional[pathlib.Path]=None: Directory for temporary files of large compressed data
+    :param policy:str=config.COMPRESSION_POLICY: Compression policy
+    :param statistics:t.Optional[CompressionStatistics]=None: Statistics to record the compression in
+    :return: An iterator of the sha256 hash of each file, or None if not computed
+    """
+    if jobs > 1 and missing_zipfile_internals():
+        logger.warning(
+            f"Compressing files serially; 'zipfile' of Python "
+            f"{platform.python_version()} lacks {', '.join(missing_zipfile_internals())}"
+        )
+        jobs = 1
+
+    if jobs <= 1:
+        for file_path, compute_digest in files:
+            compress_type, compress_level = compression.choose_compression(
+                file_path, policy
+            )
+            yield write_file_to_zip(
+                zip_file,
+                file_path,
+                block_size=block_size,
+                compute_digest=compute_digest,
+                compress_type=compress_type,
+                compress_level=compress_level,
+                statistics=statistics,
+            )
+        return
+
+    def write(compressed_file: CompressedFile) -> t.Optional[str]:
+        write_compressed_file_to_zip(zip_file, compressed_file)
+        if statistics is not None:
+            statistics.record(
+                compressed_file.compress_type,
+                compressed_file.file_size,
+                compressed_file.compress_size,
+                compressed_file.seconds,
+            )
+        return compressed_file.digest
+
+    pending: t.Deque[concurrent.futures.Future] = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        try:
+            for file_path, compute_digest in files:
+                pending.append(
+                    executor.submit(
+                        compress_file,
+                        file_path,
+                        *compression.choose_compression(file_path, policy),
+                        compute_digest,
+                        block_size,
+                        spool_dir,
+                    )
+                )
+                if len(pending) >= 2 * jobs:
+                    yield write(pending.popleft().result())
+
+            while pending:
+                yield write(pending.popleft().result())
+        finally:
+            # Remove the temporary files of members which were not written
+            for future in pending:
+                if not future.cancel() and future.exception() is None:
+                    data_path = future.result().data_path
+                    if data_path is not None:
+                        data_path.unlink(missing_ok=True)
@@ -0,0 +1,49 @@
+import logging
+import pathlib
+import typing as t
+import zipfile
+
+from macos_installation.classes.data import (  # type: ignore
+    CompressedFile,
+    CompressionStatistics,
+)
+
+COMPRESSED_INLINE_LIMIT: t.Final[int]
+ZIP_FLAG_LZMA_EOS: t.Final[int]
+ZIPFILE_INTERNALS: t.Final[t.Dict[str, t.Tuple[str, ...]]]
+logger: logging.Logger
+
+def get_arcname(file_path: t.Union[str, pathlib.Path]) -> str: ...
+def missing_zipfile_internals() -> t.Tuple[str, ...]: ...
+def write_file_to_zip(
+    zip_file: zipfile.ZipFile,
+    file_path: pathlib.Path,
+    arcname: t.Optional[str] = ...,
+    block_size: int = ...,
+    compute_digest: bool = ...,
+    compress_type: t.Optional[int] = ...,
+    compress_level: t.Optional[int] = ...,
+    statistics: t.Optional[CompressionStatistics] = ...,
+) -> t.Optional[str]: ...
+def compress_file(
+    file_path: pathlib.Path,
+    compress_type: int = ...,
+    compress_level: t.Optional[int] = ...,
+    compute_digest: bool = ...,
+    block_size: int = ...,
+    spool_dir: t.Optional[pathlib.Path] = ...,
+) -> CompressedFile: ...
+def write_compressed_file_to_zip(
+    zip_file: zipfile.ZipFile,
+    compressed_file: CompressedFile,
+    arcname: t.Optional[str] = ...,
+) -> t.NoReturn: ...
+def write_files_to_zip(
+    zip_file: zipfile.ZipFile,
+    files: t.Iterable[t.Tuple[pathlib.Path, bool]],
+    jobs: int = ...,
+    block_size: int = ...,
+    spool_dir: t.Optional[pathlib.Path] = ...,
+    policy: str = ...,
+    statistics: t.Optional[CompressionStatistics] = ...,
+) -> t.Iterator[t.Optional[str]]: ...
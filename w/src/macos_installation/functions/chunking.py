@@ -0,0 +1,112 @@
+import hashlib
+import typing as t
+
+from macos_installation import config
+
+# Random bits for each byte value, taken from its SHA256 digest so they are identical
+# everywhere, which keeps chunk boundaries stable between runs
+BOUNDARY_TABLE: t.Final[bytes] = bytes(
+    hashlib.sha256(bytes([i])).digest()[0] for i in range(256)
+)
+# Number of bytes each boundary bit depends on; see '_boundary_bits'
+BOUNDARY_WINDOW: t.Final[int] = 8
+LOW_BIT_TABLE: t.Final[bytes] = bytes(i & 1 for i in range(256))
+
+
+def _boundary_bits(data: t.Union[bytes, bytearray, memoryview]) -> bytes:
+    """
+    The _boundary_bits function returns a byte for every byte of data, holding the parity
+    of bit k of the random bits (see 'BOUNDARY_TABLE') of the k-th last byte, for every k
+    below BOUNDARY_WINDOW. The bits of all bytes are held in one integer, so the work is
+    done by a few integer operations rather than a Python loop over every byte: shifting
+    it right by 9 bits lines up bit k + 1 of each byte with bit k of the next byte.
+
+    :param data:t.Union[bytes, bytearray, memoryview]: Data to map
+    :return: A byte of 0 or 1 for every byte of data
+    """
+    bits = int.from_bytes(bytes(data).translate(BOUNDARY_TABLE), "big")
+    for shift in (9, 18, 36):
+        bits ^= bits >> shift
+
+    return bits.to_bytes(len(data), "big").translate(LOW_BIT_TABLE)
+
+
+def find_chunk_boundary(
+    data: t.Union[bytes, bytearray, memoryview],
+    min_size: int = config.CHUNK_MIN_SIZE,
+    avg_size: int = config.CHUNK_AVG_SIZE,
+    max_size: int = config.CHUNK_MAX_SIZE,
+) -> int:
+    """
+    The find_chunk_boundary function returns the length of the first chunk of data. Every
+    byte gets a boundary bit which only depends on the last BOUNDARY_WINDOW bytes (see
+    '_boundary_bits'), and the chunk ends after the first run of set bits long enough to
+    occur about once every avg_size - min_size bytes. Since boundaries depend on the
+    content around them rather than on offsets, inserting or removing bytes only changes
+    the chunks around the edit. The first min_size bytes are skipped, and chunks never
+    exceed max_size. The run is searched for with 'bytes.find', a block at a time, so the
+    data after the boundary is not mapped.
+
+    :param data:t.Union[bytes, bytearray, memoryview]: Data to split
+    :param min_size:int=config.CHUNK_MIN_SIZE: Minimum length of a chunk
+    :param avg_size:int=config.CHUNK_AVG_SIZE: Approximate average length of a chunk
+    :param max_size:int=config.CHUNK_MAX_SIZE: Maximum length of a chunk
+    :return: The length of the first chunk
+    """
+    if len(data) <= min_size:
+        return len(data)
+
+    run = b"\x01" * max(1, (avg_size - min_size).bit_length() - 2)
+    end = min(len(data), max_size)
+
+    start = min_size
+    while start < end:
+        # Blocks overlap by the bytes the bits of a run ending in this block depend on;
+        # runs ending before the block were searched for in the previous one
+        block_start = max(min_size, start - len(run) - BOUNDARY_WINDOW + 2)
+        block_end = min(end, start + avg_size)
+        index = _boundary_bits(data[block_start:block_end]).find(
+            run, 0 if block_start == min_size else BOUNDARY_WINDOW - 1
+        )
+        if index >= 0:
+            return block_start + index + len(run)
+
+        start = block_end
+
+    return end
+
+
+def iter_chunks(
+    stream: t.IO[bytes],
+    min_size: int = config.CHUNK_MIN_SIZE,
+    avg_size: int = config.CHUNK_AVG_SIZE,
+    max_size: int = config.CHUNK_MAX_SIZE,
+) -> t.Iterator[bytes]:
+    """
+    The iter_chunks function reads a stream until EOF and yields its content-defined chunks
+    (see 'find_chunk_boundary'). At most two chunks' worth of data is held in memory.
+
+    :param stream:t.IO[bytes]: Stream to read
+    :param min_size:int=config.CHUNK_MIN_SIZE: Minimum length of a chunk
+    :param avg_size:int=config.CHUNK_AVG_SIZE: Approximate average length of a chunk
+    :param max_size:int=config.CHUNK_MAX_SIZE: Maximum length of a chunk
+    :return: An iterator of chunks; empty for an empty stream
+    """
+    buffer = bytearray()
+    eof = False
+
+    while True:
+        # A full chunk must be buffered before a boundary can be chosen
+        while not eof and len(buffer) < max_size:
+            data = stream.read(max_size)
+            if data:
+                buffer += data
+            else:
+                eof = True
+
+        if not buffer:
+            return
+
+        boundary = find_chunk_boundary(buffer, min_size, avg_size, max_size)
+        yield bytes(buffer[:boundary])
+        del buffer[:boundary]
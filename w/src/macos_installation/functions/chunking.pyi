@@ -0,0 +1,18 @@
+import typing as t
+
+BOUNDARY_TABLE: t.Final[bytes]
+BOUNDARY_WINDOW: t.Final[int]
+LOW_BIT_TABLE: t.Final[bytes]
+
+def find_chunk_boundary(
+    data: t.Union[bytes, bytearray, memoryview],
+    min_size: int = ...,
+    avg_size: int = ...,
+    max_size: int = ...,
+) -> int: ...
+def iter_chunks(
+    stream: t.IO[bytes],
+    min_size: int = ...,
+    avg_size: int = ...,
+    max_size: int = ...,
+) -> t.Iterator[bytes]: ...
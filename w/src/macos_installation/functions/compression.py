@@ -0,0 +1,103 @@
+import collections
+import math
+import pathlib
+import typing as t
+import zipfile
+
+from macos_installation import config
+
+# Leading bytes of file formats which are already compressed (or encrypted)
+COMPRESSED_SIGNATURES: t.Final[t.Tuple[bytes, ...]] = (
+    b"\x1f\x8b",  # gzip
+    b"BZh",  # bzip2
+    b"\xfd7zXZ\x00",  # xz
+    b"\x28\xb5\x2f\xfd",  # zstd
+    b"7z\xbc\xaf\x27\x1c",  # 7-Zip
+    b"PK\x03\x04",  # ZIP (and formats based on it, e.g. .docx, .jar)
+    b"Rar!\x1a\x07",  # RAR
+    b"\x89PNG\r\n\x1a\n",  # PNG
+    b"\xff\xd8\xff",  # JPEG
+    b"GIF8",  # GIF
+    b"MACOSENC",  # Encrypted backups of this tool
+)
+
+# Compression method and level of each policy which does not depend on the file
+FIXED_POLICIES: t.Final[t.Dict[str, t.Tuple[int, t.Optional[int]]]] = {
+    "store": (zipfile.ZIP_STORED, None),
+    "deflate": (zipfile.ZIP_DEFLATED, None),
+    "bzip2": (zipfile.ZIP_BZIP2, None),
+    "lzma": (zipfile.ZIP_LZMA, None),
+}
+# All policies; kept in the config, so the CLI can offer them without importing this module
+POLICIES: t.Final[t.Tuple[str, ...]] = config.COMPRESSION_POLICIES
+
+# Names of the compression methods, for reporting
+COMPRESSION_NAMES: t.Final[t.Dict[int, str]] = {
+    zipfile.ZIP_STORED: "store",
+    zipfile.ZIP_DEFLATED: "deflate",
+    zipfile.ZIP_BZIP2: "bzip2",
+    zipfile.ZIP_LZMA: "lzma",
+}
+
+
+def get_entropy(data: bytes) -> float:
+    """
+    The get_entropy function returns the Shannon entropy of data, in bits per byte. Data
+    which is compressed or encrypted is close to 8; text is typically between 4 and 5.
+
+    :param data:bytes: Data to measure
+    :return: The entropy of the data, between 0 and 8
+    """
+    if not data:
+        return 0.0
+
+    size = len(data)
+    return -sum(
+        count / size * math.log2(count / size)
+        for count in collections.Counter(data).values()
+    )
+
+
+def choose_compression(
+    file_path: pathlib.Path,
+    policy: str = config.COMPRESSION_POLICY,
+    sample_size: int = config.COMPRESSION_SAMPLE_SIZE,
+) -> t.Tuple[int, t.Optional[int]]:
+    """
+    The choose_compression function returns the compression method and level of a ZIP
+    member. The 'auto' and 'max' policies sample the start of the file: files which are
+    already compressed (by their leading bytes, or by the entropy of the sample) are
+    stored as-is, since compressing them costs time without saving space. Other files are
+    deflated; with the 'max' policy, highly compressible files (e.g. text) are compressed
+    with LZMA, and the rest are deflated at the highest level. The other policies always
+    use the same method.
+
+    :param file_path:pathlib.Path: File to compress
+    :param policy:str=config.COMPRESSION_POLICY: Compression policy; see 'POLICIES'
+    :param sample_size:int=config.COMPRESSION_SAMPLE_SIZE: Number of bytes sampled
+    :return: A tuple of the 'zipfile' compression method and level (None for the default)
+    """
+    if policy in FIXED_POLICIES:
+        return FIXED_POLICIES[policy]
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown compression policy: '{policy}'")
+
+    with file_path.open("rb") as f:
+        sample = f.read(sample_size)
+
+    if not sample:
+        return zipfile.ZIP_STORED, None
+
+    entropy = get_entropy(sample)
+    if (
+        sample.startswith(COMPRESSED_SIGNATURES)
+        or entropy >= config.COMPRESSION_ENTROPY_INCOMPRESSIBLE
+    ):
+        return zipfile.ZIP_STORED, None
+
+    if policy == "max":
+        if entropy <= config.COMPRESSION_ENTROPY_TEXT:
+            return zipfile.ZIP_LZMA, None
+        return zipfile.ZIP_DEFLATED, 9
+
+    return zipfile.ZIP_DEFLATED, None
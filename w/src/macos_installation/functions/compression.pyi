@@ -0,0 +1,12 @@
+import pathlib
+import typing as t
+
+COMPRESSED_SIGNATURES: t.Final[t.Tuple[bytes, ...]]
+FIXED_POLICIES: t.Final[t.Dict[str, t.Tuple[int, t.Optional[int]]]]
+POLICIES: t.Final[t.Tuple[str, ...]]
+COMPRESSION_NAMES: t.Final[t.Dict[int, str]]
+
+def get_entropy(data: bytes) -> float: ...
+def choose_compression(
+    file_path: pathlib.Path, policy: str = ..., sample_size: int = ...
+) -> t.Tuple[int, t.Optional[int]]: ...
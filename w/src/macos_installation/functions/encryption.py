@@ -1,72 +1,467 @@
+import dataclasses
+import hmac
+import io
+import logging
 import secrets
+import time
 import typing as t
 
 from Cryptodome.Cipher import AES
+from Cryptodome.Hash import SHA256
 from Cryptodome.Protocol import KDF
 
 from macos_installation import config
-from macos_installation.classes.data import EncryptedData
+from macos_installation.classes import session
+from macos_installation.classes.data import EncryptionHeader, KDFParameters
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Sizes used by the encrypted container
+NONCE_SIZE: t.Final[int] = 16
+TAG_SIZE: t.Final[int] = 16
+
+# Lowest scrypt cost considered when calibrating
+KDF_CALIBRATION_MIN_N: t.Final[int] = 2**14
+
+# Layout of the legacy (headerless) format: salt + nonce + data + tag
+LEGACY_SALT_SIZE: t.Final[int] = 32
+LEGACY_NONCE_SIZE: t.Final[int] = 16
+
+
+class InvalidPasswordError(ValueError):
+    """
+    Raised when the key derived from a password does not match the key check in the
+    header of an encrypted container, before any of its data is decrypted.
+    """
 
 
 def encrypt_bytes(
     unencrypted_data: bytes,
-    password: t.Union[bytes, str],
+    password: t.Union[bytes, str, "session.KeySession"],
 ) -> bytes:
     """
-    The encrypt_bytes function encrypts the given unencrypted_data using AES-GCM
-    with the given password. The function returns a byte string containing the salt,
-    nonce, encrypted data, and digest tag concatenated together in that order.
+    The encrypt_bytes function encrypts the given unencrypted_data with the given password.
+    It is a convenience wrapper around encrypt_stream for data that is already in memory,
+    and returns the complete encrypted container (header and segments).
 
     :param unencrypted_data:bytes: Store the data that will be encrypted
-    :param password:t.Union[bytes, str]: Specify the password; string or bytes object allowed
-    :param : Generate a key from the password
-    :return: The encrypted data along with the salt, nonce, and digest tag
+    :param password:t.Union[bytes, str, KeySession]: Specify the password; string, bytes, or key session allowed
+    :return: The encrypted container
     """
-    try:
-        password = password.encode(config.DEFAULT_ENCODING)
-    except AttributeError:
-        # Password is already encoded
-        pass
-
-    key, salt = generate_key(password)
-
-    # Encrypt the data
-    cipher = AES.new(key, AES.MODE_GCM)
-    nonce = cipher.nonce
-    encrypted_data = cipher.encrypt(unencrypted_data)
-    tag = cipher.digest()
-
-    # Return the encrypted data along with the salt, nonce, and digest tag
-    return salt + nonce + encrypted_data + tag
+    encrypted = io.BytesIO()
+    encrypt_stream(io.BytesIO(unencrypted_data), encrypted, password)
+    return encrypted.getvalue()
 
 
-def decrypt_bytes(encrypted_data: bytes, password: t.Union[bytes, str]) -> bytes:
+def decrypt_bytes(
+    encrypted_data: bytes, password: t.Union[bytes, str, "session.KeySession"]
+) -> bytes:
     """
     The decrypt_bytes function takes in a bytes object and a password, and returns the decrypted data.
-    The function uses AES-GCM to decrypt the data,
-    which is an authenticated encryption algorithm that provides both confidentiality and integrity.
-    The function also checks if the encrypted data has been tampered with by comparing its tag with what it should be.
+    It is a convenience wrapper around decrypt_stream, so both the segmented container and
+    the legacy single-buffer format are accepted.
 
     :param encrypted_data:bytes: Store the encrypted data
-    :param password:t.Union[bytes, str]: Specify the password; string or bytes object allowed
+    :param password:t.Union[bytes, str, KeySession]: Specify the password; string, bytes, or key session allowed
     :return: The decrypted data
     """
-    # Extract the salt from the encrypted data, and generate the decryption key
-    encrypted_data = EncryptedData(encrypted_data)
+    decrypted = io.BytesIO()
+    decrypt_stream(io.BytesIO(encrypted_data), decrypted, password)
+    return decrypted.getvalue()
+
+
+def encrypt_stream(
+    src: t.IO[bytes],
+    dst: t.IO[bytes],
+    password: t.Union[bytes, str, "session.KeySession"],
+    segment_size: t.Optional[int] = None,
+) -> t.NoReturn:
+    """
+    The encrypt_stream function reads src until EOF and writes an encrypted container to dst.
+    The container is a header followed by fixed-size segments, each encrypted with AES-GCM
+    under its own nonce and authenticated separately, so only one segment is held in memory
+    at a time. The final segment is always shorter than segment_size (possibly empty), and its
+    nonce carries a final-segment marker; this makes truncation and reordering detectable.
+    The header also holds a key check, so a wrong password is detected without decrypting.
+
+    :param src:t.IO[bytes]: Stream to read the unencrypted data from
+    :param dst:t.IO[bytes]: Stream to write the encrypted container to
+    :param password:t.Union[bytes, str, KeySession]: Specify the password; string, bytes, or key session allowed
+    :param segment_size:t.Optional[int]=None: Size of the plaintext segments
+    :return: None
+    """
+    key_session = session.KeySession.from_password(password)
+    key, salt = key_session.encryption_key()
+    nonce = generate_salt(NONCE_SIZE)
+    header = EncryptionHeader(
+        salt=salt,
+        nonce=nonce,
+        segment_size=segment_size or config.ENCRYPTION_SEGMENT_SIZE,
+        kdf=key_session.kdf,
+        key_check=_key_check(key, nonce),
+    )
+    segment_key = _derive_segment_key(key, header.nonce)
+
+    dst.write(header.raw)
+
+    counter = 0
+    segment = _read_exactly(src, header.segment_size)
+    while True:
+        is_final = len(segment) < header.segment_size
+        cipher = AES.new(
+            segment_key, AES.MODE_GCM, nonce=_segment_nonce(counter, is_final)
+        )
+        cipher.update(header.raw)
+        encrypted_segment, tag = cipher.encrypt_and_digest(segment)
+        dst.write(encrypted_segment)
+        dst.write(tag)
+
+        if is_final:
+            break
+
+        counter += 1
+        segment = _read_exactly(src, header.segment_size)
+
+
+def decrypt_stream(
+    src: t.IO[bytes],
+    dst: t.IO[bytes],
+    password: t.Union[bytes, str, "session.KeySession"],
+) -> t.NoReturn:
+    """
+    The decrypt_stream function reads an encrypted container from src and writes the decrypted
+    data to dst, one segment at a time. Every segment is verified before it is written, and a
+    ValueError is raised if a segment fails authentication or the final segment is missing.
+    A wrong password raises an InvalidPasswordError (a ValueError) before any segment is
+    read, if the header holds a key check.
+
+    Data without the container header is treated as the legacy single-buffer format, which
+    requires a seekable src, and is only verified once all of it has been decrypted; callers
+    should discard dst if a ValueError is raised.
+
+    :param src:t.IO[bytes]: Stream to read the encrypted data from
+    :param dst:t.IO[bytes]: Stream to write the decrypted data to
+    :param password:t.Union[bytes, str, KeySession]: Specify the password; string, bytes, or key session allowed
+    :return: None
+    """
+    key_session = session.KeySession.from_password(password)
+
+    prefix = _read_exactly(src, len(EncryptionHeader.MAGIC))
+    if prefix != EncryptionHeader.MAGIC:
+        _decrypt_legacy_stream(src, dst, key_session, prefix)
+        return
+
+    header = EncryptionHeader.from_stream(src, prefix)
+    segment_key = _derive_segment_key(_header_key(header, key_session), header.nonce)
+
+    counter = 0
+    while True:
+        segment = _read_exactly(src, header.segment_size + TAG_SIZE)
+        if not segment:
+            raise ValueError("Encrypted data is truncated; final segment is missing")
+        if len(segment) < TAG_SIZE:
+            raise ValueError("Encrypted data is truncated; segment tag is missing")
+
+        is_final = len(segment) < header.segment_size + TAG_SIZE
+        cipher = AES.new(
+            segment_key, AES.MODE_GCM, nonce=_segment_nonce(counter, is_final)
+        )
+        cipher.update(header.raw)
+        segment = memoryview(segment)
+        dst.write(cipher.decrypt_and_verify(segment[:-TAG_SIZE], segment[-TAG_SIZE:]))
+
+        if is_final:
+            break
+
+        counter += 1
+
+    if src.read(1):
+        raise ValueError("Encrypted data has trailing bytes after the final segment")
+
+
+def _decrypt_legacy_stream(
+    src: t.IO[bytes],
+    dst: t.IO[bytes],
+    key_session: "session.KeySession",
+    prefix: bytes = b"",
+) -> t.NoReturn:
+    """
+    The _decrypt_legacy_stream function decrypts data written before the segmented container
+    existed: a salt, a nonce, the AES-GCM encrypted data, and a single digest tag at the end.
+    The data is decrypted in segments, but can only be verified after the last one.
+
+    :param src:t.IO[bytes]: Seekable stream to read the encrypted data from
+    :param dst:t.IO[bytes]: Stream to write the decrypted data to
+    :param key_session:KeySession: Key session for the password
+    :param prefix:bytes=b"": Bytes already consumed from the start of src
+    :return: None
+    """
+    salt_and_nonce = prefix + _read_exactly(
+        src, LEGACY_SALT_SIZE + LEGACY_NONCE_SIZE - len(prefix)
+    )
+    salt = salt_and_nonce[:LEGACY_SALT_SIZE]
+    nonce = salt_and_nonce[LEGACY_SALT_SIZE:]
+
+    # Find the digest tag at the end of the data
+    data_start = src.tell()
+    # mmap.seek returns None, so the position is read back separately
+    src.seek(0, io.SEEK_END)
+    data_end = src.tell() - TAG_SIZE
+    if len(nonce) != LEGACY_NONCE_SIZE or data_end < data_start:
+        raise ValueError("Encrypted data is too short")
+    src.seek(data_end)
+    tag = src.read(TAG_SIZE)
+    src.seek(data_start)
+
+    cipher = AES.new(
+        key_session.key_for(salt, KDFParameters()), AES.MODE_GCM, nonce=nonce
+    )
+
+    remaining = data_end - data_start
+    while remaining:
+        segment = _read_exactly(src, min(config.ENCRYPTION_SEGMENT_SIZE, remaining))
+        if not segment:
+            raise ValueError("Encrypted data is truncated")
+        dst.write(cipher.decrypt(segment))
+        remaining -= len(segment)
+
+    cipher.verify(tag)
+
+
+class _SegmentReader(io.RawIOBase):
+    """
+    Read-only, seekable view of the data in an encrypted container. Segments are only
+    read and decrypted when data in them is read, and each is verified before any of its
+    data is returned; the most recently read segment is kept, so sequential reads decrypt
+    each segment once.
+    """
+
+    def __init__(
+        self,
+        src: t.IO[bytes],
+        header: EncryptionHeader,
+        segment_key: bytes,
+        data_start: int,
+    ):
+        self.__src = src
+        self.__header = header
+        self.__segment_key = segment_key
+        self.__data_start = data_start
+        self.__stride = header.segment_size + TAG_SIZE
+
+        # The final segment is always shorter than a full one, which fixes their count;
+        # memory maps only return the new position from 'seek' on Python 3.13+
+        src.seek(0, io.SEEK_END)
+        data_size = src.tell() - data_start
+        self.__final_index, final_size = divmod(data_size, self.__stride)
+        if final_size < TAG_SIZE:
+            raise ValueError("Encrypted data is truncated; final segment is missing")
+        self.__size = self.__final_index * header.segment_size + final_size - TAG_SIZE
+
+        self.__position = 0
+        self.__segment_index: t.Optional[int] = None
+        self.__segment = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.__position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.__position, io.SEEK_END: self.__size}
+        position = base[whence] + offset
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self.__position = position
+        return position
+
+    def segment(self, index: int) -> bytes:
+        """
+        The segment function returns the decrypted data of a segment, raising a ValueError
+        if it fails authentication.
+
+        :param self: Access the attributes of the class
+        :param index:int: Index of the segment
+        :return: The decrypted segment
+        """
+        if index != self.__segment_index:
+            self.__src.seek(self.__data_start + index * self.__stride)
+            segment = memoryview(_read_exactly(self.__src, self.__stride))
+            if len(segment) < TAG_SIZE:
+                raise ValueError("Encrypted data is truncated; segment tag is missing")
+
+            cipher = AES.new(
+                self.__segment_key,
+                AES.MODE_GCM,
+                nonce=_segment_nonce(index, index == self.__final_index),
+            )
+            cipher.update(self.__header.raw)
+            self.__segment = cipher.decrypt_and_verify(
+                segment[:-TAG_SIZE], segment[-TAG_SIZE:]
+            )
+            self.__segment_index = index
+
+        return self.__segment
+
+    def readinto(self, buffer: t.Any) -> int:
+        if self.__position >= self.__size:
+            return 0
+
+        index, offset = divmod(self.__position, self.__header.segment_size)
+        data = self.segment(index)[offset : offset + len(buffer)]
+        buffer[: len(data)] = data
+        self.__position += len(data)
+        return len(data)
+
+
+def open_decrypted_stream(
+    src: t.IO[bytes],
+    password: t.Union[bytes, str, "session.KeySession"],
+) -> t.Optional[t.IO[bytes]]:
+    """
+    The open_decrypted_stream function returns a seekable, read-only view of the data in an
+    encrypted container, without decrypting it up front: each segment is decrypted and
+    verified when data in it is first read. Reading a few members of a ZIP file therefore
+    only decrypts the segments holding them and the central directory. The final segment
+    is verified straight away, so a wrong password or truncated data raises a ValueError;
+    an InvalidPasswordError if the key check in the header does not match.
+
+    Data in the legacy single-buffer format can only be verified once all of it has been
+    decrypted, so None is returned for it; use 'decrypt_stream' instead.
+
+    :param src:t.IO[bytes]: Seekable stream to read the encrypted data from
+    :param password:t.Union[bytes, str, KeySession]: Specify the password; string, bytes, or key session allowed
+    :return: The decrypted view, or None for the legacy format
+    """
+    key_session = session.KeySession.from_password(password)
+
+    src.seek(0)
+    prefix = _read_exactly(src, len(EncryptionHeader.MAGIC))
+    if prefix != EncryptionHeader.MAGIC:
+        return None
+
+    header = EncryptionHeader.from_stream(src, prefix)
+    reader = _SegmentReader(
+        src,
+        header,
+        _derive_segment_key(_header_key(header, key_session), header.nonce),
+        src.tell(),
+    )
+    reader.segment(reader.seek(0, io.SEEK_END) // header.segment_size)
+    reader.seek(0)
+
+    return io.BufferedReader(reader)
+
+
+def read_key_salt(src: t.IO[bytes]) -> t.Tuple[bytes, KDFParameters]:
+    """
+    The read_key_salt function reads the salt and key derivation parameters from the start
+    of encrypted data without decrypting any of it, so the key can be derived ahead of
+    time (see 'KeySession.prefetch'). Data in the legacy format starts with its salt, and
+    was always derived with the default parameters.
+
+    :param src:t.IO[bytes]: Stream positioned at the start of the encrypted data
+    :return: A tuple of the salt and key derivation parameters
+    """
+    prefix = _read_exactly(src, len(EncryptionHeader.MAGIC))
+    if prefix != EncryptionHeader.MAGIC:
+        salt = prefix + _read_exactly(src, LEGACY_SALT_SIZE - len(prefix))
+        if len(salt) != LEGACY_SALT_SIZE:
+            raise ValueError("Encrypted data is too short")
+        return salt, KDFParameters()
+
+    header = EncryptionHeader.from_stream(src, prefix)
+    return header.salt, header.kdf
+
+
+def _header_key(header: EncryptionHeader, key_session: "session.KeySession") -> bytes:
+    """
+    The _header_key function derives the key of a container from its header, and checks
+    it against the key check in the header, if there is one.
+
+    :param header:EncryptionHeader: Header of the container
+    :param key_session:KeySession: Key session for the password
+    :return: The password-derived key
+    """
+    key = key_session.key_for(header.salt, header.kdf)
+    if header.key_check is not None and not hmac.compare_digest(
+        _key_check(key, header.nonce), header.key_check
+    ):
+        raise InvalidPasswordError("Password does not match the key check")
 
-    key, _ = generate_key(password, encrypted_data.salt)
+    return key
 
-    # Create cipher with the nonce
-    cipher = AES.new(key, AES.MODE_GCM, nonce=encrypted_data.nonce)
 
-    # Decrypt the data
-    decrypted_data = cipher.decrypt(encrypted_data.raw_data)
+def _key_check(key: bytes, nonce: bytes) -> bytes:
+    return derive_subkey(key, b"macos-installation key check", salt=nonce)
 
-    # Verify the data
-    cipher.verify(encrypted_data.tag)
 
-    # Return the decrypted data
-    return decrypted_data
+def _derive_segment_key(key: bytes, nonce: bytes) -> bytes:
+    """
+    The _derive_segment_key function derives the key used for the segments of one container
+    from the password-derived key and the container's random nonce, so segment nonces never
+    repeat under the same key even if the password-derived key is reused.
+
+    :param key:bytes: Password-derived key
+    :param nonce:bytes: Random nonce from the container header
+    :return: The segment key
+    """
+    return derive_subkey(key, b"macos-installation segment key", salt=nonce)
+
+
+def derive_subkey(key: bytes, context: bytes, salt: bytes = b"") -> bytes:
+    """
+    The derive_subkey function derives a key for a single purpose (given by context) from a
+    password-derived key with HKDF-SHA256, so the expensive key derivation is done only once
+    and keys used for different purposes are still independent.
+
+    :param key:bytes: Password-derived key
+    :param context:bytes: Purpose of the derived key
+    :param salt:bytes=b"": Optional salt
+    :return: The derived key, as long as the password-derived key
+    """
+    return KDF.HKDF(key, len(key), salt, SHA256, context=context)
+
+
+def _segment_nonce(counter: int, is_final: bool) -> bytes:
+    """
+    The _segment_nonce function builds the 12-byte AES-GCM nonce of a segment from its
+    position in the container, and a marker byte which is only set on the final segment.
+
+    :param counter:int: Index of the segment
+    :param is_final:bool: Whether this is the final segment
+    :return: The segment nonce
+    """
+    return counter.to_bytes(11, "big") + (b"\x01" if is_final else b"\x00")
+
+
+def _read_exactly(stream: t.IO[bytes], size: int) -> bytes:
+    """
+    The _read_exactly function reads size bytes from the stream, only returning fewer
+    bytes when the end of the stream is reached.
+
+    :param stream:t.IO[bytes]: Stream to read from
+    :param size:int: Number of bytes to read
+    :return: The bytes read
+    """
+    data = stream.read(size)
+    if len(data) in (0, size):
+        return data
+
+    chunks = [data]
+    remaining = size - len(data)
+    while remaining:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+
+    return b"".join(chunks)
 
 
 def generate_salt(size: int = 32) -> bytes:
@@ -84,6 +479,7 @@ def generate_key(
     password: str,
     salt: t.Optional[bytes] = None,
     key_length: t.Optional[int] = 32,
+    kdf: t.Optional[KDFParameters] = None,
 ) -> t.Tuple[bytes, bytes]:
     """
     The generate_key function generates a key and salt for use in the encrypt
@@ -93,8 +489,55 @@ def generate_key(
     :param password:str: Provide the password that will be used to generate the key
     :param salt:t.Optional[bytes]=None: Generate a new salt if one is not provided
     :param key_length:t.Optional[int]=32: Specify the length of the key to be generated
+    :param kdf:t.Optional[KDFParameters]=None: Key derivation parameters; defaults to scrypt with N=2**20, r=8, p=1
     :return: A tuple of the key and salt
     """
     if not salt:
         salt = generate_salt(key_length)
-    return KDF.scrypt(password, salt, key_len=key_length, N=2**20, r=8, p=1), salt
+    kdf = kdf or KDFParameters()
+    return (
+        KDF.scrypt(password, salt, key_len=key_length, N=kdf.n, r=kdf.r, p=kdf.p),
+        salt,
+    )
+
+
+def calibrate_kdf(
+    time_target: float = config.KDF_TIME_TARGET,
+    memory_limit: int = config.KDF_MEMORY_LIMIT,
+) -> KDFParameters:
+    """
+    The calibrate_kdf function benchmarks scrypt on the current host, and returns the
+    strongest parameters which derive a key within the time target without allocating
+    more than the memory limit. The cost parameter N is doubled for as long as the
+    measured derivation time allows it; r and p keep their default values.
+
+    If even the lowest cost considered exceeds the time target, that cost is returned.
+
+    :param time_target:float=config.KDF_TIME_TARGET: Maximum time (seconds) a key derivation may take
+    :param memory_limit:int=config.KDF_MEMORY_LIMIT: Maximum memory (bytes) a key derivation may use
+    :return: The calibrated key derivation parameters
+    """
+    password, salt = generate_salt(), generate_salt()
+
+    def measure(parameters: KDFParameters) -> float:
+        start = time.perf_counter()
+        generate_key(password, salt, kdf=parameters)
+        return time.perf_counter() - start
+
+    kdf = KDFParameters(n=KDF_CALIBRATION_MIN_N)
+    elapsed = measure(kdf)
+    while True:
+        candidate = dataclasses.replace(kdf, n=kdf.n * 2)
+        if candidate.memory_cost > memory_limit or elapsed * 2 > time_target:
+            break
+
+        elapsed = measure(candidate)
+        if elapsed > time_target:
+            break
+        kdf = candidate
+
+    logger.debug(
+        f"Calibrated KDF parameters: {kdf} "
+        f"(memory: {kdf.memory_cost // 1024**2} MiB)"
+    )
+    return kdf
@@ -1,8 +1,43 @@
 import typing as t
 
-def encrypt_bytes(unencrypted_data: bytes, password: t.Union[bytes, str]) -> bytes: ...
-def decrypt_bytes(encrypted_data: bytes, password: t.Union[bytes, str]) -> bytes: ...
+from macos_installation.classes.data import KDFParameters  # type: ignore
+from macos_installation.classes.session import KeySession  # type: ignore
+
+NONCE_SIZE: t.Final[int]
+TAG_SIZE: t.Final[int]
+KDF_CALIBRATION_MIN_N: t.Final[int]
+LEGACY_SALT_SIZE: t.Final[int]
+LEGACY_NONCE_SIZE: t.Final[int]
+
+class InvalidPasswordError(ValueError): ...
+
+def encrypt_bytes(
+    unencrypted_data: bytes, password: t.Union[bytes, str, KeySession]
+) -> bytes: ...
+def decrypt_bytes(
+    encrypted_data: bytes, password: t.Union[bytes, str, KeySession]
+) -> bytes: ...
+def encrypt_stream(
+    src: t.IO[bytes],
+    dst: t.IO[bytes],
+    password: t.Union[bytes, str, KeySession],
+    segment_size: t.Optional[int] = ...,
+) -> t.NoReturn: ...
+def decrypt_stream(
+    src: t.IO[bytes], dst: t.IO[bytes], password: t.Union[bytes, str, KeySession]
+) -> t.NoReturn: ...
+def open_decrypted_stream(
+    src: t.IO[bytes], password: t.Union[bytes, str, KeySession]
+) -> t.Optional[t.IO[bytes]]: ...
+def read_key_salt(src: t.IO[bytes]) -> t.Tuple[bytes, KDFParameters]: ...
+def derive_subkey(key: bytes, context: bytes, salt: bytes = ...) -> bytes: ...
 def generate_salt(size: int = ...) -> bytes: ...
 def generate_key(
-    password: str, salt: t.Optional[bytes] = ..., key_length: t.Optional[int] = ...
+    password: str,
+    salt: t.Optional[bytes] = ...,
+    key_length: t.Optional[int] = ...,
+    kdf: t.Optional[KDFParameters] = ...,
 ) -> t.Tuple[bytes, bytes]: ...
+def calibrate_kdf(
+    time_target: float = ..., memory_limit: int = ...
+) -> KDFParameters: ...
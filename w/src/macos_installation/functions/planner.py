@@ -0,0 +1,132 @@
+import hashlib
+import heapq
+import pathlib
+import shutil
+import time
+import typing as t
+import zipfile
+
+from macos_installation import config
+from macos_installation.classes.data import BackupPlan, LocationPlan
+from macos_installation.functions import compression
+
+
+def get_free_space(path: pathlib.Path) -> t.Optional[int]:
+    """
+    The get_free_space function returns the free space of the file system a path is (or
+    would be) created on. Paths which do not exist yet are looked up through their nearest
+    existing parent.
+
+    :param path:pathlib.Path: Path to look up
+    :return: The number of free bytes, or None if it cannot be determined
+    """
+    for parent in (path, *path.parents):
+        if parent.exists():
+            try:
+                return shutil.disk_usage(parent).free
+            except OSError:
+                return None
+    return None
+
+
+def sample_files(
+    file_paths: t.Sequence[pathlib.Path], count: int
+) -> t.List[pathlib.Path]:
+    """
+    The sample_files function picks files spread evenly over a list of files, so the
+    sample covers every part of a location rather than only its first directory.
+
+    :param file_paths:t.Sequence[pathlib.Path]: Files to pick from
+    :param count:int: Maximum number of files to pick
+    :return: The picked files, in the order they were given
+    """
+    count = min(count, len(file_paths))
+    return [file_paths[i * len(file_paths) // count] for i in range(count)]
+
+
+def plan_backup(
+    file_paths: t.Iterable[pathlib.Path],
+    backup_locations: t.Iterable[pathlib.Path],
+    destination: pathlib.Path,
+    policy: str = config.COMPRESSION_POLICY,
+    jobs: int = 1,
+    copies: int = 2,
+    largest_files: int = config.PLAN_LARGEST_FILES,
+    sample_count: int = config.PLAN_SAMPLE_FILES,
+    sample_size: int = config.PLAN_SAMPLE_SIZE,
+) -> BackupPlan:
+    """
+    The plan_backup function estimates what a backup of the given files will take, without
+    writing anything. Every file is stat-ed, and a few files of each location are sampled:
+    the start of each sample is compressed the way the compression policy would compress
+    the file, which gives the location's compression ratio, and is hashed and compressed
+    under a timer, which gives the throughput the size and time estimates are based on.
+
+    :param file_paths:t.Iterable[pathlib.Path]: Files which will be backed up
+    :param backup_locations:t.Iterable[pathlib.Path]: Locations the files belong to
+    :param destination:pathlib.Path: Backup file or repository the backup is written to
+    :param policy:str=config.COMPRESSION_POLICY: Compression policy; see 'compression.POLICIES'
+    :param jobs:int=1: Number of processes compressing files
+    :param copies:int=2: Number of copies of the backup which exist at once while it is written
+    :param largest_files:int=config.PLAN_LARGEST_FILES: Number of largest files to report
+    :param sample_count:int=config.PLAN_SAMPLE_FILES: Number of files sampled per location
+    :param sample_size:int=config.PLAN_SAMPLE_SIZE: Number of bytes sampled per file
+    :return: The backup plan
+    """
+    locations = {
+        location: LocationPlan(location) for location in sorted(backup_locations)
+    }
+    location_files: t.Dict[pathlib.Path, t.List[pathlib.Path]] = {
+        location: [] for location in locations
+    }
+    file_sizes: t.List[t.Tuple[int, str]] = []
+
+    for file_path in file_paths:
+        location = next(
+            (p for p in (file_path, *file_path.parents) if p in locations), None
+        )
+        if location is None:
+            continue
+
+        file_size = file_path.stat().st_size
+        locations[location].files += 1
+        locations[location].file_size += file_size
+        location_files[location].append(file_path)
+        file_sizes.append((file_size, str(file_path)))
+
+    hash_seconds, compress_seconds, sampled = 0.0, 0.0, 0
+    for location, plan in locations.items():
+        for file_path in sample_files(location_files[location], sample_count):
+            compress_type, compress_level = compression.choose_compression(
+                file_path, policy
+            )
+            with file_path.open("rb") as f:
+                sample = f.read(sample_size)
+
+            start_time = time.perf_counter()
+            hashlib.sha256(sample).digest()
+            hash_seconds += time.perf_counter() - start_time
+
+            compress_size = len(sample)
+            start_time = time.perf_counter()
+            compressor = zipfile._get_compressor(compress_type, compress_level)
+            if compressor is not None:
+                compress_size = len(compressor.compress(sample) + compressor.flush())
+            compress_seconds += time.perf_counter() - start_time
+
+            plan.sample_size += len(sample)
+            plan.sample_compress_size += compress_size
+            sampled += len(sample)
+
+    return BackupPlan(
+        destination=destination,
+        locations=list(locations.values()),
+        largest_files=[
+            (path, size) for size, path in heapq.nlargest(largest_files, file_sizes)
+        ],
+        hash_throughput=sampled / hash_seconds if hash_seconds else 0.0,
+        compress_throughput=sampled / compress_seconds if compress_seconds else 0.0,
+        jobs=jobs,
+        copies=copies,
+        free_space=get_free_space(destination),
+    )
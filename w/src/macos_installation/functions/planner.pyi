@@ -0,0 +1,20 @@
+import pathlib
+import typing as t
+
+from macos_installation.classes.data import BackupPlan  # type: ignore
+
+def get_free_space(path: pathlib.Path) -> t.Optional[int]: ...
+def sample_files(
+    file_paths: t.Sequence[pathlib.Path], count: int
+) -> t.List[pathlib.Path]: ...
+def plan_backup(
+    file_paths: t.Iterable[pathlib.Path],
+    backup_locations: t.Iterable[pathlib.Path],
+    destination: pathlib.Path,
+    policy: str = ...,
+    jobs: int = ...,
+    copies: int = ...,
+    largest_files: int = ...,
+    sample_count: int = ...,
+    sample_size: int = ...,
+) -> BackupPlan: ...
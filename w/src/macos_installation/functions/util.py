@@ -1,51 +1,249 @@
+import collections
+import concurrent.futures
+import contextlib
 import datetime
+import functools
 import hashlib
+import logging
+import mmap
+import os
 import pathlib
+import re
 import shutil
+import tempfile
 import typing as t
 
+from macos_installation import config
 
-def create_backup(path: pathlib.Path, suffix: str = None) -> pathlib.Path:
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Hashing is done in blocks of this size; files of at least the mmap
+# threshold are hashed from a memory map instead of read into buffers
+HASH_BLOCK_SIZE: t.Final[int] = 1024 * 1024
+HASH_MMAP_THRESHOLD: t.Final[int] = 8 * 1024 * 1024
+
+# How symbolic links found while walking directories are handled (see
+# 'get_recursive_file_list'), and how 'create_backup' backs up paths; kept in the
+# config, so the CLI can offer them without importing this module
+SYMLINK_POLICIES: t.Final[t.Tuple[str, ...]] = config.SYMLINK_POLICIES
+BACKUP_STRATEGIES: t.Final[t.Tuple[str, ...]] = config.BACKUP_STRATEGIES
+
+# The Linux ioctl cloning a file's extents into another file, used by the 'reflink'
+# strategy
+FICLONE: t.Final[int] = 0x40049409
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def _copy_file(src: str, dst: str, strategy: str, used: t.Counter[str]) -> str:
+    """
+    The _copy_file function copies a file for 'create_backup', cloning or hard linking it
+    if the strategy asks for it, and copying it if that fails (e.g. on a filesystem which
+    does not support it). The destination is removed first, since writing to it could
+    otherwise write through a hard link made by an earlier backup into the original.
+
+    :param src:str: File to copy
+    :param dst:str: Path of the copy
+    :param strategy:str: Strategy of the backup; see 'BACKUP_STRATEGIES'
+    :param used:t.Counter[str]: Counts of the strategies used, which are updated
+    :return: The path of the copy
+    """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+
+    if not os.path.islink(src):
+        try:
+            if strategy == "hardlink":
+                os.link(src, dst)
+                used["hardlink"] += 1
+                return dst
+            if strategy == "reflink" and fcntl is not None:
+                with open(src, "rb") as s, open(dst, "xb") as d:
+                    fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+                shutil.copystat(src, dst)
+                used["reflink"] += 1
+                return dst
+        except OSError:
+            if os.path.lexists(dst):
+                os.unlink(dst)
+
+    shutil.copy2(src, dst)
+    used["copy"] += 1
+    return dst
+
+
+def create_backup(
+    path: pathlib.Path, suffix: str = None, strategy: str = "copy"
+) -> pathlib.Path:
     """
     The create_backup function creates a backup of the specified file or directory.
     If the path is a file, then it will create a copy of that file with the current date and time as its suffix.
     If the path is a directory, then it will create an exact copy of that directory with the current date and time as its suffix.
 
+    Strategies other than 'copy' avoid copying data: 'rename' moves the path aside, which
+    suits paths about to be replaced anyway (the path no longer exists afterwards);
+    'reflink' clones files, sharing their extents until either copy is written to (btrfs,
+    XFS); 'hardlink' links files, which is only safe if the originals are replaced rather
+    than modified in place. Whatever cannot be backed up this way is copied instead; the
+    strategies used are logged.
+
     :param path:pathlib.Path: Specify the path to a file or directory
     :param suffix:str=None: Specify a suffix for the backup file
+    :param strategy:str="copy": How the backup is made; one of 'BACKUP_STRATEGIES'
     :return: The path of the backup file or directory
     """
+    if strategy not in BACKUP_STRATEGIES:
+        raise ValueError(f"Unknown backup strategy: '{strategy}'")
+
     # If no suffix specified, get the current date and time, and
     # format the date and time as a string in the format "YYYY-MM-DD_HH-MM-SS"
     suffix = suffix or datetime.datetime.now().strftime("%Y-%m-%d")
 
     new_path = pathlib.Path(f"{path}_{suffix}")
+    used: t.Counter[str] = collections.Counter()
 
-    # Check if the path is a file or a directory
-    if path.is_file():
-        # If the path is a file, create a backup of the file with the date and time suffix
-        shutil.copy2(path, new_path)
-        return new_path
-    elif path.is_dir():
-        # If the path is a directory, create a backup of the directory with the date and time suffix
-        shutil.copytree(path, new_path, dirs_exist_ok=True)
-        return new_path
-    else:
+    if not (path.is_file() or path.is_dir()):
         # If the path is neither a file nor a directory, raise an exception
         raise ValueError(f"{path} is neither a file nor a directory")
 
+    if strategy == "rename":
+        try:
+            # Fails if a non-empty backup directory from earlier exists; it is merged below
+            os.rename(path, new_path)
+            used["rename"] += 1
+        except OSError as e:
+            logger.debug(f"Renaming '{path}' failed, copying it instead: {e}")
+
+    copy_function = functools.partial(_copy_file, strategy=strategy, used=used)
+    if not used and path.is_file():
+        # If the path is a file, create a backup of the file with the date and time suffix
+        copy_function(str(path), str(new_path))
+    elif not used:
+        # If the path is a directory, create a backup of the directory with the date and time suffix
+        shutil.copytree(path, new_path, copy_function=copy_function, dirs_exist_ok=True)
+
+    strategies = ", ".join(
+        name if name == "rename" else f"{name} ({count} files)"
+        for name, count in used.items()
+    )
+    logger.info(f"Backed up '{path}' to '{new_path}' using {strategies or 'copy'}")
+    return new_path
+
+
+def translate_glob(pattern: str) -> str:
+    """
+    The translate_glob function translates a glob pattern into a regular expression. Unlike
+    'fnmatch', wildcards do not match across directories: '*' and '?' never match a '/',
+    while '**' matches any number of directories (e.g. '.vim/**/.git' matches both
+    '.vim/.git' and '.vim/pack/plugins/start/fugitive/.git').
+
+    :param pattern:str: Glob pattern
+    :return: A regular expression matching the same paths
+    """
+    i, n, result = 0, len(pattern), []
+    while i < n:
+        if pattern.startswith("**/", i):
+            result.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            result.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            result.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            result.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2 :]:
+            end = pattern.index("]", i + 2)
+            characters = pattern[i + 1 : end].replace("\\", "\\\\")
+            if characters.startswith("!"):
+                characters = "^" + characters[1:]
+            result.append(f"[{characters}]")
+            i = end + 1
+        else:
+            result.append(re.escape(pattern[i]))
+            i += 1
+
+    return "".join(result)
+
+
+def compile_path_patterns(
+    patterns: t.Iterable[str], base_dir: t.Optional[t.Union[str, pathlib.Path]] = None
+) -> t.Callable[[str, str], bool]:
+    """
+    The compile_path_patterns function compiles glob patterns into a single matcher. Like
+    in '.gitignore' files, a pattern without a '/' matches the name of a file or directory
+    anywhere (e.g. '__pycache__', '*.swp'); an absolute pattern matches the full path; and
+    any other pattern matches the path relative to base_dir (e.g. '.vim/**/.git').
+
+    :param patterns:t.Iterable[str]: Glob patterns; see 'translate_glob'
+    :param base_dir:t.Optional[t.Union[str, pathlib.Path]]=None: Directory relative patterns are anchored to
+    :return: A function of a path and its name, returning whether any pattern matches
+    """
+    name_patterns, path_patterns = [], []
+    base = f"{str(base_dir).rstrip(os.sep)}{os.sep}" if base_dir is not None else None
+
+    for pattern in patterns:
+        pattern = pattern.rstrip("/")
+        if "/" not in pattern:
+            name_patterns.append(translate_glob(pattern))
+        elif pattern.startswith("/"):
+            path_patterns.append(translate_glob(pattern))
+        elif base is not None:
+            path_patterns.append(re.escape(base) + translate_glob(pattern))
+
+    # One alternation per kind is much faster than trying each pattern in turn
+    name_regex = re.compile("|".join(name_patterns)) if name_patterns else None
+    path_regex = re.compile("|".join(path_patterns)) if path_patterns else None
+
+    def matches(path: str, name: str) -> bool:
+        return bool(
+            (name_regex is not None and name_regex.fullmatch(name))
+            or (path_regex is not None and path_regex.fullmatch(path))
+        )
+
+    return matches
+
 
 def get_recursive_file_list(
-    locations: t.Iterable[t.Union[str, pathlib.Path]]
+    locations: t.Iterable[t.Union[str, pathlib.Path]],
+    excludes: t.Iterable[str] = (),
+    includes: t.Iterable[str] = (),
+    symlink_policy: str = "files",
+    base_dir: t.Optional[t.Union[str, pathlib.Path]] = None,
 ) -> t.Iterator[pathlib.Path]:
     """
     The get_recursive_file_list function accepts a list of file paths and returns a generator
-    of all the files in those locations. If any of the input locations are directories, this function
-    will recurse through each directory to find all files contained within it.
+    of all the files in those locations. Directories are walked with 'os.scandir', whose
+    entries carry the file type, so most files are never stat'ed. Directories matching an
+    exclude pattern are pruned before they are read; sockets, FIFOs and devices are always
+    skipped. Within each directory, files are yielded in name order before the contents of
+    its subdirectories, so the same tree always gives the same list.
+
+    Symbolic links inside the locations are handled according to symlink_policy: 'skip'
+    ignores them; 'files' (the default) backs up the targets of links to files, but does
+    not descend into linked directories; 'follow' also descends into linked directories,
+    visiting each directory at most once so link cycles terminate. Locations themselves
+    are always followed.
 
     :param locations:t.Iterable[t.Union[str, pathlib.Path]]: Specify the location of the files to be searched
+    :param excludes:t.Iterable[str]=(): Glob patterns of files and directories to skip; see 'compile_path_patterns'
+    :param includes:t.Iterable[str]=(): Glob patterns of files to keep; if given, other files are skipped
+    :param symlink_policy:str="files": How symbolic links are handled; one of 'SYMLINK_POLICIES'
+    :param base_dir:t.Optional[t.Union[str, pathlib.Path]]=None: Directory relative patterns are anchored to
     :return: A generator object that contains all the files the directories given
     """
+    if symlink_policy not in SYMLINK_POLICIES:
+        raise ValueError(f"Unknown symlink policy: '{symlink_policy}'")
+
+    is_excluded = compile_path_patterns(excludes, base_dir)
+    includes = list(includes)
+    is_included = compile_path_patterns(includes, base_dir) if includes else None
+    follow_dirs = symlink_policy == "follow"
 
     for location in locations:
         # First check if the input is string
@@ -53,33 +251,167 @@ def get_recursive_file_list(
         if isinstance(location, str):
             location = pathlib.Path(location)
 
-        # If location is directory, recurse
-        if location.is_dir():
-            # Recursively search the directory for files
-            for p in location.glob("**/*"):
-                # Yield each file
-                if p.is_file():
-                    yield p
+        if is_excluded(str(location), location.name):
+            continue
+
         # Otherwise give the file path back
-        elif location.is_file():
-            yield location
+        if not location.is_dir():
+            if location.is_file() and (
+                is_included is None or is_included(str(location), location.name)
+            ):
+                yield location
+            continue
+
+        # Directories visited so far, by device and inode, when following links to them
+        visited = {(location.stat().st_dev, location.stat().st_ino)}
+        stack = [str(location)]
+
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError as e:
+                logger.warning(f"Skipping unreadable directory: {e}")
+                continue
+
+            subdirectories = []
+            for entry in entries:
+                is_symlink = entry.is_symlink()
+                if (is_symlink and symlink_policy == "skip") or is_excluded(
+                    entry.path, entry.name
+                ):
+                    continue
+
+                try:
+                    if entry.is_dir():
+                        if is_symlink:
+                            if not follow_dirs:
+                                continue
+                            stat_result = entry.stat()
+                            key = (stat_result.st_dev, stat_result.st_ino)
+                            if key in visited:
+                                continue
+                            visited.add(key)
+                        subdirectories.append(entry.path)
+                    elif entry.is_file() and (
+                        is_included is None or is_included(entry.path, entry.name)
+                    ):
+                        yield pathlib.Path(entry.path)
+                except OSError as e:
+                    logger.warning(f"Skipping unreadable entry: {e}")
+
+            # Depth-first, in name order
+            stack.extend(reversed(subdirectories))
 
 
-def get_file_sha256_hash(file_path: pathlib.Path) -> str:
+def get_file_sha256_hash(
+    file_path: pathlib.Path,
+    block_size: int = HASH_BLOCK_SIZE,
+    mmap_threshold: int = HASH_MMAP_THRESHOLD,
+) -> str:
     """
     The get_file_sha256_hash function accepts a pathlib.Path object representing the file to be hashed,
-    and returns the SHA256 hash of that file as a string.
+    and returns the SHA256 hash of that file as a string. The file is hashed in fixed-size blocks, so
+    memory usage does not depend on the size of the file; large files are hashed from a memory map.
 
     :param file_path:pathlib.Path: Pass the file path to the function
+    :param block_size:int=HASH_BLOCK_SIZE: Number of bytes hashed at a time
+    :param mmap_threshold:int=HASH_MMAP_THRESHOLD: Minimum file size for hashing from a memory map
     :return: The sha256 hash of the contents of a file
     """
-    # Open the file in binary mode
-    with file_path.open("rb") as f:
-        # Read the contents of the file into memory
-        contents = f.read()
+    digest = hashlib.sha256()
+
+    # Open the file in unbuffered binary mode; blocks are read straight into our buffer
+    with file_path.open("rb", buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+
+        if size and size >= mmap_threshold:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, "madvise"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                with memoryview(mapped) as view:
+                    for offset in range(0, len(view), block_size):
+                        digest.update(view[offset : offset + block_size])
+        else:
+            buffer = bytearray(block_size)
+            with memoryview(buffer) as view:
+                while read_size := f.readinto(buffer):
+                    digest.update(view[:read_size])
+
+    return digest.hexdigest()
+
+
+def get_file_sha256_hashes(
+    file_paths: t.Iterable[pathlib.Path], jobs: t.Optional[int] = None
+) -> t.Dict[pathlib.Path, str]:
+    """
+    The get_file_sha256_hashes function returns the SHA256 hashes of the given files, hashing them
+    concurrently in a pool of threads. hashlib releases the GIL while hashing, so the threads run in
+    parallel and hashing is bound by disk throughput rather than a single core.
+
+    :param file_paths:t.Iterable[pathlib.Path]: Files to hash
+    :param jobs:t.Optional[int]=None: Number of threads; None picks a default based on the CPU count
+    :return: A dictionary of file paths to their sha256 hashes, in the order they were given
+    """
+    file_paths = list(file_paths)
+
+    if jobs == 1 or len(file_paths) < 2:
+        return {p: get_file_sha256_hash(p) for p in file_paths}
 
-    # Calculate the SHA256 hash of the contents
-    return hashlib.sha256(contents).hexdigest()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        return dict(zip(file_paths, executor.map(get_file_sha256_hash, file_paths)))
+
+
+@contextlib.contextmanager
+def atomic_write(file_path: pathlib.Path) -> t.Iterator[t.IO[bytes]]:
+    """
+    The atomic_write function opens a temporary file next to file_path for writing, and
+    renames it into place once the block completes, so a partially written file is never
+    left behind. If the block raises, the temporary file is removed instead. The file gets
+    the usual mode of new files (honoring the umask), not the private mode of temporary
+    files.
+
+    :param file_path:pathlib.Path: File to write
+    :return: A context manager yielding the temporary file, opened in binary mode
+    """
+    with tempfile.NamedTemporaryFile(
+        dir=file_path.parent, prefix=f".{file_path.name}.", delete=False
+    ) as f:
+        try:
+            os.chmod(f.fileno(), 0o666 & ~get_umask())
+            yield f
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, file_path)
+
+
+def _read_umask() -> int:
+    """
+    The _read_umask function reads the file mode creation mask of the process, which
+    can only be read by setting it; it is restored straight away.
+
+    :return: The umask
+    """
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+# Setting the umask races with other threads reading it, and a thread could restore
+# the temporary value last, so it is only read once on import
+_UMASK: t.Final[int] = _read_umask()
+
+
+def get_umask() -> int:
+    """
+    The get_umask function returns the file mode creation mask of the process, as read
+    on import; it never changes the umask, so threads can call it safely.
+
+    :return: The umask
+    """
+    return _UMASK
 
 
 def get_terminal_size(
@@ -1,11 +1,36 @@
+import logging
 import pathlib
 import typing as t
 
-def create_backup(path: pathlib.Path, suffix: str = ...) -> pathlib.Path: ...
+HASH_BLOCK_SIZE: t.Final[int]
+HASH_MMAP_THRESHOLD: t.Final[int]
+SYMLINK_POLICIES: t.Final[t.Tuple[str, ...]]
+BACKUP_STRATEGIES: t.Final[t.Tuple[str, ...]]
+FICLONE: t.Final[int]
+logger: logging.Logger
+
+def create_backup(
+    path: pathlib.Path, suffix: str = ..., strategy: str = ...
+) -> pathlib.Path: ...
+def translate_glob(pattern: str) -> str: ...
+def compile_path_patterns(
+    patterns: t.Iterable[str], base_dir: t.Optional[t.Union[str, pathlib.Path]] = ...
+) -> t.Callable[[str, str], bool]: ...
 def get_recursive_file_list(
-    locations: t.Iterable[t.Union[str, pathlib.Path]]
+    locations: t.Iterable[t.Union[str, pathlib.Path]],
+    excludes: t.Iterable[str] = ...,
+    includes: t.Iterable[str] = ...,
+    symlink_policy: str = ...,
+    base_dir: t.Optional[t.Union[str, pathlib.Path]] = ...,
 ) -> t.Iterator[pathlib.Path]: ...
-def get_file_sha256_hash(file_path: pathlib.Path) -> str: ...
+def get_file_sha256_hash(
+    file_path: pathlib.Path, block_size: int = ..., mmap_threshold: int = ...
+) -> str: ...
+def get_file_sha256_hashes(
+    file_paths: t.Iterable[pathlib.Path], jobs: t.Optional[int] = ...
+) -> t.Dict[pathlib.Path, str]: ...
+def atomic_write(file_path: pathlib.Path) -> t.ContextManager[t.IO[bytes]]: ...
+def get_umask() -> int: ...
 def get_terminal_size(
     fallback: t.Optional[t.Tuple[int, int]] = ...
 ) -> t.Tuple[int, int]: ...
@@ -0,0 +1,187 @@
+import hashlib
+import io
+import os
+import unittest
+import zipfile
+from unittest import mock
+
+from macos_installation.classes.data import CompressionStatistics
+from macos_installation.functions import archive
+from tests import TestBase
+
+
+class TestWriteFileToZip(TestBase):
+    def test_write_file_to_zip(self):
+        file_paths = [self.file1_path, self.file4_path]
+        contents = [self.file1_content, self.file4_content]
+
+        zip_contents = io.BytesIO()
+        with zipfile.ZipFile(
+            zip_contents, mode="w", compression=zipfile.ZIP_DEFLATED
+        ) as zip_file:
+            digests = [
+                archive.write_file_to_zip(zip_file, file_path, block_size=7)
+                for file_path in file_paths
+            ]
+
+        # Digests are computed from the same read that was compressed
+        self.assertEqual(
+            digests, [hashlib.sha256(c.encode()).hexdigest() for c in contents]
+        )
+
+        # Members are named and stored the same way 'ZipFile.write' would
+        reference_contents = io.BytesIO()
+        with zipfile.ZipFile(reference_contents, mode="w") as zip_file:
+            for file_path in file_paths:
+                zip_file.write(file_path)
+            reference_names = zip_file.namelist()
+
+        with zipfile.ZipFile(zip_contents) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            self.assertEqual(zip_file.namelist(), reference_names)
+            for name, content in zip(reference_names, contents):
+                self.assertEqual(
+                    zip_file.getinfo(name).compress_type, zipfile.ZIP_DEFLATED
+                )
+                self.assertEqual(zip_file.read(name).decode(), content)
+
+
+class TestWriteFilesToZip(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.large_path = self.temp_dir_path / "large"
+        self.large_path.write_bytes(os.urandom(64 * 1024) * 4)
+        self.file_paths = [
+            self.file1_path,
+            self.large_path,
+            self.file2_path,
+            self.file4_path,
+        ]
+
+    def test_compress_file(self):
+        for compress_type in [
+            zipfile.ZIP_STORED,
+            zipfile.ZIP_DEFLATED,
+            zipfile.ZIP_BZIP2,
+            zipfile.ZIP_LZMA,
+        ]:
+            # Compressed data of the large file is returned through a temporary file
+            with mock.patch.object(archive, "COMPRESSED_INLINE_LIMIT", 1024):
+                compressed_files = [
+                    archive.compress_file(
+                        p, compress_type, spool_dir=self.temp_dir_path
+                    )
+                    for p in self.file_paths
+                ]
+            self.assertIsNotNone(compressed_files[1].data_path)
+
+            zip_contents = io.BytesIO()
+            with zipfile.ZipFile(
+                zip_contents, mode="w", compression=compress_type
+            ) as zip_file:
+                for compressed_file in compressed_files:
+                    archive.write_compressed_file_to_zip(zip_file, compressed_file)
+
+            self.assertFalse(compressed_files[1].data_path.exists())
+            with zipfile.ZipFile(zip_contents) as zip_file:
+                self.assertIsNone(zip_file.testzip())
+                for file_path, compressed_file in zip(
+                    self.file_paths, compressed_files
+                ):
+                    contents = zip_file.read(archive.get_arcname(file_path))
+                    self.assertEqual(contents, file_path.read_bytes())
+                    self.assertEqual(
+                        compressed_file.digest, hashlib.sha256(contents).hexdigest()
+                    )
+
+    def test_write_files_to_zip_parallel(self):
+        results = []
+        for jobs in [1, 2]:
+            zip_contents = io.BytesIO()
+            with zipfile.ZipFile(
+                zip_contents, mode="w", compression=zipfile.ZIP_DEFLATED
+            ) as zip_file:
+                digests = list(
+                    archive.write_files_to_zip(
+                        zip_file, [(p, True) for p in self.file_paths], jobs=jobs
+                    )
+                )
+            with zipfile.ZipFile(zip_contents) as zip_file:
+                self.assertIsNone(zip_file.testzip())
+                results.append(
+                    (digests, [(i.filename, i.CRC) for i in zip_file.infolist()])
+                )
+
+        # Parallel compression writes the same members in the same order
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(
+            [name for name, _ in results[1][1]],
+            [archive.get_arcname(p) for p in self.file_paths],
+        )
+
+    def test_zipfile_internals(self):
+        # Members compressed by worker processes are written with private 'zipfile'
+        # attributes; this fails on a Python version which changed them
+        self.assertEqual(archive.missing_zipfile_internals(), ())
+
+        # Without them, files are compressed serially, with a warning
+        with mock.patch.object(
+            archive, "missing_zipfile_internals", return_value=("ZipFile._writing",)
+        ), mock.patch(
+            "concurrent.futures.ProcessPoolExecutor"
+        ) as executor, self.assertLogs(
+            archive.logger, "WARNING"
+        ):
+            zip_contents = io.BytesIO()
+            with zipfile.ZipFile(zip_contents, mode="w") as zip_file:
+                digests = list(
+                    archive.write_files_to_zip(
+                        zip_file, [(p, True) for p in self.file_paths], jobs=2
+                    )
+                )
+            with self.assertRaises(RuntimeError):
+                archive.compress_file(self.file1_path)
+
+        executor.assert_not_called()
+        self.assertEqual(
+            digests,
+            [hashlib.sha256(p.read_bytes()).hexdigest() for p in self.file_paths],
+        )
+        with zipfile.ZipFile(zip_contents) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+
+    def test_write_files_to_zip_statistics(self):
+        compressed_path = self.temp_dir_path / "compressed.gz"
+        compressed_path.write_bytes(b"\x1f\x8b" + os.urandom(1024))
+
+        statistics = CompressionStatistics()
+        zip_contents = io.BytesIO()
+        with zipfile.ZipFile(
+            zip_contents, mode="w", compression=zipfile.ZIP_DEFLATED
+        ) as zip_file:
+            list(
+                archive.write_files_to_zip(
+                    zip_file,
+                    [(self.file1_path, False), (compressed_path, False)],
+                    statistics=statistics,
+                )
+            )
+
+        with zipfile.ZipFile(zip_contents) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            self.assertEqual(
+                zip_file.getinfo(archive.get_arcname(compressed_path)).compress_type,
+                zipfile.ZIP_STORED,
+            )
+
+        self.assertEqual(
+            sorted(statistics.codecs), [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED]
+        )
+        stored = statistics.codecs[zipfile.ZIP_STORED]
+        self.assertEqual((stored.files, stored.file_size), (1, 1026))
+        self.assertEqual(stored.compress_size, stored.file_size)
+        self.assertIsNotNone(statistics.seconds_saved(zipfile.ZIP_STORED))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import hashlib
+import os
+import unittest
+
+from macos_installation.classes.cache import HashCache
+from tests import TestBase
+
+
+class TestHashCache(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.cache_path = self.temp_dir_path / "cache" / "hash-cache.sqlite3"
+
+    def test_get_file_sha256_hashes(self):
+        file_paths = [self.file1_path, self.file2_path, self.file4_path]
+        contents = [self.file1_content, self.file2_content, self.file4_content]
+        expected_hashes = {
+            p: hashlib.sha256(c.encode()).hexdigest()
+            for p, c in zip(file_paths, contents)
+        }
+
+        with HashCache(self.cache_path) as hash_cache:
+            self.assertEqual(
+                hash_cache.get_file_sha256_hashes(file_paths), expected_hashes
+            )
+            self.assertEqual((hash_cache.hits, hash_cache.misses), (0, 3))
+
+        # Digests persist across instances
+        with HashCache(self.cache_path) as hash_cache:
+            self.assertEqual(
+                hash_cache.get_file_sha256_hashes(file_paths), expected_hashes
+            )
+            self.assertEqual((hash_cache.hits, hash_cache.misses), (3, 0))
+
+            # A changed stat tuple invalidates the cached digest
+            stat_result = self.file2_path.stat()
+            os.utime(
+                self.file2_path,
+                ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 1),
+            )
+            self.assertEqual(
+                hash_cache.get_file_sha256_hashes(file_paths), expected_hashes
+            )
+            self.assertEqual((hash_cache.hits, hash_cache.misses), (5, 1))
+
+    def test_evict_missing(self):
+        with HashCache(self.cache_path) as hash_cache:
+            hash_cache.get_file_sha256_hashes([self.file1_path, self.file2_path])
+
+            self.file1_path.unlink()
+            self.assertEqual(hash_cache.evict_missing(), 1)
+            self.assertEqual(hash_cache.evict_missing(), 0)
+
+            self.assertIsNotNone(
+                hash_cache.get(self.file2_path, self.file2_path.stat())
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import io
+import random
+import unittest
+
+from macos_installation.functions import chunking
+
+
+class TestChunking(unittest.TestCase):
+    def setUp(self):
+        self.data = random.Random(0).randbytes(1024 * 1024)
+        self.sizes = {"min_size": 2048, "avg_size": 8192, "max_size": 32768}
+
+    def test_iter_chunks(self):
+        chunks = list(chunking.iter_chunks(io.BytesIO(self.data), **self.sizes))
+
+        self.assertEqual(b"".join(chunks), self.data)
+        for chunk in chunks[:-1]:
+            self.assertGreaterEqual(len(chunk), self.sizes["min_size"])
+            self.assertLessEqual(len(chunk), self.sizes["max_size"])
+
+        self.assertEqual(list(chunking.iter_chunks(io.BytesIO(b""))), [])
+        self.assertEqual(list(chunking.iter_chunks(io.BytesIO(b"abc"))), [b"abc"])
+
+    def test_boundaries_are_content_defined(self):
+        chunks = list(chunking.iter_chunks(io.BytesIO(self.data), **self.sizes))
+
+        # Inserting bytes only changes the chunks around the insertion
+        edited_data = self.data[:1000] + b"inserted" + self.data[1000:]
+        edited_chunks = list(
+            chunking.iter_chunks(io.BytesIO(edited_data), **self.sizes)
+        )
+        self.assertGreaterEqual(len(set(chunks) & set(edited_chunks)), len(chunks) - 2)
+
+    def test_find_chunk_boundary(self):
+        def find_chunk_boundary(data, min_size, avg_size, max_size):
+            # Reference implementation, one byte at a time
+            if len(data) <= min_size:
+                return len(data)
+            run_length = (avg_size - min_size).bit_length() - 2
+            run = 0
+            for index in range(min_size, min(len(data), max_size)):
+                bit = 0
+                for k in range(chunking.BOUNDARY_WINDOW):
+                    if index - k >= min_size:
+                        bit ^= chunking.BOUNDARY_TABLE[data[index - k]] >> k & 1
+                run = run + 1 if bit else 0
+                if run == run_length:
+                    return index + 1
+            return min(len(data), max_size)
+
+        # Small average sizes search many blocks before finding a boundary
+        rng = random.Random(1)
+        for sizes in [self.sizes, {"min_size": 64, "avg_size": 80, "max_size": 4096}]:
+            for _ in range(20):
+                data = rng.randbytes(rng.randint(0, 2 * sizes["max_size"]))
+                self.assertEqual(
+                    chunking.find_chunk_boundary(memoryview(data), **sizes),
+                    find_chunk_boundary(data, **sizes),
+                )
+
+        # Runs of the same byte are cut either straight after the minimum size, or at
+        # the maximum size
+        for byte in range(256):
+            boundary = chunking.find_chunk_boundary(bytes([byte]) * 40000, **self.sizes)
+            self.assertTrue(
+                boundary < self.sizes["min_size"] + 32
+                or boundary == self.sizes["max_size"],
+                boundary,
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
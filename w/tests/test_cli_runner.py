@@ -1,13 +1,19 @@
+import json
 import os.path
 import pathlib
 import tempfile
 import unittest
+import zipfile
 from unittest import mock
 
 from click.testing import CliRunner
+from Cryptodome.Cipher import AES
 
 from macos_installation import config
+from macos_installation.classes.data import BackupManifest
+from macos_installation.classes.session import KeySession
 from macos_installation.cli import cli_entrypoint
+from macos_installation.functions import archive, encryption
 from tests import TestBase
 
 
@@ -162,6 +168,62 @@ class TestCliRunner(TestBase):
                     message = f" to '{config.CURRENT_USER_HOME_DIR / test_location}'"
                     self.assertIn(message, restore_result.output)
 
+            ###############
+            # Incremental #
+            ###############
+
+            # Only the manifest is read from the encrypted parent, which is not
+            # decrypted as a whole
+            with mock.patch.object(
+                encryption, "decrypt_stream", wraps=encryption.decrypt_stream
+            ) as decrypt_stream:
+                incremental_result = runner.invoke(
+                    cli_entrypoint,
+                    [
+                        "--no-dry-run",
+                        "backup",
+                        "--backup-file",
+                        os.path.join(isolated_area, "incremental.zip"),
+                        "--incremental-from",
+                        f"{backup_file_path}.enc",
+                        "--password",
+                        password,
+                    ],
+                )
+            self.assertEqual(incremental_result.exit_code, 0)
+            self.assertIn(
+                "Incremental backup of 'test.zip.enc'", incremental_result.output
+            )
+            decrypt_stream.assert_not_called()
+
+            # The key of the parent is prefetched as soon as the manifest is read
+            incremental_path = pathlib.Path(isolated_area) / "incremental.zip.enc"
+            salts = []
+            for backup_path in [
+                incremental_path,
+                pathlib.Path(f"{backup_file_path}.enc"),
+            ]:
+                with backup_path.open("rb") as f:
+                    salts.append(encryption.read_key_salt(f)[0])
+            with mock.patch.object(
+                KeySession, "prefetch", autospec=True, side_effect=KeySession.prefetch
+            ) as prefetch, mock.patch(
+                "macos_installation.config.CURRENT_USER_HOME_DIR",
+                pathlib.Path(tempfile.TemporaryDirectory().name),
+            ):
+                restore_result = runner.invoke(
+                    cli_entrypoint,
+                    [
+                        "restore",
+                        "--backup-file",
+                        str(incremental_path),
+                        "--password",
+                        password,
+                    ],
+                )
+            self.assertEqual(restore_result.exit_code, 0)
+            self.assertEqual([c.args[1] for c in prefetch.call_args_list], salts)
+
             ###########
             # Encrypt #
             ###########
@@ -185,6 +247,594 @@ class TestCliRunner(TestBase):
                 message = f"Encrypted file written to '/private{backup_file_path}.enc'"
                 self.assertIn(message, encrypt_result.output)
 
+    def test_incremental_backup_restore(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem() as isolated_area, mock.patch(
+            "macos_installation.config.BACKUP_LOCATIONS", []
+        ):
+            full_backup_path = os.path.join(isolated_area, "full.zip")
+            incremental_backup_path = os.path.join(isolated_area, "incremental.zip")
+            backup_args = [
+                "--no-dry-run",
+                "backup",
+                "--no-hash-cache",
+                "--extra-location",
+                str(self.sub_dir_path),
+            ]
+            deleted_path = self.sub_dir_path / "deleted"
+            deleted_path.write_text("deleted")
+
+            full_result = runner.invoke(
+                cli_entrypoint, [*backup_args, "--backup-file", full_backup_path]
+            )
+            self.assertEqual(full_result.exit_code, 0)
+
+            # Change, delete, and add files
+            self.file5_path.write_text("changed")
+            deleted_path.unlink()
+            added_path = self.sub_dir_path / "added"
+            added_path.write_text("added")
+
+            incremental_result = runner.invoke(
+                cli_entrypoint,
+                [
+                    *backup_args,
+                    "--backup-file",
+                    incremental_backup_path,
+                    "--incremental-from",
+                    full_backup_path,
+                ],
+            )
+            self.assertEqual(incremental_result.exit_code, 0)
+            self.assertIn(
+                "Incremental backup of 'full.zip': 2 added or changed files, 1 deleted files",
+                incremental_result.output,
+            )
+
+            with zipfile.ZipFile(incremental_backup_path) as incremental_zip:
+                manifest, _ = BackupManifest.from_zip_file(incremental_zip)
+                self.assertEqual(manifest.parent_backup, full_backup_path)
+                self.assertCountEqual(
+                    manifest.stored_files, [str(self.file5_path), str(added_path)]
+                )
+                self.assertEqual(manifest.deleted_files, [str(deleted_path)])
+                self.assertNotIn(
+                    archive.get_arcname(self.file4_path), incremental_zip.namelist()
+                )
+
+            # Unchanged files are restored from the parent backup
+            self.file4_path.write_text("overwritten")
+            restore_result = runner.invoke(
+                cli_entrypoint,
+                [
+                    "--no-dry-run",
+                    "restore",
+                    "--backup-file",
+                    incremental_backup_path,
+                ],
+            )
+            self.assertEqual(restore_result.exit_code, 0)
+            self.assertEqual(self.file4_path.read_text(), self.file4_content)
+            self.assertEqual(self.file5_path.read_text(), "changed")
+            self.assertEqual(added_path.read_text(), "added")
+            self.assertFalse(deleted_path.exists())
+
+            # The chain cannot be restored without its parent
+            os.remove(full_backup_path)
+            restore_result = runner.invoke(
+                cli_entrypoint,
+                ["--no-dry-run", "restore", "--backup-file", incremental_backup_path],
+            )
+            self.assertEqual(restore_result.exit_code, 1)
+            self.assertIn("was not found", restore_result.output)
+
+    def test_repository_backup_restore(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem() as isolated_area, mock.patch(
+            "macos_installation.config.BACKUP_LOCATIONS", []
+        ):
+            repository_path = os.path.join(isolated_area, "repository")
+            backup_args = [
+                "--no-dry-run",
+                "backup",
+                "--no-hash-cache",
+                "--extra-location",
+                str(self.sub_dir_path),
+                "--repository",
+                repository_path,
+            ]
+
+            first_result = runner.invoke(
+                cli_entrypoint, [*backup_args, "--snapshot", "first"]
+            )
+            self.assertEqual(first_result.exit_code, 0)
+            self.assertIn("Stored 2 new chunks", first_result.output)
+
+            # Unchanged files are not stored again
+            self.file5_path.write_text("changed")
+            second_result = runner.invoke(
+                cli_entrypoint, [*backup_args, "--snapshot", "second"]
+            )
+            self.assertEqual(second_result.exit_code, 0)
+            self.assertIn("Stored 1 new chunks", second_result.output)
+            self.assertIn("1 chunks were already stored", second_result.output)
+
+            stats_result = runner.invoke(
+                cli_entrypoint, ["repository-stats", "--repository", repository_path]
+            )
+            self.assertEqual(stats_result.exit_code, 0)
+            self.assertIn("| Deduplication ratio", stats_result.output)
+
+            # Restore the first snapshot
+            restore_result = runner.invoke(
+                cli_entrypoint,
+                [
+                    "--no-dry-run",
+                    "restore",
+                    "--repository",
+                    repository_path,
+                    "--snapshot",
+                    "first",
+                ],
+            )
+            self.assertEqual(restore_result.exit_code, 0)
+            self.assertEqual(self.file4_path.read_text(), self.file4_content)
+            self.assertEqual(self.file5_path.read_text(), self.file5_content)
+
+            # Only a backup file or a repository may be given
+            both_result = runner.invoke(
+                cli_entrypoint,
+                [*backup_args, "--backup-file", os.path.join(isolated_area, "x.zip")],
+            )
+            self.assertEqual(both_result.exit_code, 1)
+
+            gc_result = runner.invoke(
+                cli_entrypoint,
+                ["--no-dry-run", "repository-gc", "--repository", repository_path],
+            )
+            self.assertEqual(gc_result.exit_code, 0)
+            self.assertIn("Removed 0 unreferenced files", gc_result.output)
+
+    def test_selective_restore(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem() as isolated_area, mock.patch(
+            "macos_installation.config.BACKUP_LOCATIONS", []
+        ):
+            backup_path = os.path.join(isolated_area, "selective.zip")
+            password = TestBase.generate_random_string(16)
+
+            backup_result = runner.invoke(
+                cli_entrypoint,
+                [
+                    "--no-dry-run",
+                    "backup",
+                    "--no-hash-cache",
+                    "--extra-location",
+                    str(self.temp_dir_path),
+                    "--backup-file",
+                    backup_path,
+                    "--password",
+                    password,
+                ],
+            )
+            self.assertEqual(backup_result.exit_code, 0)
+
+            self.file1_path.write_text("overwritten")
+            self.file4_path.write_text("overwritten")
+            self.file5_path.unlink()
+
+            # Only the matching file, and the files below the matching directory
+            restore_args = [
+                "--no-dry-run",
+                "restore",
+                "--backup-file",
+                f"{backup_path}.enc",
+                "--password",
+                password,
+            ]
+            restore_result = runner.invoke(
+                cli_entrypoint,
+                [*restore_args, "--path", self.sub_dir_path.name],
+            )
+            self.assertEqual(restore_result.exit_code, 0)
+            self.assertEqual(self.file4_path.read_text(), self.file4_content)
+            self.assertEqual(self.file5_path.read_text(), self.file5_content)
+            self.assertEqual(self.file1_path.read_text(), "overwritten")
+            self.assertTrue(self.file2_path.exists())
+
+            restore_result = runner.invoke(
+                cli_entrypoint, [*restore_args, "--path", str(self.file1_path)]
+            )
+            self.assertEqual(restore_result.exit_code, 0)
+            self.assertEqual(self.file1_path.read_text(), self.file1_content)
+
+            restore_result = runner.invoke(
+                cli_entrypoint, [*restore_args, "--path", "/missing/**"]
+            )
+            self.assertEqual(restore_result.exit_code, 1)
+            self.assertIn("No files in the backup match", restore_result.output)
+
+    def test_restore_verifies_digests(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem() as isolated_area, mock.patch(
+            "macos_installation.config.BACKUP_LOCATIONS", []
+        ):
+            backup_path = os.path.join(isolated_area, "backup.zip")
+            tampered_path = os.path.join(isolated_area, "tampered.zip")
+            backup_result = runner.invoke(
+                cli_entrypoint,
+                [
+                    "--no-dry-run",
+                    "backup",
+                    "--no-hash-cache",
+                    "--extra-location",
+                    str(self.sub_dir_path),
+                    "--backup-file",
+                    backup_path,
+                ],
+            )
+            self.assertEqual(backup_result.exit_code, 0)
+
+            # Change the contents of a member, but not its digest in the manifest
+            with zipfile.ZipFile(backup_path) as backup_zip, zipfile.ZipFile(
+                tampered_path, "w"
+            ) as tampered_zip:
+                for info in backup_zip.infolist():
+                    data = backup_zip.read(info)
+                    if info.filename == archive.get_arcname(self.file5_path):
+                        data = b"tampered"
+                    tampered_zip.writestr(info, data)
+
+            self.file4_path.write_text("overwritten")
+            restore_result = runner.invoke(
+                cli_entrypoint,
+                ["--no-dry-run", "restore", "--backup-file", tampered_path],
+            )
+            self.assertEqual(restore_result.exit_code, 1)
+            self.assertIn("do not match the backup manifest", restore_result.output)
+
+            # Nothing was replaced, and no staging directory was left behind
+            self.assertEqual(self.file4_path.read_text(), "overwritten")
+            self.assertEqual(self.file5_path.read_text(), self.file5_content)
+            self.assertFalse(list(self.temp_dir_path.glob(".*.restore-*")))
+
+            restore_result = runner.invoke(
+                cli_entrypoint,
+                ["--no-dry-run", "restore", "--backup-file", backup_path],
+            )
+            self.assertEqual(restore_result.exit_code, 0)
+            self.assertEqual(self.file4_path.read_text(), self.file4_content)
+
+    def test_parallel_restore(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem() as isolated_area, mock.patch(
+            "macos_installation.config.BACKUP_LOCATIONS", []
+        ):
+            for i in range(20):
+                nested_path = self.sub_dir_path / f"dir{i % 3}" / f"nested{i % 2}"
+                nested_path.mkdir(parents=True, exist_ok=True)
+                (nested_path / f"file{i}").write_bytes(os.urandom(i * 5000))
+
+            def tree() -> dict:
+                return {
+                    str(p.relative_to(self.sub_dir_path)): p.read_bytes()
+                    for p in self.sub_dir_path.glob("**/*")
+                    if p.is_file()
+                }
+
+            expected_tree = tree()
+            backup_path = os.path.join(isolated_area, "parallel.zip")
+            password = TestBase.generate_random_string(16)
+            backup_result = runner.invoke(
+                cli_entrypoint,
+                [
+                    "--no-dry-run",
+                    "backup",
+                    "--no-hash-cache",
+                    "--extra-location",
+                    str(self.sub_dir_path),
+                    "--backup-file",
+                    backup_path,
+                    "--password",
+                    password,
+                ],
+            )
+            self.assertEqual(backup_result.exit_code, 0)
+
+            # Parallel and serial restores give the same result
+            outputs = []
+            for jobs in ["4", "1"]:
+                restore_result = runner.invoke(
+                    cli_entrypoint,
+                    [
+                        "--no-dry-run",
+                        "restore",
+                        "--backup-file",
+                        f"{backup_path}.enc",
+                        "--password",
+                        password,
+                        "--jobs",
+                        jobs,
+                    ],
+                )
+                self.assertEqual(restore_result.exit_code, 0)
+                self.assertEqual(tree(), expected_tree)
+                # Log records carry timestamps
+                outputs.append(
+                    [l for l in restore_result.output.splitlines() if " INFO " not in l]
+                )
+
+            self.assertEqual(outputs[0], outputs[1])
+
+    def test_parallel_restore_legacy_encrypted(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem() as isolated_area, mock.patch(
+            "macos_installation.config.BACKUP_LOCATIONS", []
+        ):
+            backup_path = pathlib.Path(isolated_area) / "legacy.zip"
+            backup_result = runner.invoke(
+                cli_entrypoint,
+                [
+                    "--no-dry-run",
+                    "backup",
+                    "--no-hash-cache",
+                    "--extra-location",
+                    str(self.sub_dir_path),
+                    "--backup-file",
+                    str(backup_path),
+                ],
+            )
+            self.assertEqual(backup_result.exit_code, 0)
+
+            # Encrypt the backup in the format written before the segmented container
+            password = TestBase.generate_random_string(16)
+            key, salt = encryption.generate_key(password.encode())
+            cipher = AES.new(key, AES.MODE_GCM)
+            legacy_path = pathlib.Path(f"{backup_path}.enc")
+            legacy_path.write_bytes(
+                salt
+                + cipher.nonce
+                + cipher.encrypt(backup_path.read_bytes())
+                + cipher.digest()
+            )
+            self.file4_path.unlink()
+
+            # The backup is decrypted once, not once per thread
+            with mock.patch.object(
+                encryption,
+                "_decrypt_legacy_stream",
+                wraps=encryption._decrypt_legacy_stream,
+            ) as decrypt_legacy_stream:
+                restore_result = runner.invoke(
+                    cli_entrypoint,
+                    [
+                        "--no-dry-run",
+                        "restore",
+                        "--backup-file",
+                        str(legacy_path),
+                        "--password",
+                        password,
+                        "--jobs",
+                        "4",
+                    ],
+                )
+            self.assertEqual(restore_result.exit_code, 0)
+            self.assertEqual(decrypt_legacy_stream.call_count, 1)
+            self.assertEqual(self.file4_path.read_text(), self.file4_content)
+
+    def test_delta_restore(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem() as isolated_area, mock.patch(
+            "macos_installation.config.BACKUP_LOCATIONS", []
+        ):
+            touched_path = self.sub_dir_path / "touched"
+            touched_path.write_text("touched")
+            backup_path = os.path.join(isolated_area, "delta.zip")
+            backup_result = runner.invoke(
+                cli_entrypoint,
+                [
+                    "--no-dry-run",
+                    "backup",
+                    "--no-hash-cache",
+                    "--extra-location",
+                    str(self.sub_dir_path),
+                    "--backup-file",
+                    backup_path,
+                ],
+            )
+            self.assertEqual(backup_result.exit_code, 0)
+
+            # Same contents with a new mtime, changed contents, and a deleted file
+            os.utime(touched_path, ns=(0, 0))
+            self.file4_path.write_text("changed")
+            self.file5_path.unlink()
+            extra_path = self.sub_dir_path / "extra"
+            extra_path.write_text("extra")
+
+            restore_args = ["restore", "--backup-file", backup_path, "--delta"]
+            dry_run_result = runner.invoke(cli_entrypoint, restore_args)
+            self.assertEqual(dry_run_result.exit_code, 0)
+            self.assertEqual(self.file4_path.read_text(), "changed")
+
+            restore_result = runner.invoke(
+                cli_entrypoint, ["--no-dry-run", *restore_args]
+            )
+            self.assertEqual(restore_result.exit_code, 0)
+            message = (
+                "Delta restore: skipped 1 identical files, replaced 1 changed files, "
+                "restored 1 new files"
+            )
+            self.assertIn(f"[DRY-RUN] {message}", dry_run_result.output)
+            self.assertIn(message, restore_result.output)
+            self.assertEqual(self.file4_path.read_text(), self.file4_content)
+            self.assertEqual(self.file5_path.read_text(), self.file5_content)
+            self.assertEqual(extra_path.read_text(), "extra")
+
+            # Only the changed file was backed up
+            backups = [p.name for p in self.sub_dir_path.glob("*_20*")]
+            self.assertEqual(backups, [f"{self.file4_path.name}_{backups[0][-10:]}"])
+
+            restore_result = runner.invoke(
+                cli_entrypoint, ["--no-dry-run", *restore_args]
+            )
+            self.assertEqual(restore_result.exit_code, 0)
+            self.assertIn("skipped 3 identical files", restore_result.output)
+
+    def test_backup_plan(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem() as isolated_area, mock.patch(
+            "macos_installation.config.BACKUP_LOCATIONS", []
+        ):
+            backup_path = os.path.join(isolated_area, "plan.zip")
+            backup_args = [
+                "backup",
+                "--extra-location",
+                str(self.sub_dir_path),
+                "--backup-file",
+                backup_path,
+            ]
+            table_result = runner.invoke(cli_entrypoint, backup_args)
+            self.assertEqual(table_result.exit_code, 0)
+            self.assertIn("Estimated Bytes Out", table_result.output)
+            self.assertIn(str(self.file4_path), table_result.output)
+
+            json_result = runner.invoke(
+                cli_entrypoint, [*backup_args, "--plan-format", "json"]
+            )
+            self.assertEqual(json_result.exit_code, 0)
+            plan = json.loads(json_result.output)
+            self.assertEqual(plan["files"], 2)
+            self.assertEqual(plan["locations"][0]["location"], str(self.sub_dir_path))
+            self.assertEqual(len(plan["largest_files"]), 2)
+            self.assertFalse(os.path.exists(backup_path))
+
+            # Dry runs leave the hash cache alone
+            cache_path = pathlib.Path(isolated_area) / "hash-cache.sqlite3"
+            with mock.patch("macos_installation.config.HASH_CACHE_PATH", cache_path):
+                self.assertEqual(
+                    runner.invoke(cli_entrypoint, backup_args).exit_code, 0
+                )
+            self.assertFalse(cache_path.exists())
+
+            with mock.patch(
+                "macos_installation.functions.planner.get_free_space", return_value=0
+            ):
+                table_result = runner.invoke(cli_entrypoint, backup_args)
+            self.assertIn("Warning: not enough free space", table_result.output)
+
+    def test_profile(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem() as isolated_area, mock.patch(
+            "macos_installation.config.BACKUP_LOCATIONS", []
+        ):
+            trace_path = os.path.join(isolated_area, "trace.json")
+            result = runner.invoke(
+                cli_entrypoint,
+                [
+                    "--no-dry-run",
+                    "--profile",
+                    trace_path,
+                    "backup",
+                    "--no-hash-cache",
+                    "--extra-location",
+                    str(self.sub_dir_path),
+                    "--backup-file",
+                    os.path.join(isolated_area, "profile.zip"),
+                ],
+            )
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn(f"Trace written to '{trace_path}'", result.output)
+
+            with open(trace_path) as f:
+                events = {e["name"]: e for e in json.load(f)["traceEvents"]}
+            self.assertTrue({"walk", "compress", "write"} <= set(events))
+            self.assertEqual(events["compress"]["args"]["files"], 2)
+            self.assertEqual(
+                events["compress"]["args"]["bytes"],
+                len(self.file4_content) + len(self.file5_content),
+            )
+
+    def test_encrypt_decrypt_files(self):
+        runner = CliRunner()
+        with runner.isolated_filesystem() as isolated_area, mock.patch(
+            "macos_installation.config.ENCRYPTION_SEGMENT_SIZE", 1024
+        ):
+            password = TestBase.generate_random_string(16)
+            file_paths = []
+            for i, size in enumerate((0, 1000, 5 * 1024 + 1)):
+                file_path = pathlib.Path(isolated_area) / f"{i}.zip"
+                with zipfile.ZipFile(file_path, "w") as zip_file:
+                    if size:
+                        zip_file.writestr("data", os.urandom(size))
+                file_paths.append(file_path)
+            contents = [file_path.read_bytes() for file_path in file_paths]
+            backup_file_args = [
+                arg for file_path in file_paths for arg in ("-b", str(file_path))
+            ]
+
+            encrypt_result = runner.invoke(
+                cli_entrypoint,
+                ["encrypt", "--jobs", "2", *backup_file_args, "--password", password],
+            )
+            self.assertEqual(encrypt_result.exit_code, 0)
+            for file_path in file_paths:
+                self.assertIn(
+                    f"Encrypted file written to '{file_path}.enc'",
+                    encrypt_result.output,
+                )
+            encrypted_paths = [pathlib.Path(f"{p}.enc") for p in file_paths]
+
+            # Encrypted files are skipped
+            encrypt_result = runner.invoke(
+                cli_entrypoint,
+                ["encrypt", "-b", str(encrypted_paths[1]), "--password", password],
+            )
+            self.assertEqual(encrypt_result.exit_code, 0)
+            self.assertIn("is already encrypted, skipping", encrypt_result.output)
+            self.assertFalse(pathlib.Path(f"{encrypted_paths[1]}.enc").exists())
+
+            # A wrong password leaves the files in place
+            decrypt_args = [
+                arg for file_path in encrypted_paths for arg in ("-b", str(file_path))
+            ]
+            for file_path in file_paths:
+                file_path.write_bytes(b"original")
+            decrypt_result = runner.invoke(
+                cli_entrypoint,
+                ["decrypt", "--jobs", "2", *decrypt_args, "--password", password[:-2]],
+            )
+            self.assertEqual(decrypt_result.exit_code, 1)
+            self.assertIn("was incorrect", decrypt_result.output)
+            for file_path in file_paths:
+                self.assertEqual(file_path.read_bytes(), b"original")
+            self.assertEqual(
+                sorted(p.name for p in pathlib.Path(isolated_area).iterdir()),
+                sorted(p.name for p in [*file_paths, *encrypted_paths]),
+            )
+
+            decrypt_result = runner.invoke(
+                cli_entrypoint,
+                ["decrypt", "--jobs", "2", *decrypt_args, "--password", password],
+            )
+            self.assertEqual(decrypt_result.exit_code, 0)
+            for file_path, content in zip(file_paths, contents):
+                self.assertIn(
+                    f"Decrypted file written to '{file_path}'", decrypt_result.output
+                )
+                self.assertEqual(file_path.read_bytes(), content)
+
+            # A truncated file is not reported as a wrong password
+            encrypted_paths[2].write_bytes(encrypted_paths[2].read_bytes()[:-1])
+            decrypt_result = runner.invoke(
+                cli_entrypoint,
+                ["decrypt", "-b", str(encrypted_paths[2]), "--password", password],
+            )
+            self.assertEqual(decrypt_result.exit_code, 1)
+            self.assertIn(
+                f"File '{encrypted_paths[2].name}' is corrupt or truncated!",
+                decrypt_result.output,
+            )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,62 @@
+import gzip
+import os
+import unittest
+import zipfile
+
+from macos_installation.functions import compression
+from tests import TestBase
+
+
+class TestCompression(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.text_path = self.temp_dir_path / "text"
+        self.text_path.write_text("The quick brown fox jumps over the lazy dog. " * 200)
+        self.gzip_path = self.temp_dir_path / "text.gz"
+        self.gzip_path.write_bytes(gzip.compress(self.text_path.read_bytes()))
+        self.random_path = self.temp_dir_path / "random"
+        self.random_path.write_bytes(os.urandom(16 * 1024))
+        self.empty_path = self.temp_dir_path / "empty"
+        self.empty_path.touch()
+
+    def test_get_entropy(self):
+        self.assertEqual(compression.get_entropy(b""), 0.0)
+        self.assertEqual(compression.get_entropy(b"aaaa"), 0.0)
+        self.assertEqual(compression.get_entropy(bytes(range(256))), 8.0)
+        self.assertLess(compression.get_entropy(self.text_path.read_bytes()), 5.0)
+
+    def test_choose_compression(self):
+        expected = {
+            "auto": {
+                self.text_path: (zipfile.ZIP_DEFLATED, None),
+                self.gzip_path: (zipfile.ZIP_STORED, None),
+                self.random_path: (zipfile.ZIP_STORED, None),
+                self.empty_path: (zipfile.ZIP_STORED, None),
+            },
+            "max": {
+                self.text_path: (zipfile.ZIP_LZMA, None),
+                self.gzip_path: (zipfile.ZIP_STORED, None),
+                self.random_path: (zipfile.ZIP_STORED, None),
+            },
+            "deflate": {self.random_path: (zipfile.ZIP_DEFLATED, None)},
+            "store": {self.text_path: (zipfile.ZIP_STORED, None)},
+        }
+        for policy, files in expected.items():
+            for file_path, compression_method in files.items():
+                self.assertEqual(
+                    compression.choose_compression(file_path, policy),
+                    compression_method,
+                    f"{policy}: {file_path.name}",
+                )
+
+        with self.assertRaises(ValueError):
+            compression.choose_compression(self.text_path, "unknown")
+
+        # The policies offered by the CLI are the ones known here
+        self.assertCountEqual(
+            compression.POLICIES, ["auto", "max", *compression.FIXED_POLICIES]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,13 @@
+import io
+import threading
 import unittest
+from unittest import mock
 
 from Cryptodome import Random
+from Cryptodome.Cipher import AES
 
+from macos_installation.classes.data import EncryptionHeader, KDFParameters
+from macos_installation.classes.session import KeySession
 from macos_installation.functions import encryption
 
 
@@ -43,6 +49,277 @@ class TestEncryptDecrypt(unittest.TestCase):
             encryption.decrypt_bytes(encrypted_data, password)
 
 
+class TestEncryptDecryptStream(unittest.TestCase):
+    def test_encrypt_decrypt_stream_segments(self):
+        password = Random.get_random_bytes(16).hex()
+        segment_size = 256
+
+        # Sizes covering a partial, an exact multiple, and an empty input
+        for size in [1000, segment_size * 3, 0]:
+            data = Random.get_random_bytes(size)
+
+            encrypted = io.BytesIO()
+            encryption.encrypt_stream(
+                io.BytesIO(data), encrypted, password, segment_size=segment_size
+            )
+
+            # Header followed by one tagged segment per (partial) plaintext segment
+            header = EncryptionHeader.from_stream(io.BytesIO(encrypted.getvalue()))
+            self.assertEqual(header.segment_size, segment_size)
+            self.assertEqual(
+                len(encrypted.getvalue()),
+                len(header.raw)
+                + size
+                + (size // segment_size + 1) * encryption.TAG_SIZE,
+            )
+
+            encrypted.seek(0)
+            decrypted = io.BytesIO()
+            encryption.decrypt_stream(encrypted, decrypted, password)
+            self.assertEqual(data, decrypted.getvalue())
+
+    def test_decrypt_stream_truncated(self):
+        password = Random.get_random_bytes(16).hex()
+        segment_size = 256
+        data = Random.get_random_bytes(segment_size * 2 + 10)
+
+        encrypted = io.BytesIO()
+        encryption.encrypt_stream(
+            io.BytesIO(data), encrypted, password, segment_size=segment_size
+        )
+
+        # Drop the final segment; the remaining segments are still authentic
+        truncated = encrypted.getvalue()[: -(10 + encryption.TAG_SIZE)]
+        with self.assertRaises(ValueError, msg="final segment is missing"):
+            encryption.decrypt_bytes(truncated, password)
+
+    def test_decrypt_stream_wrong_password(self):
+        kdf = KDFParameters(n=2**14)
+        data = Random.get_random_bytes(1000)
+        encrypted = io.BytesIO()
+        encryption.encrypt_stream(
+            io.BytesIO(data), encrypted, KeySession("password", kdf), segment_size=256
+        )
+        header = EncryptionHeader.from_stream(io.BytesIO(encrypted.getvalue()))
+        self.assertIsNotNone(header.key_check)
+
+        # The key check fails before any segment is read
+        for password in ["wrong", KeySession("wrong", kdf)]:
+            encrypted.seek(0)
+            decrypted = io.BytesIO()
+            with self.assertRaises(encryption.InvalidPasswordError):
+                encryption.decrypt_stream(encrypted, decrypted, password)
+            self.assertEqual(encrypted.tell(), len(header.raw))
+            self.assertEqual(decrypted.getvalue(), b"")
+        with self.assertRaises(encryption.InvalidPasswordError):
+            encryption.open_decrypted_stream(encrypted, KeySession("wrong", kdf))
+
+        # Headers written without a key check still decrypt
+        old_header = EncryptionHeader(
+            salt=header.salt,
+            nonce=header.nonce,
+            segment_size=header.segment_size,
+            kdf=header.kdf,
+        )
+        self.assertNotIn("key_check", old_header.body())
+        self.assertIsNone(
+            EncryptionHeader.from_stream(io.BytesIO(old_header.raw)).key_check
+        )
+
+    def test_invalid_header(self):
+        bodies = [
+            b'{"nonce": "00", "segment_size": 256}',
+            b'{"salt": "zz", "nonce": "00", "segment_size": 256}',
+            b'{"salt": 1, "nonce": "00", "segment_size": 256}',
+            b'{"salt": "00", "nonce": "00", "segment_size": 0}',
+            b"[]",
+            b"not json",
+        ]
+        for body in bodies:
+            raw = EncryptionHeader.PREFIX.pack(EncryptionHeader.MAGIC, 1, len(body))
+            with self.assertRaises(ValueError, msg=body):
+                EncryptionHeader.from_stream(io.BytesIO(raw + body))
+
+    def test_decrypt_legacy_format(self):
+        password = Random.get_random_bytes(16).hex()
+        data = Random.get_random_bytes(1024)
+
+        # Build data in the format written before the segmented container
+        key, salt = encryption.generate_key(password.encode())
+        cipher = AES.new(key, AES.MODE_GCM)
+        legacy_data = salt + cipher.nonce + cipher.encrypt(data) + cipher.digest()
+
+        self.assertEqual(data, encryption.decrypt_bytes(legacy_data, password))
+
+        with self.assertRaises(ValueError, msg="MAC check failed"):
+            encryption.decrypt_bytes(legacy_data[:-1], password)
+
+    def test_open_decrypted_stream(self):
+        key_session = KeySession(Random.get_random_bytes(16).hex())
+        segment_size = 256
+
+        for size in [1000, segment_size * 3, 0]:
+            data = Random.get_random_bytes(size)
+            encrypted = io.BytesIO()
+            encryption.encrypt_stream(
+                io.BytesIO(data), encrypted, key_session, segment_size=segment_size
+            )
+
+            decrypted = encryption.open_decrypted_stream(encrypted, key_session)
+            self.assertEqual(decrypted.read(), data)
+
+            # Reads across segment boundaries, in any order
+            for offset, length in [(700, 100), (10, 500), (250, 12), (size - 3, 10)]:
+                decrypted.seek(max(offset, 0))
+                self.assertEqual(
+                    decrypted.read(length), data[max(offset, 0) :][:length]
+                )
+
+        # Wrong passwords and truncation are detected before anything is read
+        with self.assertRaises(ValueError):
+            encryption.open_decrypted_stream(encrypted, "wrong")
+        truncated = io.BytesIO(encrypted.getvalue()[: -encryption.TAG_SIZE])
+        with self.assertRaises(ValueError):
+            encryption.open_decrypted_stream(truncated, key_session)
+
+        # Tampered segments fail when they are read
+        data = Random.get_random_bytes(1000)
+        encrypted = io.BytesIO()
+        encryption.encrypt_stream(
+            io.BytesIO(data), encrypted, key_session, segment_size=segment_size
+        )
+        tampered = bytearray(encrypted.getvalue())
+        tampered[-500] ^= 1
+        decrypted = encryption.open_decrypted_stream(io.BytesIO(tampered), key_session)
+        self.assertEqual(decrypted.read(10), data[:10])
+        with self.assertRaises(ValueError):
+            decrypted.read()
+
+        # The legacy format cannot be read piecewise
+        self.assertIsNone(
+            encryption.open_decrypted_stream(
+                io.BytesIO(Random.get_random_bytes(100)), key_session
+            )
+        )
+
+
+class TestKeySession(unittest.TestCase):
+    def test_key_session_reuses_keys(self):
+        password = Random.get_random_bytes(16).hex()
+        key_session = KeySession(password)
+
+        # Encrypting twice only derives the encryption key once
+        data = Random.get_random_bytes(1024)
+        encrypted_data1 = encryption.encrypt_bytes(data, key_session)
+        encrypted_data2 = encryption.encrypt_bytes(data, key_session)
+        self.assertNotEqual(encrypted_data1, encrypted_data2)
+        self.assertEqual(key_session.derivations, 1)
+
+        # Decrypting with the same session reuses the cached key
+        self.assertEqual(data, encryption.decrypt_bytes(encrypted_data1, key_session))
+        self.assertEqual(data, encryption.decrypt_bytes(encrypted_data2, key_session))
+        self.assertEqual(key_session.derivations, 1)
+
+        # A new salt needs a new derivation, which is then cached as well
+        salt = encryption.generate_salt()
+        self.assertEqual(
+            key_session.key_for(salt), encryption.generate_key(password, salt)[0]
+        )
+        key_session.key_for(salt)
+        self.assertEqual(key_session.derivations, 2)
+
+        self.assertIs(KeySession.from_password(key_session), key_session)
+
+    def test_key_session_prefetch(self):
+        password = Random.get_random_bytes(16).hex()
+        kdf = KDFParameters(n=2**14)
+        key_session = KeySession(password, kdf)
+
+        # The encryption key is derived in the background, and not derived again
+        key_session.prefetch().join()
+        self.assertEqual(key_session.derivations, 1)
+        encrypted_data = encryption.encrypt_bytes(b"data", key_session)
+        self.assertEqual(key_session.derivations, 1)
+
+        # Keys of existing data are prefetched from the salt in its header
+        key_session = KeySession(password)
+        salt, header_kdf = encryption.read_key_salt(io.BytesIO(encrypted_data))
+        self.assertEqual(header_kdf, kdf)
+        key_session.prefetch(salt, header_kdf).join()
+        self.assertEqual(encryption.decrypt_bytes(encrypted_data, key_session), b"data")
+        self.assertEqual(key_session.derivations, 1)
+
+        # Data in the legacy format starts with its salt
+        legacy_data = Random.get_random_bytes(100)
+        self.assertEqual(
+            encryption.read_key_salt(io.BytesIO(legacy_data)),
+            (legacy_data[: encryption.LEGACY_SALT_SIZE], KDFParameters()),
+        )
+        with self.assertRaises(ValueError):
+            encryption.read_key_salt(io.BytesIO(b"short"))
+
+    def test_key_session_concurrent_keys(self):
+        key_session = KeySession("password", KDFParameters(n=2**14))
+        salts = [encryption.generate_salt() for _ in range(2)]
+        barrier = threading.Barrier(len(salts), timeout=10)
+
+        def generate_key(password, salt, kdf):
+            # Only returns once both keys are being derived at the same time
+            barrier.wait()
+            return salt, salt
+
+        with mock.patch.object(encryption, "generate_key", side_effect=generate_key):
+            threads = [
+                threading.Thread(target=key_session.key_for, args=(salt,))
+                for salt in salts
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertFalse(barrier.broken)
+        self.assertEqual(key_session.derivations, 2)
+        self.assertEqual([key_session.key_for(salt) for salt in salts], salts)
+
+        # Threads needing the same key wait for a single derivation
+        salt = encryption.generate_salt()
+        threads = [
+            threading.Thread(target=key_session.key_for, args=(salt,)) for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(key_session.derivations, 3)
+
+
+class TestKDFParameters(unittest.TestCase):
+    def test_kdf_parameters_in_header(self):
+        password = Random.get_random_bytes(16).hex()
+        kdf = KDFParameters(n=2**14, r=8, p=2)
+        data = Random.get_random_bytes(1024)
+
+        encrypted_data = encryption.encrypt_bytes(data, KeySession(password, kdf))
+
+        # Parameters are read back from the header; no need to know them up front
+        header = EncryptionHeader.from_stream(io.BytesIO(encrypted_data))
+        self.assertEqual(header.kdf, kdf)
+        self.assertEqual(data, encryption.decrypt_bytes(encrypted_data, password))
+
+    def test_kdf_parameters_validation(self):
+        for parameters in [{"name": "md5"}, {"n": 1000}, {"n": 1}, {"r": 0}]:
+            with self.assertRaises(ValueError):
+                KDFParameters(**parameters)
+
+    def test_calibrate_kdf(self):
+        memory_limit = 32 * 1024**2
+        kdf = encryption.calibrate_kdf(time_target=0.2, memory_limit=memory_limit)
+
+        self.assertGreaterEqual(kdf.n, encryption.KDF_CALIBRATION_MIN_N)
+        self.assertLessEqual(kdf.memory_cost, memory_limit)
+
+
 class TestGenerateKey(unittest.TestCase):
     def test_generate_key(self):
         salt = b"salt"
@@ -0,0 +1,82 @@
+import subprocess
+import sys
+import unittest
+
+from tests import TestBase
+
+
+class TestMain(TestBase):
+    def test_lazy_imports(self):
+        # Heavy dependencies are only imported once a command runs
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys; import macos_installation.main; "
+                "from macos_installation import config; "
+                "print(' '.join(sys.modules)); print(' '.join(vars(config)))",
+            ],
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        modules, config_names = (line.split() for line in result.stdout.splitlines())
+        for module in (
+            "Cryptodome",
+            "coloredlogs",
+            "sqlite3",
+            "tabulate",
+            "macos_installation.cli.backup",
+            "macos_installation.cli.restore",
+            "macos_installation.classes.zip",
+        ):
+            self.assertNotIn(module, modules)
+
+        # Config values which query the file system or terminal are not computed yet
+        self.assertNotIn("BACKUP_LOCATIONS", config_names)
+        self.assertNotIn("BASE_CLI_CONTEXT_SETTINGS", config_names)
+
+    def test_help_imports(self):
+        # Showing the help, or the backup locations, does not import the modules used
+        # to back up and restore files; the logging and table dependencies of the
+        # latter import some of the standard library ones themselves
+        cases = {
+            "--help": ["concurrent.futures", "hashlib", "mmap", "tempfile", "zipfile"],
+            "print-backup-locations": [],
+        }
+        for command, stdlib_modules in cases.items():
+            result = subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    "import sys; from macos_installation import main\n"
+                    "try:\n    main.main()\n"
+                    "finally:\n    print(' '.join(sys.modules), file=sys.stderr)",
+                    command,
+                ],
+                capture_output=True,
+                check=True,
+                text=True,
+            )
+            modules = result.stderr.split()
+            for module in (
+                *stdlib_modules,
+                "macos_installation.functions.compression",
+                "macos_installation.functions.util",
+            ):
+                self.assertNotIn(module, modules, command)
+
+    def test_lazy_config(self):
+        from macos_installation import config
+
+        self.assertIsInstance(config.BACKUP_LOCATIONS, list)
+        self.assertIs(config.BACKUP_LOCATIONS, config.BACKUP_LOCATIONS)
+        self.assertEqual(
+            config.BASE_CLI_CONTEXT_SETTINGS["auto_envvar_prefix"], "MACOS_INSTALL"
+        )
+        with self.assertRaises(AttributeError):
+            config.UNKNOWN_SETTING
+
+
+if __name__ == "__main__":
+    unittest.main()
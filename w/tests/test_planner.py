@@ -0,0 +1,73 @@
+import os
+import unittest
+from unittest import mock
+
+from macos_installation.functions import planner
+from tests import TestBase
+
+
+class TestPlanner(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.text_dir_path = self.temp_dir_path / "text"
+        self.text_dir_path.mkdir()
+        self.text_path = self.text_dir_path / "text"
+        self.text_path.write_text("The quick brown fox jumps over the lazy dog. " * 200)
+        self.random_path = self.temp_dir_path / "random"
+        self.random_path.write_bytes(os.urandom(16 * 1024))
+
+    def test_sample_files(self):
+        file_paths = [self.temp_dir_path / str(i) for i in range(10)]
+        self.assertEqual(planner.sample_files(file_paths, 20), file_paths)
+        self.assertEqual(
+            planner.sample_files(file_paths, 2), [file_paths[0], file_paths[5]]
+        )
+        self.assertEqual(planner.sample_files([], 2), [])
+
+    def test_get_free_space(self):
+        self.assertGreater(planner.get_free_space(self.temp_dir_path), 0)
+        self.assertEqual(
+            planner.get_free_space(self.temp_dir_path / "missing" / "backup.zip"),
+            planner.get_free_space(self.temp_dir_path),
+        )
+
+    def test_plan_backup(self):
+        file_paths = [self.random_path, self.text_path, self.file1_path]
+        plan = planner.plan_backup(
+            file_paths,
+            [self.text_dir_path, self.random_path],
+            self.temp_dir_path / "backup.zip",
+            jobs=2,
+            largest_files=1,
+        )
+
+        # Files outside the backup locations are not planned
+        self.assertEqual(plan.files, 2)
+        self.assertEqual(
+            plan.file_size,
+            self.random_path.stat().st_size + len(self.text_path.read_bytes()),
+        )
+        self.assertEqual(plan.largest_files, [(str(self.random_path), 16 * 1024)])
+        self.assertEqual(plan.jobs, 2)
+
+        # Random data is stored, text is deflated
+        locations = {location.location: location for location in plan.locations}
+        self.assertEqual(locations[self.random_path].compress_ratio, 1.0)
+        self.assertLess(locations[self.text_dir_path].compress_ratio, 0.1)
+        self.assertLess(plan.estimated_compress_size, plan.file_size)
+        self.assertEqual(plan.required_space, 2 * plan.estimated_compress_size)
+        self.assertGreater(plan.hash_throughput, 0)
+        self.assertGreater(plan.compress_throughput, 0)
+        self.assertGreater(plan.estimated_seconds, 0)
+        self.assertTrue(plan.has_enough_space)
+        self.assertEqual(plan.dict()["locations"][0]["files"], 1)
+
+        with mock.patch.object(planner, "get_free_space", return_value=0):
+            plan = planner.plan_backup(
+                file_paths, [self.random_path], self.temp_dir_path / "backup.zip"
+            )
+        self.assertFalse(plan.has_enough_space)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import json
+import pstats
+import threading
+import unittest
+
+from macos_installation.classes.profiler import Profiler
+from tests import TestBase
+
+
+class TestProfiler(TestBase):
+    def test_disabled(self):
+        profiler = Profiler()
+        with profiler.phase("walk") as phase:
+            phase.files = 1
+        self.assertEqual(profiler.phases, [])
+
+    def test_phases(self):
+        profiler = Profiler()
+        profiler.start()
+        with profiler.phase("hash") as phase:
+            phase.files, phase.bytes = 2, 1024**2
+            with profiler.phase("kdf"):
+                pass
+        with profiler.phase("hash") as phase:
+            phase.files, phase.bytes = 1, 1024**2
+
+        def write():
+            with profiler.phase("write"):
+                pass
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        thread.join()
+        profiler.stop()
+
+        # Phases are recorded once they end, along with their thread
+        self.assertEqual(
+            [p.name for p in profiler.phases], ["kdf", "hash", "hash", "write"]
+        )
+        self.assertNotEqual(profiler.phases[0].thread_id, profiler.phases[3].thread_id)
+        summary = profiler.summary()
+        self.assertEqual([row[0] for row in summary], ["hash", "kdf", "write"])
+        self.assertEqual(summary[0][1], 2)
+        self.assertEqual(summary[0][3:5], [2 * 1024**2, 3])
+        self.assertEqual(summary[1][5], "N/A")
+
+        trace = json.loads(json.dumps(profiler.chrome_trace()))
+        events = trace["traceEvents"]
+        self.assertEqual(len(events), 4)
+        self.assertEqual({e["ph"] for e in events}, {"X"})
+        self.assertEqual(events[1]["args"]["files"], 2)
+        self.assertLessEqual(events[1]["ts"], events[0]["ts"])
+        self.assertGreater(events[1]["args"]["peak_rss"], 0)
+
+        # Phases recorded after the profiler stopped are ignored
+        with profiler.phase("walk"):
+            pass
+        self.assertEqual(len(profiler.phases), 4)
+
+    def test_cprofile(self):
+        profiler = Profiler()
+        profiler.start(cprofile=True)
+        sum(range(1000))
+        profiler.stop()
+
+        stats_path = self.temp_dir_path / "stats.prof"
+        profiler.write_cprofile(stats_path)
+        self.assertGreater(pstats.Stats(str(stats_path)).total_calls, 0)
+
+        # Without cProfile, no statistics are written
+        profiler.start()
+        profiler.stop()
+        profiler.write_cprofile(self.temp_dir_path / "none.prof")
+        self.assertFalse((self.temp_dir_path / "none.prof").exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
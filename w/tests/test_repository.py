@@ -0,0 +1,96 @@
+import unittest
+
+from macos_installation.classes.data import KDFParameters
+from macos_installation.classes.repository import ChunkRepository
+from tests import TestBase
+
+
+class TestChunkRepository(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.repository_path = self.temp_dir_path / "repository"
+        self.kdf = KDFParameters(n=2**14)
+
+    def test_write_restore_file(self):
+        repository = ChunkRepository(self.repository_path, create=True)
+        digest, chunk_references = repository.write_file(self.file1_path)
+        self.assertEqual(repository.new_chunks, 1)
+
+        # Identical contents are only stored once
+        self.file2_path.write_text(self.file1_content)
+        self.assertEqual(
+            repository.write_file(self.file2_path), (digest, chunk_references)
+        )
+        self.assertEqual((repository.new_chunks, repository.reused_chunks), (1, 1))
+
+        restored_path = self.temp_dir_path / "restored" / "file"
+        repository.restore_file(chunk_references, restored_path)
+        self.assertEqual(restored_path.read_text(), self.file1_content)
+
+    def test_encrypted_repository(self):
+        repository = ChunkRepository(
+            self.repository_path, "password", kdf=self.kdf, create=True
+        )
+        _, chunk_references = repository.write_file(self.file1_path)
+        repository.write_snapshot("snapshot", {}, {"file": chunk_references})
+
+        # Neither chunk IDs nor chunks reveal the contents
+        chunk_id, _ = chunk_references[0]
+        chunk_path = self.repository_path / "chunks" / chunk_id[:2] / chunk_id
+        self.assertNotEqual(
+            chunk_id,
+            ChunkRepository(self.temp_dir_path / "other", create=True).chunk_id(
+                self.file1_content.encode()
+            ),
+        )
+        self.assertNotIn(self.file1_content.encode(), chunk_path.read_bytes())
+
+        reopened = ChunkRepository(self.repository_path, "password")
+        self.assertEqual(
+            reopened.read_snapshot("snapshot")["files"]["file"],
+            [list(r) for r in chunk_references],
+        )
+        self.assertEqual(reopened.read_chunk(chunk_id), self.file1_content.encode())
+
+        for password in [None, "incorrect"]:
+            with self.assertRaises(SystemExit):
+                ChunkRepository(self.repository_path, password)
+
+    def test_missing_repository(self):
+        # Only backups create repositories
+        with self.assertRaises(SystemExit):
+            ChunkRepository(self.repository_path)
+        self.assertFalse(self.repository_path.exists())
+
+    def test_garbage_collect_statistics(self):
+        repository = ChunkRepository(self.repository_path, create=True)
+        files = {
+            str(p): repository.write_file(p)[1]
+            for p in [self.file1_path, self.file2_path]
+        }
+        repository.write_snapshot("first", {}, files)
+        repository.write_snapshot("second", {}, files)
+
+        # Chunks of an interrupted backup are not referenced by any snapshot
+        repository.write_file(self.file3_path)
+        self.assertEqual(repository.garbage_collect(dry_run=True)[0], 1)
+        self.assertEqual(repository.garbage_collect()[0], 1)
+        self.assertEqual(repository.garbage_collect()[0], 0)
+
+        # A running backup holds the lock, so its chunks cannot be collected
+        repository.write_file(self.file3_path)
+        with repository.lock():
+            self.assertEqual(repository.garbage_collect(dry_run=True)[0], 1)
+            with self.assertRaises(SystemExit):
+                repository.garbage_collect()
+        self.assertEqual(repository.garbage_collect()[0], 1)
+
+        statistics = repository.statistics()
+        self.assertEqual(statistics["snapshots"], 2)
+        self.assertEqual(statistics["chunks"], 2)
+        self.assertEqual(statistics["logical_size"], 2 * statistics["unique_size"])
+        self.assertEqual(statistics["dedup_ratio"], 2.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,9 @@
 import hashlib
+import os
 import pathlib
 import unittest
 from datetime import datetime
+from unittest import mock
 
 from macos_installation.functions import util
 from tests import TestBase
@@ -28,6 +30,47 @@ class TestCreateBackup(TestBase):
         self.assertTrue(expected_path.exists())
         self.assertEqual(expected_path, returned_path)
 
+    def test_create_backup_strategies(self):
+        for strategy in ["copy", "reflink", "hardlink"]:
+            backup_path = util.create_backup(
+                self.sub_dir_path, strategy, strategy=strategy
+            )
+            backup_file_path = backup_path / self.file4_path.name
+
+            self.assertEqual(backup_file_path.read_text(), self.file4_content)
+            self.assertEqual(
+                backup_file_path.stat().st_ino == self.file4_path.stat().st_ino,
+                strategy == "hardlink",
+            )
+            self.assertTrue(self.sub_dir_path.is_dir())
+
+        # Backing up again never writes through a hard link into the original
+        backup_path = util.create_backup(self.sub_dir_path, "hardlink", strategy="copy")
+        self.assertNotEqual(
+            (backup_path / self.file4_path.name).stat().st_ino,
+            self.file4_path.stat().st_ino,
+        )
+        self.assertEqual(self.file4_path.read_text(), self.file4_content)
+
+        with self.assertRaises(ValueError):
+            util.create_backup(self.sub_dir_path, strategy="unknown")
+
+    def test_create_backup_rename(self):
+        backup_path = util.create_backup(self.file1_path, "rename", strategy="rename")
+        self.assertFalse(self.file1_path.exists())
+        self.assertEqual(backup_path.read_text(), self.file1_content)
+
+        # A backup directory which already exists is merged into by copying
+        existing_path = pathlib.Path(f"{self.sub_dir_path}_rename")
+        existing_path.mkdir()
+        (existing_path / "existing").write_text("existing")
+        backup_path = util.create_backup(self.sub_dir_path, "rename", strategy="rename")
+        self.assertTrue(self.sub_dir_path.exists())
+        self.assertCountEqual(
+            [p.name for p in backup_path.iterdir()],
+            ["existing", self.file4_path.name, self.file5_path.name],
+        )
+
 
 class TestGetSHA256Hash(TestBase):
     def test_get_sha256_hash(self):
@@ -36,6 +79,42 @@ class TestGetSHA256Hash(TestBase):
             util.get_file_sha256_hash(pathlib.Path(self.file1.name)), expected_hash
         )
 
+    def test_get_sha256_hash_blocks(self):
+        content = TestBase.generate_random_string(10000).encode()
+        file_path = self.temp_dir_path / "blocks"
+        file_path.write_bytes(content)
+        expected_hash = hashlib.sha256(content).hexdigest()
+
+        # Partial last block, read from the file and from a memory map
+        for mmap_threshold in [len(content) + 1, 0]:
+            self.assertEqual(
+                util.get_file_sha256_hash(
+                    file_path, block_size=3000, mmap_threshold=mmap_threshold
+                ),
+                expected_hash,
+            )
+
+        # Empty files cannot be memory-mapped
+        empty_path = self.temp_dir_path / "empty"
+        empty_path.touch()
+        self.assertEqual(
+            util.get_file_sha256_hash(empty_path, mmap_threshold=0),
+            hashlib.sha256().hexdigest(),
+        )
+
+    def test_get_sha256_hashes(self):
+        file_paths = [self.file3_path, self.file1_path, self.file5_path]
+        contents = [self.file3_content, self.file1_content, self.file5_content]
+        expected_hashes = {
+            p: hashlib.sha256(c.encode()).hexdigest()
+            for p, c in zip(file_paths, contents)
+        }
+
+        for jobs in [1, 4]:
+            hashes = util.get_file_sha256_hashes(iter(file_paths), jobs=jobs)
+            self.assertEqual(hashes, expected_hashes)
+            self.assertEqual(list(hashes), file_paths)
+
 
 class TestGetRecursiveFileList(TestBase):
     def test_get_recursive_file_list(self):
@@ -52,6 +131,120 @@ class TestGetRecursiveFileList(TestBase):
         self.assertIn(self.file4_path, files)
         self.assertIn(self.file5_path, files)
 
+    def test_get_recursive_file_list_excludes(self):
+        git_dir = self.temp_dir_path / ".vim" / "pack" / "plugin" / ".git"
+        git_dir.mkdir(parents=True)
+        (git_dir / "HEAD").write_text("ref: refs/heads/main")
+        (git_dir.parent / "plugin.vim").write_text("set number")
+        (self.temp_dir_path / "file.swp").write_text("swap")
+
+        files = list(
+            util.get_recursive_file_list(
+                [self.temp_dir_path],
+                excludes=[".vim/**/.git", "*.swp", self.sub_dir_path.name],
+                base_dir=self.temp_dir_path,
+            )
+        )
+
+        self.assertEqual(
+            sorted(files),
+            sorted(
+                [
+                    self.file1_path,
+                    self.file2_path,
+                    self.file3_path,
+                    git_dir.parent / "plugin.vim",
+                ]
+            ),
+        )
+
+        # Included files are kept unless their directory was excluded
+        files = list(
+            util.get_recursive_file_list(
+                [self.temp_dir_path],
+                excludes=[".vim/**/.git"],
+                includes=["*.vim", "HEAD"],
+                base_dir=self.temp_dir_path,
+            )
+        )
+        self.assertEqual(files, [git_dir.parent / "plugin.vim"])
+
+    def test_get_recursive_file_list_order(self):
+        paths = [self.temp_dir_path]
+        self.assertEqual(
+            list(util.get_recursive_file_list(paths)),
+            sorted([self.file1_path, self.file2_path, self.file3_path])
+            + sorted([self.file4_path, self.file5_path]),
+        )
+
+    def test_get_recursive_file_list_special_files(self):
+        fifo_path = self.temp_dir_path / "fifo"
+        os.mkfifo(fifo_path)
+
+        files = list(util.get_recursive_file_list([self.temp_dir_path]))
+
+        self.assertEqual(len(files), 5)
+        self.assertNotIn(fifo_path, files)
+
+    def test_get_recursive_file_list_symlinks(self):
+        (self.temp_dir_path / "file_link").symlink_to(self.file1_path)
+        (self.sub_dir_path / "dir_link").symlink_to(self.temp_dir_path)
+        (self.temp_dir_path / "broken_link").symlink_to(self.temp_dir_path / "missing")
+
+        expected = {
+            "skip": 5,
+            "files": 6,
+            # The link cycle is only followed once
+            "follow": 6,
+        }
+        for policy, count in expected.items():
+            files = list(
+                util.get_recursive_file_list(
+                    [self.temp_dir_path], symlink_policy=policy
+                )
+            )
+            self.assertEqual(len(files), count, policy)
+
+        with self.assertRaises(ValueError):
+            list(util.get_recursive_file_list([self.temp_dir_path], symlink_policy="x"))
+
+    def test_translate_glob(self):
+        matches = util.compile_path_patterns(
+            [".vim/**/.git", "*.sw[!x]", "/etc/hosts"], base_dir="/home/user"
+        )
+
+        self.assertTrue(matches("/home/user/.vim/.git", ".git"))
+        self.assertTrue(matches("/home/user/.vim/pack/a/start/b/.git", ".git"))
+        self.assertFalse(matches("/home/user/.git", ".git"))
+        self.assertFalse(matches("/other/.vim/.git", ".git"))
+        self.assertTrue(matches("/home/user/.vimrc.swp", ".vimrc.swp"))
+        self.assertFalse(matches("/home/user/.vimrc.swx", ".vimrc.swx"))
+        self.assertTrue(matches("/etc/hosts", "hosts"))
+
+
+class TestAtomicWrite(TestBase):
+    def test_atomic_write(self):
+        # The umask is process-wide, so threads writing files never set it
+        with mock.patch("os.umask") as umask, util.atomic_write(self.file1_path) as f:
+            f.write(b"new")
+            # The file is only replaced once the block completes
+            self.assertNotEqual(self.file1_path.read_bytes(), b"new")
+        umask.assert_not_called()
+        self.assertEqual(self.file1_path.read_bytes(), b"new")
+        self.assertEqual(
+            self.file1_path.stat().st_mode & 0o777, 0o666 & ~util.get_umask()
+        )
+
+        with self.assertRaises(ValueError):
+            with util.atomic_write(self.file1_path) as f:
+                f.write(b"partial")
+                raise ValueError()
+        self.assertEqual(self.file1_path.read_bytes(), b"new")
+        self.assertEqual(
+            [p for p in self.file1_path.parent.iterdir() if p.name.startswith(".")],
+            [],
+        )
+
 
 class TestGetTerminalSize(unittest.TestCase):
     def test_get_terminal_size(self):
@@ -0,0 +1,158 @@
+import io
+import pathlib
+import zipfile
+from unittest import mock
+
+from macos_installation.classes.data import KDFParameters
+from macos_installation.classes.session import KeySession
+from macos_installation.classes.zip import InMemoryZip, MappedFile
+from macos_installation.functions import encryption
+from tests import TestBase
+
+
+class TestInMemoryZip(TestBase):
+    def test_spool_to_disk(self):
+        with InMemoryZip(
+            spool_threshold=1024, spool_dir=self.temp_dir_path
+        ) as zip_object:
+            with zip_object.open_zip_file(mode="a") as zip_file:
+                zip_file.writestr("small.txt", self.file1_content)
+            self.assertFalse(zip_object.zip_contents._rolled)
+
+            with zip_object.open_zip_file(mode="a") as zip_file:
+                zip_file.writestr(
+                    "large.txt",
+                    TestBase.generate_random_string(4096),
+                    compress_type=zipfile.ZIP_STORED,
+                )
+            self.assertTrue(zip_object.zip_contents._rolled)
+
+            archive_path = self.temp_dir_path / "archive.zip"
+            zip_object.write_to_file(archive_path)
+
+        with zipfile.ZipFile(archive_path) as zip_file:
+            self.assertEqual(zip_file.namelist(), ["small.txt", "large.txt"])
+
+    def test_existing_archive_is_mapped(self):
+        archive_path = self.temp_dir_path / "archive.zip"
+        with zipfile.ZipFile(archive_path, mode="w") as zip_file:
+            zip_file.write(self.file1_path)
+
+        with InMemoryZip(archive_path) as zip_object:
+            self.assertIsInstance(zip_object.zip_contents, MappedFile)
+            self.assertFalse(zip_object.is_encrypted)
+            self.assertEqual(zip_object.read(), archive_path.read_bytes())
+
+            with zip_object.open_zip_file(mode="r") as zip_file:
+                self.assertEqual(
+                    zip_file.read(str(self.file1_path).lstrip("/")).decode(),
+                    self.file1_content,
+                )
+
+            copy_path = pathlib.Path(f"{archive_path}.copy")
+            zip_object.write_to_file(copy_path)
+            self.assertEqual(copy_path.read_bytes(), archive_path.read_bytes())
+
+    def test_read_unencrypted_derives_key_once(self):
+        password = TestBase.generate_random_string(16)
+        archive_path = self.temp_dir_path / "archive.zip.enc"
+        with InMemoryZip(password=password) as zip_object:
+            with zip_object.open_zip_file(mode="a") as zip_file:
+                zip_file.writestr("file.txt", self.file1_content)
+            zip_object.encrypt()
+            zip_object.write_to_file(archive_path)
+
+        with mock.patch.object(
+            encryption, "generate_key", wraps=encryption.generate_key
+        ) as generate_key:
+            with InMemoryZip(archive_path, password) as zip_object:
+                encrypted_contents = zip_object.zip_contents
+                for _ in range(2):
+                    with zipfile.ZipFile(zip_object.read_unencrypted()) as zip_file:
+                        self.assertEqual(
+                            zip_file.read("file.txt").decode(), self.file1_content
+                        )
+
+                # The encrypted contents are not re-encrypted
+                self.assertTrue(zip_object.is_encrypted)
+                self.assertIs(zip_object.zip_contents, encrypted_contents)
+
+                zip_object.decrypt()
+                self.assertFalse(zip_object.is_encrypted)
+
+        self.assertEqual(generate_key.call_count, 1)
+
+    def test_read_unencrypted_corrupt(self):
+        key_session = KeySession("password", KDFParameters(n=2**14))
+
+        # A member whose data does not match its CRC
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            zip_file.writestr("file.txt", self.file1_content)
+        bad_crc = bytearray(archive.getvalue())
+        bad_crc[bad_crc.index(self.file1_content.encode())] ^= 1
+
+        cases = {
+            b"not an archive": "File 'archive.enc' is corrupt!",
+            bytes(bad_crc): "Bad CRC or file headers on 'archive.enc': file.txt",
+        }
+        archive_path = self.temp_dir_path / "archive.enc"
+        for contents, message in cases.items():
+            archive_path.write_bytes(encryption.encrypt_bytes(contents, key_session))
+            with InMemoryZip(archive_path, key_session) as zip_object, mock.patch(
+                "click.secho"
+            ) as secho, self.assertRaises(SystemExit):
+                zip_object.read_unencrypted()
+            secho.assert_called_once_with(message, fg="red")
+
+        # Truncated data is told apart from a wrong password
+        encrypted = encryption.encrypt_bytes(bytes(bad_crc), key_session)
+        cases = {
+            (encrypted[:-1], "password"): "File 'archive.enc' is corrupt or truncated!",
+            (encrypted, "wrong"): (
+                "Password for encrypted ZIP file 'archive.enc' was incorrect!"
+            ),
+        }
+        for (contents, password), message in cases.items():
+            archive_path.write_bytes(contents)
+            for read in ["read_unencrypted", "open_unencrypted"]:
+                session = KeySession(password, KDFParameters(n=2**14))
+                with InMemoryZip(archive_path, session) as zip_object, mock.patch(
+                    "click.secho"
+                ) as secho, self.assertRaises(SystemExit):
+                    getattr(zip_object, read)()
+                secho.assert_called_once_with(message, fg="red")
+
+    def test_is_encrypted(self):
+        password = TestBase.generate_random_string(16)
+        with InMemoryZip(password=password) as zip_object:
+            # Empty contents are not encrypted
+            self.assertFalse(zip_object.is_encrypted)
+
+            with zip_object.open_zip_file(mode="a") as zip_file:
+                zip_file.writestr("file.txt", self.file1_content)
+            self.assertFalse(zip_object.is_encrypted)
+            zip_object.encrypt()
+            self.assertTrue(zip_object.is_encrypted)
+            encrypted = zip_object.read()
+
+        # A corrupt archive is not mistaken for an encrypted one
+        corrupt_path = self.temp_dir_path / "corrupt.zip"
+        corrupt_path.write_bytes(b"PK\x03\x04" + bytes(100))
+        with InMemoryZip(corrupt_path) as zip_object:
+            self.assertFalse(zip_object.is_encrypted)
+
+        # Only headerless (legacy) contents are opened as an archive, and only once
+        cases = {
+            "encrypted": (encrypted, True, 0),
+            "legacy": (bytes(range(256)), True, 1),
+        }
+        for name, (contents, expected, zip_opens) in cases.items():
+            archive_path = self.temp_dir_path / name
+            archive_path.write_bytes(contents)
+            with InMemoryZip(archive_path) as zip_object, mock.patch.object(
+                zipfile, "ZipFile", wraps=zipfile.ZipFile
+            ) as zip_file_class:
+                for _ in range(2):
+                    self.assertEqual(zip_object.is_encrypted, expected, name)
+                self.assertEqual(zip_file_class.call_count, zip_opens, name)